@@ -1,36 +1,324 @@
-from flask import Flask, render_template, request, redirect, url_for, session, flash, g
-import sqlite3
+from flask import Flask, render_template, request, redirect, url_for, session, flash, g, jsonify, Response
+from markupsafe import Markup
 import click
-from werkzeug.security import generate_password_hash, check_password_hash #for authentication
-from models.database import init_db, get_db_connection, DATABASE
+from werkzeug.security import check_password_hash #for authentication
+from models.database import (init_db, init_app, get_db, get_db_connection, get_pool, DATABASE, POOL_SIZE,
+                             DEFAULT_ADMIN_PASSWORD, DEFAULT_ADMIN_USERNAME, DatabaseError, IntegrityError, migrate)
+from models import repository as repo
+from models.allocator import get_allocator, AllocationError
+from models.slots import MAX_SLOT_SECONDS, get_slot_allocator
+from models.user_cache import get_user_cache, USER_CACHE_SIZE, USER_CACHE_TTL
+from models.passwords import (DEFAULT_HASH_METHOD, LOGIN_MAX_FAILURES_PER_IP, LOGIN_MAX_FAILURES_PER_USER,
+                              LOGIN_WINDOW_SECONDS, get_login_throttle, hash_password, method_prefix, needs_rehash)
+from models.timefmt import format_local, now_epoch, parse_local
+from models.stats import get_summary, hourly_series
+from models.listings import list_lots, list_users
+from models.versions import get_change_tracker
+from models.events import get_event_broker, lot_event
+from models.billing import Tariff, compute_cost, recompute_costs
+from models.archive import ARCHIVE_AFTER_DAYS, ARCHIVE_BATCH_SIZE, archive_completed, history_page, user_summary
+from models.exports import EXPORT_FORMATS, REPORTS, stream_report
+from models.provisioning import provision_spots, resize_spots
+from models.lots import insert_lot, parse_lot_form, read_coordinates, read_max_stay, read_tariff_form
+from models.geo import NEAREST_DEFAULT, NEAREST_MAX, get_lot_index
+from models.fragments import FRAGMENT_CACHE_BYTES, get_fragment_cache
+from models import loadtest, profiling
+from models import server
+from models.overstay import OVERSTAY_BATCH_SIZE, OVERSTAY_CHECK_SECONDS, release_overstays, start_overstay_scheduler
+from models.importer import IMPORT_BATCH_LOTS, IMPORT_FORMATS, guess_format, import_lots, read_records
 import os
 import functools
-from datetime import datetime, timedelta
+import ipaddress
 import math
+import zlib
+from datetime import datetime
+import time
 import pytz 
 
 # INITIAL CONFIGURATION
 app = Flask(__name__)
-app.config['SECRET_KEY'] = os.urandom(24) 
+# set SECRET_KEY in production; the random fallback is per start, so sessions end on restart
+app.config['SECRET_KEY'] = os.environ.get('SECRET_KEY') or os.urandom(24)
 app.config['SESSION_COOKIE_SECURE'] = False 
 app.config['SESSION_COOKIE_HTTPONLY'] = True
 app.config['SESSION_COOKIE_SAMESITE'] = 'Lax'
+app.config['DATABASE'] = DATABASE
+# the admin account init-db creates (the load test logs in with it too)
+app.config['ADMIN_USERNAME'] = os.environ.get('ADMIN_USERNAME', DEFAULT_ADMIN_USERNAME)
+app.config['ADMIN_PASSWORD'] = os.environ.get('ADMIN_PASSWORD', DEFAULT_ADMIN_PASSWORD)
+app.config['USER_CACHE_SIZE'] = USER_CACHE_SIZE
+app.config['USER_CACHE_TTL'] = USER_CACHE_TTL
+app.config['FRAGMENT_CACHE_BYTES'] = int(os.environ.get('FRAGMENT_CACHE_BYTES', FRAGMENT_CACHE_BYTES))
+# password hashing cost (any werkzeug method string) and failed-login throttling
+app.config['PASSWORD_HASH_METHOD'] = os.environ.get('PASSWORD_HASH_METHOD', DEFAULT_HASH_METHOD)
+method_prefix(app.config['PASSWORD_HASH_METHOD'])  # fail at startup on a bad method
+app.config['LOGIN_WINDOW_SECONDS'] = LOGIN_WINDOW_SECONDS
+app.config['LOGIN_MAX_FAILURES_PER_USER'] = LOGIN_MAX_FAILURES_PER_USER
+app.config['LOGIN_MAX_FAILURES_PER_IP'] = LOGIN_MAX_FAILURES_PER_IP
+# per-request query timing and /metrics; costs nothing when off
+app.config['QUERY_PROFILING'] = os.environ.get('QUERY_PROFILING') == '1'
+app.config['SLOW_QUERY_MS'] = float(os.environ.get('SLOW_QUERY_MS', profiling.SLOW_QUERY_MS))
+# /metrics is for admins, plus scrapers from these comma-separated addresses or networks (e.g. 10.0.0.5,127.0.0.1/32)
+app.config['METRICS_ALLOWED_ADDRS'] = [ipaddress.ip_network(addr.strip(), strict=False)
+                                       for addr in os.environ.get('METRICS_ALLOWED_ADDRS', '').split(',') if addr.strip()]
+# seconds between overstay sweeps in served workers (0 turns the scheduler off)
+app.config['OVERSTAY_CHECK_SECONDS'] = float(os.environ.get('OVERSTAY_CHECK_SECONDS', OVERSTAY_CHECK_SECONDS))
+init_app(app)
+profiling.init_app(app)
 
 @app.cli.command('init-db')
 def init_db_command():
     """Clear existing data and create new tables."""
-    init_db()
+    init_db(app.config['DATABASE'])
+    user_cache().clear()
     click.echo('Initialized the database.')
 
+@app.cli.command('migrate-db')
+def migrate_db_command():
+    """Upgrade an existing database to the latest schema version without dropping data."""
+    conn = get_db_connection(app.config['DATABASE'])
+    version = migrate(conn, verbose=True)
+    conn.close()
+    click.echo(f'Database is at schema version {version}.')
+
+@app.cli.command('recompute-costs')
+@click.option('--lot-id', type=int, default=None, help='Only re-bill reservations of this lot.')
+@click.option('--dry-run', is_flag=True, help='Report what would change without writing.')
+def recompute_costs_command(lot_id, dry_run):
+    """Re-bill completed reservations with each lot's current tariff."""
+    conn = get_db_connection(app.config['DATABASE'])
+    started = time.perf_counter()
+    seen, changed = recompute_costs(conn, lot_id, dry_run=dry_run)
+    elapsed = time.perf_counter() - started
+    conn.close()
+    rate = seen / elapsed if elapsed else 0
+    click.echo(f"{seen} reservations re-billed, {changed} {'would change' if dry_run else 'changed'} "
+               f"({elapsed:.2f}s, {rate:,.0f} reservations/second).")
+
+@app.cli.command('archive-reservations')
+@click.option('--older-than-days', type=int, default=ARCHIVE_AFTER_DAYS, show_default=True,
+              help='Archive completed reservations that ended more than this many days ago.')
+@click.option('--batch-size', type=int, default=ARCHIVE_BATCH_SIZE, show_default=True)
+def archive_reservations_command(older_than_days, batch_size):
+    """Move old completed reservations into the archive table in small batches."""
+    conn = get_db_connection(app.config['DATABASE'])
+    moved = archive_completed(conn, older_than_days, batch_size)
+    conn.close()
+    click.echo(f'Archived {moved} reservations.')
+
+@app.cli.command('export-report')
+@click.argument('report', type=click.Choice(sorted(REPORTS)))
+@click.option('--format', 'fmt', type=click.Choice(sorted(EXPORT_FORMATS)), default='csv', show_default=True)
+@click.option('--lot-id', type=int, default=None, help='Only export this lot.')
+@click.option('--output', type=click.File('w'), default='-', help='File to write (default: stdout).')
+def export_report_command(report, fmt, lot_id, output):
+    """Stream reservations, daily revenue per lot or hourly utilization as CSV or NDJSON."""
+    conn = get_db_connection(app.config['DATABASE'])
+    try:
+        for chunk in stream_report(conn, report, fmt, lot_id):
+            output.write(chunk)
+    finally:
+        conn.close()
+
+@app.cli.command('import-lots')
+@click.argument('file', type=click.File('r', encoding='utf-8-sig'))
+@click.option('--format', 'fmt', type=click.Choice(IMPORT_FORMATS), default=None,
+              help='File format (default: from the file extension).')
+@click.option('--batch-size', type=int, default=IMPORT_BATCH_LOTS, show_default=True, help='Lots per transaction.')
+def import_lots_command(file, fmt, batch_size):
+    """Bulk-create parking lots and their spots from a CSV, NDJSON or JSON file."""
+    conn = get_db_connection(app.config['DATABASE'])
+    started = time.perf_counter()
+    try:
+        lots, spots, errors = import_lots(conn, read_records(file, fmt or guess_format(file.name)), batch_size)
+    except ValueError as e:
+        raise click.ClickException(str(e))
+    finally:
+        conn.close()
+    for ref, error in errors:
+        click.echo(f'Row {ref}: {error}', err=True)
+    click.echo(f'Imported {lots} lots with {spots} spots in {time.perf_counter() - started:.2f}s; '
+               f'{len(errors)} rows rejected.')
+
+@app.cli.command('loadtest')
+@click.option('--lots', type=int, default=20, show_default=True)
+@click.option('--spots-per-lot', type=int, default=50, show_default=True)
+@click.option('--users', type=int, default=500, show_default=True)
+@click.option('--history', type=int, default=20000, show_default=True, help='Completed reservations to seed.')
+@click.option('--workers', type=int, default=8, show_default=True, help='Concurrent client threads.')
+@click.option('--seconds', type=float, default=10.0, show_default=True)
+@click.option('--http', is_flag=True, help='Go through a local threaded WSGI server instead of the test client.')
+@click.option('--output', type=click.Path(dir_okay=False), default=None, help='Write the results as JSON.')
+@click.option('--baseline', type=click.Path(exists=True, dir_okay=False), default=None,
+              help='Earlier --output file; fail if a route\'s p95 got slower than --tolerance allows.')
+@click.option('--tolerance', type=float, default=0.2, show_default=True)
+@click.option('--admin-password', default=None, help='Password for the seeded admin (default: ADMIN_PASSWORD).')
+def loadtest_command(lots, spots_per_lot, users, history, workers, seconds, http, output, baseline, tolerance,
+                     admin_password):
+    """Benchmark register/login/book/release and both dashboards on a throwaway database."""
+    import json
+    import tempfile
+
+    configured = app.config['DATABASE']
+    admin_password = admin_password or app.config['ADMIN_PASSWORD']
+    database = os.path.join(tempfile.mkdtemp(), 'loadtest.db')
+    init_db(database, admin_password)
+    lot_ids, usernames = loadtest.seed(database, lots, spots_per_lot, users, history)
+    app.config['DATABASE'] = database
+    try:
+        result = loadtest.run(app, lot_ids, usernames, workers, seconds, http,
+                              admin_password=admin_password)
+    finally:
+        app.config['DATABASE'] = configured
+    result['config'] = {'lots': lots, 'spots_per_lot': spots_per_lot, 'users': users, 'history': history,
+                        'workers': workers, 'transport': 'http' if http else 'test_client'}
+    click.echo(loadtest.format_table(result))
+    if output:
+        with open(output, 'w') as f:
+            json.dump(result, f, indent=2)
+    if baseline:
+        slower = loadtest.compare(result, loadtest.load_result(baseline), tolerance)
+        for route, before, after in slower:
+            click.echo(f'{route}: p95 {before} ms -> {after} ms', err=True)
+        if slower:
+            raise click.ClickException(f'{len(slower)} route(s) slower than the baseline.')
+
+@app.cli.command('release-overstays')
+@click.option('--batch-size', type=int, default=OVERSTAY_BATCH_SIZE, show_default=True, help='Reservations per transaction.')
+def release_overstays_command(batch_size):
+    """Release active reservations that are past their lot's maximum stay, once."""
+    conn = get_db_connection(app.config['DATABASE'])
+    try:
+        released = release_overstays(conn, spot_allocator(), batch_size=batch_size)
+    finally:
+        conn.close()
+    click.echo(f'Released {len(released)} overstayed reservations.')
+
+@app.cli.command('serve')
+@click.option('--host', default='127.0.0.1', show_default=True)
+@click.option('--port', type=int, default=8000, show_default=True)
+@click.option('--workers', type=int, default=server.DEFAULT_WORKERS, show_default=True, help='Forked worker processes.')
+@click.option('--threads', type=int, default=server.DEFAULT_THREADS, show_default=True, help='Request threads per worker.')
+def serve_command(host, port, workers, threads):
+    """Run the app for production: pre-forked workers, each with a pool of request threads."""
+    try:
+        version = server.check_schema(app.config['DATABASE'])
+    except server.SchemaError as e:
+        raise click.ClickException(str(e))
+    if not os.environ.get('SECRET_KEY'):
+        click.echo('Warning: SECRET_KEY is not set; sessions will not survive a restart.', err=True)
+    click.echo(f"Database {app.config['DATABASE']} is at schema version {version}.")
+    server.serve(app, functools.partial(warm_up, threads), host, port, workers, threads)
+
+def warm_up(threads=server.DEFAULT_THREADS):
+    """Fills this process's connection pool and loads the in-process caches before serving."""
+    get_pool(app.config['DATABASE'], max(threads, POOL_SIZE)).fill(threads)
+    with app.app_context():
+        change_tracker()
+        lot_index()
+        for name in app.jinja_env.list_templates(extensions=['html']):
+            app.jinja_env.get_template(name)
+    start_overstays()
+
+def start_overstays():
+    if app.config['OVERSTAY_CHECK_SECONDS'] > 0:
+        start_overstay_scheduler(app.config['DATABASE'], spot_allocator(), app.config['OVERSTAY_CHECK_SECONDS'],
+                                 overstays_released, app.logger)
+
+def overstays_released(closed):
+    """Tells this process's caches and event streams about reservations the overstay sweep closed."""
+    with app.app_context():
+        for _, spot_id, lot_id in closed:
+            slot_allocator().set_occupied(lot_id, spot_id, False)
+            publish_occupancy(lot_id, delta=-1, spot_id=spot_id, spot_status='Available')
+    get_change_tracker(app.config['DATABASE']).mark_dirty()
+    get_lot_index(app.config['DATABASE']).mark_dirty()
+
 @app.before_request
 def load_logged_in_user():
+    if request.endpoint == 'static':
+        return
     user_id = session.get('user_id')
     if user_id is None:
         g.user = None 
     else:
-        conn = get_db_connection()
-        g.user = conn.execute('SELECT * FROM users WHERE id = ?', (user_id,)).fetchone()
-        conn.close()
+        # cache hits cost no query; the connection is only checked out on a miss
+        cache = user_cache()
+        g.user = cache.get(user_id)
+        if g.user is None:
+            g.user = repo.get_user(get_db(), user_id)
+            if g.user is not None:
+                cache.put(user_id, g.user)
+
+@app.after_request
+def mark_changes(response):
+    # anything that isn't a read may have written; let the tracker look again on the next read
+    if request.method not in ('GET', 'HEAD', 'OPTIONS'):
+        get_change_tracker(app.config['DATABASE']).mark_dirty()
+        get_lot_index(app.config['DATABASE']).mark_dirty()
+    return response
+
+def change_tracker():
+    tracker = get_change_tracker(app.config['DATABASE'])
+    tracker.sync(get_db)
+    return tracker
+
+def lot_index():
+    index = get_lot_index(app.config['DATABASE'])
+    index.sync(get_db)
+    return index
+
+def nearest_lots(lat, lng, k):
+    """The k nearest lots with a free spot as (lot row, distance km) pairs, closest first."""
+    found = lot_index().nearest(lat, lng, k)
+    distances = {lot_id: distance for distance, lot_id, _ in found}
+    lots = repo.get_lots(get_db(), [lot_id for _, lot_id, _ in found])
+    return [(lot, distances[lot['id']]) for lot in lots]
+
+def publish_occupancy(lot_id, delta=0, spot_id=None, spot_number=None, spot_status=None):
+    """Broadcasts a lot's occupancy after a committed change to every open event stream."""
+    lot = repo.get_lot(get_db(), lot_id)
+    if lot is None:
+        return
+    event_broker().publish(lot_event(lot, delta, spot_id, spot_number, spot_status), lot['version'])
+
+def event_broker():
+    return get_event_broker(app.config['DATABASE'], app.logger)
+
+def spot_allocator():
+    return get_allocator(app.config['DATABASE'])
+
+def slot_allocator():
+    return get_slot_allocator(app.config['DATABASE'])
+
+def invalidate_allocators(lot_id):
+    """Drops both allocators' view of a lot after an admin changed its spots."""
+    spot_allocator().invalidate(lot_id)
+    slot_allocator().invalidate(lot_id)
+
+def user_cache():
+    return get_user_cache(app.config['DATABASE'], app.config['USER_CACHE_SIZE'], app.config['USER_CACHE_TTL'])
+
+def fragment_cache():
+    return get_fragment_cache(app.config['DATABASE'], app.config['FRAGMENT_CACHE_BYTES'])
+
+def cached_fragment(key, version, template, build):
+    """template rendered for key as of version, from the fragment cache when it's there.
+
+    build() returns the template context and only runs on a miss, so a hit skips the
+    queries as well as the rendering. A version of None (unknown to the change tracker) is never cached.
+    """
+    cache = fragment_cache()
+    html = cache.get(key, version) if version is not None else None
+    if html is None:
+        html = render_template(template, **build())
+        if version is not None:
+            cache.put(key, version, html)
+    return Markup(html)
+
+def login_throttle():
+    return get_login_throttle(app.config['DATABASE'], app.config['LOGIN_WINDOW_SECONDS'],
+                              app.config['LOGIN_MAX_FAILURES_PER_USER'], app.config['LOGIN_MAX_FAILURES_PER_IP'])
 
 def admin_required(f):
     @functools.wraps(f)
@@ -50,6 +338,8 @@ def login_required(f):
         return f(*args, **kwargs)
     return decorated_function
 
+HISTORY_PAGE_SIZE = 20
+
 #ROUTES
 
 @app.route('/')
@@ -71,27 +361,19 @@ def register():
         elif not email:
             error = 'Email is required.'
 
-        conn = get_db_connection()
+        conn = get_db()
         if error is None:
             try:
-                existing_user = conn.execute(
-                    'SELECT id FROM users WHERE username = ? OR email = ?', (username, email)
-                ).fetchone()
-                if existing_user:
+                if repo.user_exists(conn, username, email):
                     error = f"User '{username}' or email '{email}' already exists."
                 else:
-                    conn.execute(
-                        "INSERT INTO users (username, password_hash, email, role) VALUES (?, ?, ?, ?)",
-                        (username, generate_password_hash(password), email, 'user')
-                    )
+                    repo.create_user(conn, username, hash_password(password, app.config['PASSWORD_HASH_METHOD']), email)
                     conn.commit()
                     flash('Registration successful! Please log in.', 'success')
                     return redirect(url_for('login'))
-            except sqlite3.Error as e:
+            except DatabaseError as e:
                 error = f"Database error: {e}"
                 conn.rollback()
-            finally:
-                conn.close()
 
         flash(error, 'danger')
     return render_template('register.html')
@@ -104,11 +386,15 @@ def login():
         password = request.form['password']
         error = None
 
-        conn = get_db_connection()
-        user = conn.execute(
-            'SELECT * FROM users WHERE username = ?', (username,)
-        ).fetchone()
-        conn.close()
+        # throttled before the lookup and the (deliberately slow) hash check
+        throttle = login_throttle()
+        wait = throttle.retry_after(username, request.remote_addr)
+        if wait:
+            flash(f'Too many failed login attempts. Try again in {int(wait) + 1} seconds.', 'danger')
+            return render_template('login.html'), 429
+
+        conn = get_db()
+        user = repo.get_user_by_username(conn, username)
 
         if user is None:
             error = 'Incorrect username.'
@@ -116,15 +402,25 @@ def login():
             error = 'Incorrect password.'
 
         if error is None:
+            throttle.succeeded(username)
             session.clear()
             session['user_id'] = user['id']
             session['role'] = user['role']
+            method = app.config['PASSWORD_HASH_METHOD']
+            if needs_rehash(user['password_hash'], method):
+                # hashing settings changed since this password was stored; upgrade it while we have it
+                repo.set_password_hash(conn, user['id'], hash_password(password, method))
+                conn.commit()
+                user_cache().invalidate(user['id'])
+            else:
+                user_cache().put(user['id'], user)
             flash('Logged in successfully!', 'success')
             if user['role'] == 'admin':
                 return redirect(url_for('admin_dashboard'))
             else:
                 return redirect(url_for('user_dashboard'))
 
+        throttle.failed(username, request.remote_addr)
         flash(error, 'danger')
     return render_template('login.html')
 
@@ -138,70 +434,76 @@ def logout():
 @app.route('/admin_dashboard')
 @admin_required
 def admin_dashboard():
-    conn = get_db_connection()
-    parking_lots = conn.execute('SELECT * FROM parking_lots ORDER BY prime_location_name').fetchall()
-    
-    users = conn.execute('SELECT id, username, email, role, created_at FROM users ORDER BY username').fetchall()
-    #summary chart attributes
-    total_lots = len(parking_lots)
-    total_max_spots = sum(lot['maximum_number_of_spots'] for lot in parking_lots)
-    total_occupied_spots = sum(lot['current_occupied_spots'] for lot in parking_lots)
-
-    conn.close()
-    return render_template('admin_dashboard.html',
-                           parking_lots=parking_lots,
-                           users=users,
-                           total_lots=total_lots,
-                           total_max_spots=total_max_spots,
-                           total_occupied_spots=total_occupied_spots) 
+    def build():
+        conn = get_db()
+        args = request.args
+        lot_q = args.get('lot_q', '').strip()
+        user_q = args.get('user_q', '').strip()
+        parking_lots, lots_prev, lots_next = list_lots(conn, lot_q, args.get('lot_after'), args.get('lot_before'))
+        users, users_prev, users_next = list_users(conn, user_q, args.get('user_after'), args.get('user_before'))
+
+        # each pager keeps the other listing's position and both search boxes
+        page_state = {key: value for key, value in args.items() if value}
+        def page_url(prefix, after=None, before=None):
+            state = {k: v for k, v in page_state.items() if k not in (f'{prefix}_after', f'{prefix}_before')}
+            if after is not None:
+                state[f'{prefix}_after'] = after
+            if before is not None:
+                state[f'{prefix}_before'] = before
+            return url_for('admin_dashboard', **state)
+        #summary chart attributes, read from the trigger-maintained summary tables
+        summary = get_summary(conn)
+        hourly = hourly_series(conn)
+        charts = {
+            'hours': format_local([row['hour_epoch'] for row in hourly], fmt='%H:%M'),
+            'revenue': [round(row['revenue'], 2) for row in hourly],
+            'utilization': [row['utilization'] or 0 for row in hourly],
+            'lots': [lot['prime_location_name'] for lot in parking_lots],
+            'occupied': [lot['current_occupied_spots'] for lot in parking_lots],
+            'free': [lot['maximum_number_of_spots'] - lot['current_occupied_spots'] for lot in parking_lots],
+        }
+
+        return dict(
+            parking_lots=parking_lots,
+            users=users,
+            lot_q=lot_q,
+            user_q=user_q,
+            lots_prev_url=page_url('lot', before=lots_prev) if lots_prev is not None else None,
+            lots_next_url=page_url('lot', after=lots_next) if lots_next is not None else None,
+            users_prev_url=page_url('user', before=users_prev) if users_prev is not None else None,
+            users_next_url=page_url('user', after=users_next) if users_next is not None else None,
+            total_lots=summary['total_lots'],
+            total_max_spots=summary['total_spots'],
+            total_occupied_spots=summary['occupied_spots'],
+            total_revenue=summary['total_revenue'],
+            charts=charts)
+
+    if session.get('_flashes'):
+        return render_template('admin_dashboard.html', **build())
+    # no messages to show, so the whole page is the same for this admin and query until something
+    # changes; the hour is part of the version because the chart window moves with it
+    return cached_fragment(('admin_dashboard', g.user['id'], request.query_string),
+                           (change_tracker().seq, int(time.time()) // 3600), 'admin_dashboard.html', build)
 
 @app.route('/admin/parking_lots/add', methods=('GET', 'POST'))
 @admin_required
 def add_parking_lot():
     if request.method == 'POST':
-        name = request.form['prime_location_name']
-        address = request.form['address']
-        pin_code = request.form['pin_code']
-        price_per_hour = request.form['price_per_hour']
-        max_spots = request.form['maximum_number_of_spots']
-        error = None
-
-        if not name or not address or not pin_code or not price_per_hour or not max_spots:
-            error = 'All fields are required.'
+        lot, error = parse_lot_form(request.form)
 
-        try:
-            price_per_hour = float(price_per_hour)
-            max_spots = int(max_spots)
-            if max_spots <= 0 or price_per_hour < 0:
-                error = 'Maximum spots must be positive and price cannot be negative.'
-
-        except ValueError:
-            error = 'Price per hour and maximum spots must be valid numbers.'
-
-        conn = get_db_connection()
         if error is None:
+            conn = get_db()
             try:
-                # Insert parking lot
-                conn.execute(
-                    "INSERT INTO parking_lots (prime_location_name, address, pin_code, price_per_hour, maximum_number_of_spots) VALUES (?, ?, ?, ?, ?)",
-                    (name, address, pin_code, price_per_hour, max_spots)
-                )
-                lot_id = conn.execute('SELECT id FROM parking_lots WHERE prime_location_name = ?', (name,)).fetchone()['id']
-                # Initialize spots for this lot
-                for i in range(1, max_spots + 1):
-                    spot_number = f"S{i}"
-                    conn.execute(
-                        "INSERT INTO parking_spots (lot_id, spot_number, status) VALUES (?, ?, ?)",
-                        (lot_id, spot_number, 'Available')
-                    )
+                lot_id = insert_lot(conn, lot)
+                # Initialize spots for this lot in one executemany
+                provision_spots(conn, lot_id, 1, lot['maximum_number_of_spots'], lot['spot_name_template'],
+                                lot['spots_per_level'], lot['spots_per_row'])
                 conn.commit()
                 flash('Parking Lot added successfully!', 'success')
                 return redirect(url_for('admin_dashboard'))
-            except sqlite3.IntegrityError:
-                error = f"A parking lot named '{name}' already exists."
+            except IntegrityError:
+                error = f"A parking lot named '{lot['prime_location_name']}' already exists."
                 conn.rollback()
-            finally:
-                conn.close()
 
         flash(error, 'danger')
     return render_template('add_parking_lot.html')
@@ -209,12 +511,11 @@ def add_parking_lot():
 @app.route('/admin/parking_lots/edit/<int:lot_id>', methods=('GET', 'POST'))
 @admin_required
 def edit_parking_lot(lot_id):
-    conn = get_db_connection()
-    parking_lot = conn.execute('SELECT * FROM parking_lots WHERE id = ?', (lot_id,)).fetchone()
+    conn = get_db()
+    parking_lot = repo.get_lot(conn, lot_id)
 
     if parking_lot is None:
         flash('Parking Lot not found.', 'danger')
-        conn.close()
         return redirect(url_for('admin_dashboard'))
 
     if request.method == 'POST':
@@ -235,90 +536,96 @@ def edit_parking_lot(lot_id):
         except ValueError:
             error = 'Price per hour and maximum spots must be valid numbers.'
 
+        if error is None:
+            tariff, error = read_tariff_form(request.form)
+
+        if error is None:
+            coordinates, error = read_coordinates(request.form)
+
+        if error is None:
+            max_stay_hours, error = read_max_stay(request.form)
+
         if error is None:
             try:
-                conn.execute(
-                    "UPDATE parking_lots SET prime_location_name = ?, address = ?, pin_code = ?, price_per_hour = ?, maximum_number_of_spots = ?, updated_at = CURRENT_TIMESTAMP WHERE id = ?",
-                    (name, address, pin_code, price_per_hour, max_spots, lot_id)
-                )
-                conn.commit()
-                flash('Parking Lot updated successfully!', 'success')
-                return redirect(url_for('admin_dashboard'))
-            except sqlite3.IntegrityError:
+                # the spot rows follow the new capacity in the same transaction
+                repo.begin_write(conn)
+                error = resize_spots(conn, parking_lot, max_spots)
+                if error is None:
+                    repo.update_lot(conn, lot_id, name, address, pin_code, price_per_hour, max_spots, tariff, coordinates,
+                                    max_stay_hours)
+                    conn.commit()
+                    invalidate_allocators(lot_id)
+                    flash('Parking Lot updated successfully!', 'success')
+                    return redirect(url_for('admin_dashboard'))
+                conn.rollback()
+            except IntegrityError:
                 error = f"A parking lot named '{name}' already exists."
                 conn.rollback()
-            finally:
-                conn.close()
         
         flash(error, 'danger')
     
-    conn.close()
     return render_template('edit_parking_lot.html', parking_lot=parking_lot)
 
 
 @app.route('/admin/parking_lots/delete/<int:lot_id>', methods=('POST',))
 @admin_required
 def delete_parking_lot(lot_id):
-    conn = get_db_connection()
+    conn = get_db()
     error = None
     
-    active_reservations_count = conn.execute('''
-        SELECT COUNT(pr.id)
-        FROM parking_reservations pr
-        JOIN parking_spots ps ON pr.spot_id = ps.id
-        WHERE ps.lot_id = ? AND pr.is_active = 1
-    ''', (lot_id,)).fetchone()[0]
-
-    if active_reservations_count > 0:
+    if repo.count_active_in_lot(conn, lot_id) > 0:
         error = 'Cannot delete parking lot. There are active parked vehicles in this lot.'
+    elif repo.lot_has_upcoming_slot(conn, lot_id, now_epoch()):
+        error = 'Cannot delete parking lot. Users have upcoming advance bookings in this lot.'
 
     if error is None:
         try:
-            conn.execute('DELETE FROM parking_lots WHERE id = ?', (lot_id,))
-            conn.commit()
-            flash('Parking Lot deleted successfully!', 'success')
-        except sqlite3.Error as e:
+            repo.begin_write(conn)
+            if repo.delete_lot(conn, lot_id):
+                conn.commit()
+                invalidate_allocators(lot_id)
+                flash('Parking Lot deleted successfully!', 'success')
+            else:
+                # booked between the checks above and taking the write lock
+                conn.rollback()
+                error = 'Cannot delete parking lot. A spot in it was booked just now.'
+        except DatabaseError as e:
             error = f"Database error: {e}"
             conn.rollback()
-        finally:
-            conn.close()
     
     if error:
         flash(error, 'danger')
-        conn.close()
     return redirect(url_for('admin_dashboard'))
 
 @app.route('/admin/parking_lots/manage_spots/<int:lot_id>')
 @admin_required
 def manage_spots(lot_id):
-    conn = get_db_connection()
-    parking_lot = conn.execute('SELECT * FROM parking_lots WHERE id = ?', (lot_id,)).fetchone()
+    conn = get_db()
+    parking_lot = repo.get_lot(conn, lot_id)
     if parking_lot is None:
         flash('Parking Lot not found.', 'danger')
-        conn.close()
         return redirect(url_for('admin_dashboard'))
     
-    spots = conn.execute('SELECT * FROM parking_spots WHERE lot_id = ? ORDER BY CAST(SUBSTR(spot_number, 2) AS INTEGER)', (lot_id,)).fetchall()
+    # spot inserts, updates and deletes all bump the lot's version
+    spot_table = cached_fragment(('spots', lot_id), change_tracker().lot_version(lot_id), 'spot_table.html',
+                                 lambda: {'parking_lot': parking_lot, 'spots': repo.lot_spots(conn, lot_id)})
     
-    conn.close()
     flash('This is the "Manage Spots" page. Functionality to add/view/edit individual spots for this lot would go here.', 'info')
-    return render_template('manage_spots.html', parking_lot=parking_lot, spots=spots)
+    return render_template('manage_spots.html', parking_lot=parking_lot, spot_table=spot_table)
 
 @app.route('/admin/parking_spots/edit/<int:spot_id>', methods=('GET', 'POST'))
 @admin_required
 def edit_spot(spot_id):
-    conn = get_db_connection()
-    spot = conn.execute('SELECT * FROM parking_spots WHERE id = ?', (spot_id,)).fetchone()
+    conn = get_db()
+    spot = repo.get_spot(conn, spot_id)
 
     if spot is None:
         flash('Parking spot not found.', 'danger')
-        conn.close()
         return redirect(url_for('admin_dashboard'))
 
-    parking_lot = conn.execute('SELECT prime_location_name FROM parking_lots WHERE id = ?', (spot['lot_id'],)).fetchone()
+    parking_lot = repo.get_lot(conn, spot['lot_id'])
     if parking_lot is None: 
         flash('Associated parking lot not found.', 'danger')
-        conn.close()
         return redirect(url_for('admin_dashboard'))
 
     if request.method == 'POST':
@@ -332,92 +639,69 @@ def edit_spot(spot_id):
             error = 'Invalid status selected.'
 
         if error is None and new_spot_number != spot['spot_number']:
-            existing_spot_with_new_name = conn.execute(
-                'SELECT id FROM parking_spots WHERE lot_id = ? AND spot_number = ?',
-                (spot['lot_id'], new_spot_number)
-            ).fetchone()
-            if existing_spot_with_new_name:
+            if repo.spot_number_taken(conn, spot['lot_id'], new_spot_number):
                 error = f"Spot number '{new_spot_number}' already exists in this parking lot."
         
         
         if error is None and spot['status'] == 'Occupied' and new_status == 'Available':
-            active_reservation_check = conn.execute(
-                'SELECT id FROM parking_reservations WHERE spot_id = ? AND is_active = 1',
-                (spot_id,)
-            ).fetchone()
-            if active_reservation_check:
+            if repo.spot_has_active_reservation(conn, spot_id):
                 error = "Cannot manually mark 'Occupied' spot as 'Available' because it has an active user reservation. User must release it."
 
 
         if error is None:
             try:
-                conn.execute(
-                    "UPDATE parking_spots SET spot_number = ?, status = ?, updated_at = CURRENT_TIMESTAMP WHERE id = ?",
-                    (new_spot_number, new_status, spot_id)
-                )
+                repo.update_spot(conn, spot_id, new_spot_number, new_status)
                 conn.commit()
+                invalidate_allocators(spot['lot_id'])
+                publish_occupancy(spot['lot_id'], spot_id=spot_id, spot_number=new_spot_number, spot_status=new_status)
                 flash('Parking spot updated successfully!', 'success')
                 return redirect(url_for('manage_spots', lot_id=spot['lot_id']))
-            except sqlite3.Error as e:
+            except DatabaseError as e:
                 error = f"Database error: {e}"
                 conn.rollback()
         
         flash(error, 'danger')
-        conn = get_db_connection()
-        spot = conn.execute('SELECT * FROM parking_spots WHERE id = ?', (spot_id,)).fetchone()
-        parking_lot = conn.execute('SELECT prime_location_name FROM parking_lots WHERE id = ?', (spot['lot_id'],)).fetchone()
-        conn.close()
+        spot = repo.get_spot(conn, spot_id)
+        parking_lot = repo.get_lot(conn, spot['lot_id'])
 
-    conn.close() 
     return render_template('edit_spot.html', spot=spot, parking_lot=parking_lot)
 
 
 @app.route('/admin/parking_spots/delete/<int:spot_id>', methods=('POST',))
 @admin_required
 def delete_spot(spot_id): 
-    conn = get_db_connection()
+    conn = get_db()
     error = None
 
-    spot = conn.execute('SELECT * FROM parking_spots WHERE id = ?', (spot_id,)).fetchone()
+    spot = repo.get_spot(conn, spot_id)
     if spot is None:
         flash('Parking spot not found.', 'danger')
-        conn.close()
         return redirect(url_for('admin_dashboard'))
 
     lot_id = spot['lot_id']
 
-    active_reservation = conn.execute(
-        'SELECT id FROM parking_reservations WHERE spot_id = ? AND is_active = 1',
-        (spot_id,)
-    ).fetchone()
-
-    if active_reservation:
+    if repo.spot_has_active_reservation(conn, spot_id):
         error = 'Cannot delete spot. It has an active parking reservation. Please ensure the vehicle has departed.'
+    elif repo.spot_has_upcoming_slot(conn, spot_id, now_epoch()):
+        error = 'Cannot delete spot. It has upcoming advance bookings.'
     else:
         try:
             current_spot_status = spot['status']
+            repo.begin_write(conn)
+            if repo.delete_spot(conn, spot):
+                conn.commit()
+                invalidate_allocators(lot_id)
+                publish_occupancy(lot_id, delta=-1 if current_spot_status == 'Occupied' else 0,
+                                  spot_id=spot_id, spot_number=spot['spot_number'], spot_status='Deleted')
+                flash(f'Parking spot "{spot["spot_number"]}" deleted successfully! Parking lot capacity updated.', 'success')
+            else:
+                # booked between the checks above and taking the write lock
+                conn.rollback()
+                error = 'Cannot delete spot. It was booked just now.'
 
-            conn.execute('DELETE FROM parking_spots WHERE id = ?', (spot_id,))
-
-            conn.execute(
-                "UPDATE parking_lots SET maximum_number_of_spots = maximum_number_of_spots - 1, updated_at = CURRENT_TIMESTAMP WHERE id = ?",
-                (lot_id,)
-            )
-
-            if current_spot_status == 'Occupied':
-                conn.execute(
-                    "UPDATE parking_lots SET current_occupied_spots = current_occupied_spots - 1, updated_at = CURRENT_TIMESTAMP WHERE id = ?",
-                    (lot_id,)
-                )
-
-            conn.commit()
-            flash(f'Parking spot "{spot["spot_number"]}" deleted successfully! Parking lot capacity updated.', 'success')
-
-        except sqlite3.Error as e:
+        except DatabaseError as e:
             error = f"Database error during spot deletion: {e}"
             conn.rollback()
-        finally:
-            conn.close()
     
     if error:
         flash(error, 'danger')
@@ -432,144 +716,116 @@ def user_dashboard():
         flash('Unauthorized access. Please log in as a user.', 'warning')
         return redirect(url_for('login'))
     
-    conn = get_db_connection()
+    conn = get_db()
     user_id = g.user['id']
 
-    utc_timezone = pytz.utc
-    ist_timezone = pytz.timezone('Asia/Kolkata') 
-
-    available_parking_lots = conn.execute('''
-        SELECT id, prime_location_name, address, pin_code, price_per_hour, maximum_number_of_spots, current_occupied_spots
-        FROM parking_lots
-        WHERE (maximum_number_of_spots - current_occupied_spots) > 0
-        ORDER BY prime_location_name
-    ''').fetchall()
-
-    active_reservations = conn.execute('''
-        SELECT pr.id, pl.prime_location_name, ps.spot_number, pr.parking_timestamp
-        FROM parking_reservations pr
-        JOIN parking_spots ps ON pr.spot_id = ps.id
-        JOIN parking_lots pl ON ps.lot_id = pl.id
-        WHERE pr.user_id = ? AND pr.is_active = 1
-        ORDER BY pr.parking_timestamp DESC
-    ''', (user_id,)).fetchall()
-
-    parking_history = conn.execute('''
-        SELECT pr.id, pl.prime_location_name, ps.spot_number, pr.parking_timestamp, pr.leaving_timestamp, pr.total_cost
-        FROM parking_reservations pr
-        JOIN parking_spots ps ON pr.spot_id = ps.id
-        JOIN parking_lots pl ON ps.lot_id = pl.id
-        WHERE pr.user_id = ? AND pr.is_active = 0
-        ORDER BY pr.leaving_timestamp DESC
-    ''', (user_id,)).fetchall()
-
-    processed_active_reservations = []
-    for res in active_reservations:
-        
-        try:
-            parking_utc_dt = datetime.strptime(res['parking_timestamp'], '%Y-%m-%d %H:%M:%S.%f')
-        except ValueError:
-            parking_utc_dt = datetime.strptime(res['parking_timestamp'], '%Y-%m-%d %H:%M:%S')
-        
-        parking_utc_dt = utc_timezone.localize(parking_utc_dt)
-        parking_ist_dt = parking_utc_dt.astimezone(ist_timezone)
-        processed_active_reservations.append({
+    # ?lat=&lng= (or ?pin_code=) lists the nearest lots with free spots instead of all of them by name
+    lat, lng = request.args.get('lat', type=float), request.args.get('lng', type=float)
+    pin_code = request.args.get('pin_code', '').strip()
+    nearest = False
+    if lat is not None and lng is not None and not (-90 <= lat <= 90 and -180 <= lng <= 180):
+        # also catches nan and inf, which would break the grid lookup
+        flash('Latitude must be within -90..90 and longitude within -180..180.', 'warning')
+        lat = lng = None
+    if lat is None and pin_code:
+        centre = lot_index().pin_centroid(pin_code)
+        if centre is None:
+            flash(f"No mapped parking lots with pin code {pin_code}.", 'info')
+        else:
+            lat, lng = centre
+    if lat is not None and lng is not None:
+        nearby = nearest_lots(lat, lng, NEAREST_DEFAULT)
+        lot_table = Markup(render_template('available_lots.html', available_parking_lots=[lot for lot, _ in nearby],
+                                           distances={lot['id']: distance for lot, distance in nearby}))
+        nearest = True
+    else:
+        # every lot change moves the global sequence, so the by-name list is shared by all users until then
+        lot_table = cached_fragment(('available_lots',), change_tracker().seq, 'available_lots.html',
+                                    lambda: {'available_parking_lots': repo.available_lots(conn), 'distances': None})
+    active_reservations = repo.active_reservations(conn, user_id)
+    slots = repo.upcoming_slots(conn, user_id, now_epoch())
+
+    # keyset pagination: the cursor is the (leaving_timestamp, id) of the last row on the previous page
+    before_ts = request.args.get('before_ts', type=int)
+    before_id = request.args.get('before_id', type=int)
+    before = (before_ts, before_id) if before_ts is not None and before_id else None
+
+    def history_context():
+        parking_history, next_page = history_page(conn, user_id, before, HISTORY_PAGE_SIZE)
+        parked_in = format_local([h['parking_timestamp'] for h in parking_history])
+        parked_out = format_local([h['leaving_timestamp'] for h in parking_history])
+        #summary attributes for user, one aggregate over the covering history indexes
+        summary = user_summary(conn, user_id)
+        return {
+            'parking_history': [
+                {
+                    'id': hist['id'],
+                    'prime_location_name': hist['prime_location_name'],
+                    'spot_number': hist['spot_number'],
+                    'parking_timestamp': parking_ts,
+                    'leaving_timestamp': leaving_ts,
+                    'total_cost': hist['total_cost']
+                }
+                for hist, parking_ts, leaving_ts in zip(parking_history, parked_in, parked_out)
+            ],
+            'next_page': next_page,
+            'paginated': before is not None,
+            'total_reservations': summary['total_reservations'],
+            'completed_parks': summary['completed_parks'],
+            'total_amount_spent': summary['total_amount_spent'],
+        }
+
+    # the history shows lot names and archived costs as well as the user's own reservations,
+    # so it's keyed on the global sequence: lot renames and re-billing (live or archived) all move it
+    history_table = cached_fragment(('history', user_id, before), change_tracker().seq, 'parking_history.html', history_context)
+
+    processed_active_reservations = [
+        {
             'id': res['id'],
             'prime_location_name': res['prime_location_name'],
             'spot_number': res['spot_number'],
-            'parking_timestamp': parking_ist_dt.strftime('%Y-%m-%d %H:%M:%S') 
-        })
-
-    processed_parking_history = []
-    for hist in parking_history:
-        try:
-            parking_utc_dt = datetime.strptime(hist['parking_timestamp'], '%Y-%m-%d %H:%M:%S.%f')
-        except ValueError:
-            parking_utc_dt = datetime.strptime(hist['parking_timestamp'], '%Y-%m-%d %H:%M:%S')
-        
-        parking_utc_dt = utc_timezone.localize(parking_utc_dt)
-        parking_ist_dt = parking_utc_dt.astimezone(ist_timezone)
+            'parking_timestamp': parked_at,
+        }
+        for res, parked_at in zip(active_reservations, format_local([r['parking_timestamp'] for r in active_reservations]))
+    ]
+
+    upcoming_slots = [
+        {
+            'id': slot['id'],
+            'prime_location_name': slot['prime_location_name'],
+            'spot_number': slot['spot_number'],
+            'start': start,
+            'end': end,
+        }
+        for slot, start, end in zip(slots, format_local([s['start_ts'] for s in slots]), format_local([s['end_ts'] for s in slots]))
+    ]
 
-        leaving_ist_dt_str = 'N/A'
-        if hist['leaving_timestamp']:
-            try:
-                leaving_utc_dt = datetime.strptime(hist['leaving_timestamp'], '%Y-%m-%d %H:%M:%S.%f')
-            except ValueError:
-                leaving_utc_dt = datetime.strptime(hist['leaving_timestamp'], '%Y-%m-%d %H:%M:%S')
-            
-            leaving_utc_dt = utc_timezone.localize(leaving_utc_dt)
-            leaving_ist_dt = leaving_utc_dt.astimezone(ist_timezone)
-            leaving_ist_dt_str = leaving_ist_dt.strftime('%Y-%m-%d %H:%M:%S')
-
-        processed_parking_history.append({
-            'id': hist['id'],
-            'prime_location_name': hist['prime_location_name'],
-            'spot_number': hist['spot_number'],
-            'parking_timestamp': parking_ist_dt.strftime('%Y-%m-%d %H:%M:%S'),
-            'leaving_timestamp': leaving_ist_dt_str,
-            'total_cost': hist['total_cost']
-        })
-    #summary attributes for user
-    total_reservations = conn.execute('SELECT COUNT(*) FROM parking_reservations WHERE user_id = ?', (user_id,)).fetchone()[0]
-    completed_parks = conn.execute('SELECT COUNT(*) FROM parking_reservations WHERE user_id = ? AND is_active = 0', (user_id,)).fetchone()[0]
-    total_amount_spent = conn.execute('SELECT SUM(total_cost) FROM parking_reservations WHERE user_id = ? AND is_active = 0', (user_id,)).fetchone()[0] or 0.0
-
-    conn.close()
     return render_template('user_dashboard.html',
-                           available_parking_lots=available_parking_lots,
+                           lot_table=lot_table,
+                           nearest=nearest,
+                           pin_code=pin_code,
                            active_reservations=processed_active_reservations, 
-                           parking_history=processed_parking_history,       
-                           total_reservations=total_reservations,
-                           completed_parks=completed_parks,
-                           total_amount_spent=total_amount_spent)
+                           upcoming_slots=upcoming_slots,
+                           all_lots=repo.lot_choices(conn),
+                           max_slot_hours=MAX_SLOT_SECONDS // 3600,
+                           history_table=history_table)
 
 
 @app.route('/user/book_parking_spot/<int:lot_id>', methods=('POST',))
 @login_required
 def book_parking_spot(lot_id):
-    conn = get_db_connection()
+    conn = get_db()
     user_id = g.user['id']
-    error = None
-
-    existing_active_reservation = conn.execute('SELECT id FROM parking_reservations WHERE user_id = ? AND is_active = 1', (user_id,)).fetchone()
-    if existing_active_reservation:
-        error = 'You already have an active parking reservation. Please release it before booking another.'
-        flash(error, 'danger')
-        conn.close()
-        return redirect(url_for('user_dashboard'))
-
-    available_spot = conn.execute(
-        'SELECT id, lot_id FROM parking_spots WHERE lot_id = ? AND status = ? LIMIT 1',
-        (lot_id, 'Available')
-    ).fetchone()
 
-    if available_spot:
-        try:
-            spot_id = available_spot['id']
-            conn.execute(
-                "UPDATE parking_spots SET status = ?, updated_at = CURRENT_TIMESTAMP WHERE id = ?",
-                ('Occupied', spot_id)
-            )
-            
-            conn.execute(
-                "INSERT INTO parking_reservations (spot_id, user_id, parking_timestamp, is_active) VALUES (?, ?, CURRENT_TIMESTAMP, 1)",
-                (spot_id, user_id)
-            )
-            conn.execute(
-                "UPDATE parking_lots SET current_occupied_spots = current_occupied_spots + 1, updated_at = CURRENT_TIMESTAMP WHERE id = ?",
-                (lot_id,)
-            )
-            conn.commit()
-            flash('Parking spot booked successfully! Check your active reservations.', 'success')
-        except sqlite3.Error as e:
-            error = f"Database error during booking: {e}"
-            flash(error, 'danger')
-            conn.rollback()
-        finally:
-            conn.close()
-    else:
-        flash('No available spots in this parking lot.', 'danger')
-        conn.close()
+    try:
+        _, spot_id = spot_allocator().book(conn, lot_id, user_id)
+        slot_allocator().set_occupied(lot_id, spot_id, True)
+        publish_occupancy(lot_id, delta=1, spot_id=spot_id, spot_status='Occupied')
+        flash('Parking spot booked successfully! Check your active reservations.', 'success')
+    except AllocationError as e:
+        flash(str(e), 'danger')
+    except DatabaseError as e:
+        flash(f"Database error during booking: {e}", 'danger')
     
     return redirect(url_for('user_dashboard'))
 
@@ -577,81 +833,265 @@ def book_parking_spot(lot_id):
 @app.route('/user/release_parking_spot/<int:reservation_id>', methods=('POST',))
 @login_required
 def release_parking_spot(reservation_id):
-    conn = get_db_connection()
+    conn = get_db()
     user_id = g.user['id']
     error = None
 
-    reservation = conn.execute(
-        'SELECT pr.id, pr.spot_id, pr.parking_timestamp, pl.price_per_hour '
-        'FROM parking_reservations pr '
-        'JOIN parking_spots ps ON pr.spot_id = ps.id '
-        'JOIN parking_lots pl ON ps.lot_id = pl.id '
-        'WHERE pr.id = ? AND pr.user_id = ? AND pr.is_active = 1',
-        (reservation_id, user_id)
-    ).fetchone()
+    reservation = repo.reservation_to_release(conn, reservation_id, user_id)
 
     if reservation is None:
         flash('Active reservation not found or you do not have permission to release it.', 'danger')
-        conn.close()
         return redirect(url_for('user_dashboard'))
 
     try:
-        spot_id = reservation['spot_id']
-        utc_timezone = pytz.utc
-        ist_timezone = pytz.timezone('Asia/Kolkata') 
+        # Cost Calculation based on time spend in parking and the lot's tariff
+        leaving_timestamp = now_epoch()
+        total_cost = compute_cost(reservation['parking_timestamp'], leaving_timestamp, Tariff.from_row(reservation))
 
-        # Cost Calculation based on time spend in parking
-        parking_timestamp_str = reservation['parking_timestamp']
-        try:
-            parking_timestamp_utc = datetime.strptime(parking_timestamp_str, '%Y-%m-%d %H:%M:%S.%f')
-        except ValueError:
-            parking_timestamp_utc = datetime.strptime(parking_timestamp_str, '%Y-%m-%d %H:%M:%S')
-        parking_timestamp_utc = utc_timezone.localize(parking_timestamp_utc) 
-
-        leaving_timestamp_ist = ist_timezone.localize(datetime.now()) 
-        leaving_timestamp_utc = leaving_timestamp_ist.astimezone(utc_timezone)
-
-        price_per_hour = reservation['price_per_hour']
-
-        duration_delta = leaving_timestamp_utc - parking_timestamp_utc
-        duration_seconds = duration_delta.total_seconds()
-        
-        billed_hours = 0
-        total_cost = 0.0
-        if duration_seconds > 0:
-            billed_hours = math.ceil(duration_seconds / 3600.0)
-            if billed_hours == 0: 
-                billed_hours = 1
-            total_cost = round(billed_hours * price_per_hour, 2)
-
-        conn.execute(
-            "UPDATE parking_spots SET status = ?, updated_at = CURRENT_TIMESTAMP WHERE id = ?",
-            ('Available', spot_id)
-        )
-
-        conn.execute(
-            "UPDATE parking_reservations SET leaving_timestamp = ?, total_cost = ?, is_active = 0, updated_at = CURRENT_TIMESTAMP WHERE id = ?",
-            (leaving_timestamp_utc.strftime('%Y-%m-%d %H:%M:%S'), total_cost, reservation_id) 
-        )
-
-        lot_id_for_spot = conn.execute('SELECT lot_id FROM parking_spots WHERE id = ?', (spot_id,)).fetchone()['lot_id']
-        conn.execute(
-            "UPDATE parking_lots SET current_occupied_spots = current_occupied_spots - 1, updated_at = CURRENT_TIMESTAMP WHERE id = ?",
-            (lot_id_for_spot,)
-        )
-
-        conn.commit()
+        lot_id = spot_allocator().release(conn, reservation_id, user_id, leaving_timestamp, total_cost)
+        slot_allocator().set_occupied(lot_id, reservation['spot_id'], False)
+        publish_occupancy(lot_id, delta=-1, spot_id=reservation['spot_id'], spot_status='Available')
         flash(f'Parking spot released successfully! Total cost: ₹{total_cost:.2f}', 'success')
-    except sqlite3.Error as e:
+    except AllocationError as e:
+        flash(str(e), 'danger')
+    except DatabaseError as e:
         error = f"Database error during release: {e}"
         flash(error, 'danger')
-        conn.rollback()
-    finally:
-        conn.close()
     
     return redirect(url_for('user_dashboard'))
 
 
+@app.route('/user/slots/book', methods=('POST',))
+@login_required
+def book_slot():
+    conn = get_db()
+    user_id = g.user['id']
+    error = None
+
+    lot_id = request.form.get('lot_id', type=int)
+    hours = request.form.get('hours', type=float)
+    try:
+        start = parse_local(request.form.get('start', ''))
+    except ValueError:
+        error = 'Please choose a valid start date and time.'
+    if error is None and lot_id is None:
+        error = 'Please choose a parking lot.'
+    if error is None and (hours is None or not math.isfinite(hours) or hours <= 0):
+        error = 'Please enter how many hours you need the spot for.'
+    if error is None and hours * 3600 > MAX_SLOT_SECONDS:
+        error = f'A slot can be at most {MAX_SLOT_SECONDS // 3600} hours long.'
+
+    if error is None:
+        try:
+            slot_allocator().reserve(conn, lot_id, user_id, start, start + int(hours * 3600))
+            flash('Slot reserved! It is listed under your upcoming slots.', 'success')
+        except AllocationError as e:
+            error = str(e)
+        except DatabaseError as e:
+            error = f"Database error during booking: {e}"
+
+    if error:
+        flash(error, 'danger')
+    return redirect(url_for('user_dashboard'))
+
+
+@app.route('/user/slots/<int:slot_id>/cancel', methods=('POST',))
+@login_required
+def cancel_slot(slot_id):
+    try:
+        slot_allocator().cancel(get_db(), slot_id, g.user['id'])
+        flash('Slot cancelled.', 'success')
+    except AllocationError as e:
+        flash(str(e), 'danger')
+    except DatabaseError as e:
+        flash(f"Database error while cancelling: {e}", 'danger')
+    return redirect(url_for('user_dashboard'))
+
+
+@app.route('/user/slots/<int:slot_id>/check_in', methods=('POST',))
+@login_required
+def check_in_slot(slot_id):
+    try:
+        _, spot_id, lot_id = slot_allocator().check_in(get_db(), slot_id, g.user['id'])
+        spot_allocator().invalidate(lot_id)  # its free-spot heap still lists the spot
+        publish_occupancy(lot_id, delta=1, spot_id=spot_id, spot_status='Occupied')
+        flash('Checked in! Your reserved spot is now an active reservation.', 'success')
+    except AllocationError as e:
+        flash(str(e), 'danger')
+    except DatabaseError as e:
+        flash(f"Database error during check-in: {e}", 'danger')
+    return redirect(url_for('user_dashboard'))
+
+
+@app.route('/admin/export/<report>')
+@admin_required
+def export_report(report):
+    """Downloads a report as CSV or NDJSON (?format=), streamed while it's being read."""
+    fmt = request.args.get('format', 'csv')
+    if report not in REPORTS or fmt not in EXPORT_FORMATS:
+        flash('Unknown report or format.', 'danger')
+        return redirect(url_for('admin_dashboard'))
+    lot_id = request.args.get('lot_id', type=int)
+    database = app.config['DATABASE']
+
+    def generate():
+        # own connection: the request's pooled one goes back to the pool before streaming ends
+        conn = get_db_connection(database)
+        try:
+            yield from stream_report(conn, report, fmt, lot_id)
+        finally:
+            conn.close()
+
+    filename = f"{report}{f'-lot{lot_id}' if lot_id else ''}.{fmt}"
+    return Response(generate(), mimetype=EXPORT_FORMATS[fmt],
+                    headers={'Content-Disposition': f'attachment; filename={filename}',
+                             'X-Accel-Buffering': 'no'})
+
+
+#JSON API
+API_PAGE_SIZE = 50
+API_MAX_PAGE_SIZE = 500
+
+def api_error(message, status):
+    return jsonify({'error': message}), status
+
+def conditional_json(etag, build):
+    """Answers 304 when the client already has etag, otherwise builds the JSON body and tags it.
+
+    The etag comes from the change tracker, so a matching poll never reaches the database.
+    """
+    etag = f"{etag}-{zlib.crc32(request.query_string):08x}"
+    if request.if_none_match.contains(etag):
+        response = app.response_class(status=304)
+    else:
+        response = jsonify(build())
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = 'no-cache'
+    return response
+
+def api_limit():
+    return max(1, min(request.args.get('limit', API_PAGE_SIZE, type=int), API_MAX_PAGE_SIZE))
+
+def lot_json(lot):
+    return {
+        'id': lot['id'],
+        'prime_location_name': lot['prime_location_name'],
+        'address': lot['address'],
+        'pin_code': lot['pin_code'],
+        'price_per_hour': lot['price_per_hour'],
+        'maximum_number_of_spots': lot['maximum_number_of_spots'],
+        'current_occupied_spots': lot['current_occupied_spots'],
+        'available_spots': lot['maximum_number_of_spots'] - lot['current_occupied_spots'],
+        'latitude': lot['latitude'],
+        'longitude': lot['longitude'],
+        'version': lot['version'],
+    }
+
+@app.route('/api/v1/lots')
+def api_lots():
+    tracker = change_tracker()
+
+    def build():
+        lots, _, next_cursor = list_lots(get_db(), request.args.get('q', '').strip(), request.args.get('after'),
+                                         limit=api_limit(), available_only=request.args.get('available') == '1')
+        return {'lots': [lot_json(lot) for lot in lots], 'next': next_cursor}
+
+    return conditional_json(f'lots-{tracker.seq}', build)
+
+@app.route('/api/v1/lots/nearest')
+def api_nearest_lots():
+    """The k nearest lots with free spots to ?lat=&lng=, or to the lots of ?pin_code=."""
+    lat, lng = request.args.get('lat', type=float), request.args.get('lng', type=float)
+    pin_code = request.args.get('pin_code', '').strip()
+    k = max(1, min(request.args.get('k', NEAREST_DEFAULT, type=int), NEAREST_MAX))
+    if lat is None or lng is None:
+        if not pin_code:
+            return api_error('Give lat and lng, or pin_code.', 400)
+        centre = lot_index().pin_centroid(pin_code)
+        if centre is None:
+            return api_error('No mapped parking lots with that pin code.', 404)
+        lat, lng = centre
+    elif not (-90 <= lat <= 90 and -180 <= lng <= 180):
+        return api_error('lat must be within -90..90 and lng within -180..180.', 400)
+
+    def build():
+        return {'lat': lat, 'lng': lng, 'lots': [
+            {**lot_json(lot), 'distance_km': round(distance, 3)} for lot, distance in nearest_lots(lat, lng, k)
+        ]}
+
+    return conditional_json(f'nearest-{change_tracker().seq}', build)
+
+@app.route('/api/v1/lots/<int:lot_id>')
+def api_lot(lot_id):
+    version = change_tracker().lot_version(lot_id)
+    if version is None:
+        return api_error('Parking lot not found.', 404)
+    return conditional_json(f'lot-{lot_id}-{version}', lambda: lot_json(repo.get_lot(get_db(), lot_id)))
+
+@app.route('/api/v1/lots/<int:lot_id>/spots')
+def api_lot_spots(lot_id):
+    version = change_tracker().lot_version(lot_id)
+    if version is None:
+        return api_error('Parking lot not found.', 404)
+
+    def build():
+        spots, next_cursor = repo.spot_page(get_db(), lot_id, request.args.get('after', 0, type=int), api_limit())
+        return {'lot_id': lot_id, 'spots': [dict(spot) for spot in spots], 'next': next_cursor}
+
+    return conditional_json(f'spots-{lot_id}-{version}', build)
+
+@app.route('/api/v1/reservations')
+def api_reservations():
+    if not g.user:
+        return api_error('Login required.', 401)
+    user_id = g.user['id']
+    version = change_tracker().user_version(user_id, get_db)
+
+    def build():
+        limit = api_limit()
+        before_ts = request.args.get('before_ts', type=int)
+        before_id = request.args.get('before_id', type=int)
+        before = (before_ts, before_id) if before_ts is not None and before_id else None
+        conn = get_db()
+        active = repo.active_reservations(conn, user_id)
+        history, next_cursor = history_page(conn, user_id, before, limit)
+        return {
+            'active': [dict(row) for row in active],
+            'history': [dict(row) for row in history],
+            'next': next_cursor,
+        }
+
+    return conditional_json(f'reservations-{user_id}-{version}', build)
+
+def metrics_client_allowed(remote_addr):
+    try:
+        addr = ipaddress.ip_address(remote_addr or '')
+    except ValueError:
+        return False
+    return any(addr in network for network in app.config['METRICS_ALLOWED_ADDRS'])
+
+@app.route('/metrics')
+def metrics():
+    """Per-route request and query timings in Prometheus text format (needs QUERY_PROFILING=1).
+
+    Only admins and clients in METRICS_ALLOWED_ADDRS may read it: it carries SQL text.
+    """
+    if not (g.user and g.user['role'] == 'admin') and not metrics_client_allowed(request.remote_addr):
+        return Response('Forbidden.\n', status=403, mimetype='text/plain')
+    if not profiling.enabled:
+        return Response('Query profiling is off; set QUERY_PROFILING=1.\n', status=404, mimetype='text/plain')
+    return Response(profiling.stats.render() + fragment_cache().render(), mimetype='text/plain; version=0.0.4')
+
+@app.route('/events/occupancy')
+def occupancy_events():
+    """Server-Sent Events stream of per-lot occupancy changes; ?lot_id= narrows it to one lot."""
+    if not server.detach_for_stream():
+        return Response('Too many open event streams.\n', status=503, mimetype='text/plain',
+                        headers={'Retry-After': '30'})
+    stream = event_broker().stream(request.args.get('lot_id', type=int))
+    return Response(stream, mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
 
 # MAIN ENTRY POINT
 if __name__ == '__main__':
@@ -674,7 +1114,12 @@ if __name__ == '__main__':
             print(f"[{current_time_ist}] Database initialized successfully.")
         else:
             print(f"[{current_time_ist}] Database already exists at {DATABASE}. Skipping initialization. To force re-initialization, set FLASK_REINIT_DB=1 environment variable.")
+            conn = get_db_connection(DATABASE)
+            migrate(conn, verbose=True)
+            conn.close()
     
+    if os.environ.get('WERKZEUG_RUN_MAIN') == 'true':
+        start_overstays()  # in the reloader's child, which is the one serving
     app.run(debug=True)
 
 #END
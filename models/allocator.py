@@ -0,0 +1,296 @@
+import heapq
+import random
+import threading
+import time
+
+from models.database import begin_write, insert
+
+# Spot allocation for bookings. Each lot keeps an in-memory min-heap of free
+# spot ids so a booking never has to scan parking_spots; the claim itself is
+# a conditional UPDATE inside a write transaction (begin_write), so even a stale
+# heap (another process, an admin edit) can never hand out the same spot twice.
+
+# walk-ins don't get a spot whose next advance slot (models/slots.py) starts this soon
+SLOT_HOLD_SECONDS = 2 * 3600
+
+class AllocationError(Exception):
+    """Raised when a booking or release can't go through; the message is shown to the user."""
+
+
+class SpotAllocator:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._free = {}  # lot_id -> (heap of spot ids, set of the same ids)
+
+    def _load(self, conn, lot_id):
+        ids = [row[0] for row in conn.execute(
+            'SELECT id FROM parking_spots WHERE lot_id = ? AND status = ?', (lot_id, 'Available')
+        )]
+        heapq.heapify(ids)
+        self._free[lot_id] = (ids, set(ids))
+
+    def _pop(self, conn, lot_id, reloaded=False):
+        if lot_id not in self._free:
+            self._load(conn, lot_id)
+        heap, members = self._free[lot_id]
+        if not heap and not reloaded:
+            # spots may have been freed by another process or added by an admin
+            self._load(conn, lot_id)
+            heap, members = self._free[lot_id]
+        if not heap:
+            return None
+        spot_id = heapq.heappop(heap)
+        members.discard(spot_id)
+        return spot_id
+
+    def _push(self, lot_id, spot_id):
+        with self._lock:
+            if lot_id not in self._free:
+                return  # not loaded yet, the next load will pick it up
+            heap, members = self._free[lot_id]
+            if spot_id not in members:
+                heapq.heappush(heap, spot_id)
+                members.add(spot_id)
+
+    def invalidate(self, lot_id=None):
+        """Forgets the cached free spots of a lot (or all lots) after an admin change."""
+        with self._lock:
+            if lot_id is None:
+                self._free.clear()
+            else:
+                self._free.pop(lot_id, None)
+
+    def book(self, conn, lot_id, user_id):
+        """Claims a free spot, opens the reservation and bumps the lot counter in one transaction.
+
+        Returns (reservation_id, spot_id).
+        """
+        spot_id, claimed, held = None, False, []
+        begin_write(conn)
+        try:
+            if conn.execute(
+                'SELECT 1 FROM parking_reservations WHERE user_id = ? AND is_active = 1', (user_id,)
+            ).fetchone():
+                raise AllocationError('You already have an active parking reservation. Please release it before booking another.')
+
+            reloaded = False
+            while True:
+                with self._lock:
+                    spot_id = self._pop(conn, lot_id, reloaded)
+                if spot_id is None:
+                    raise AllocationError('No available spots in this parking lot.')
+                now = int(time.time())
+                claimed = conn.execute(
+                    "UPDATE parking_spots SET status = 'Occupied', updated_at = CURRENT_TIMESTAMP "
+                    "WHERE id = ? AND lot_id = ? AND status = 'Available' AND NOT EXISTS ("
+                    "    SELECT 1 FROM spot_slots WHERE spot_id = parking_spots.id AND status = 'booked'"
+                    "    AND start_ts < ? AND end_ts > ?)",
+                    (spot_id, lot_id, now + SLOT_HOLD_SECONDS, now)
+                ).rowcount == 1
+                if claimed:
+                    break
+                reloaded = True  # stale entry (someone else has it now) or held for an upcoming slot
+                if conn.execute(
+                    "SELECT 1 FROM parking_spots WHERE id = ? AND lot_id = ? AND status = 'Available'", (spot_id, lot_id)
+                ).fetchone():
+                    held.append(spot_id)  # still free, just not for a walk-in right now; goes back on the heap
+
+            reservation_id = insert(
+                conn, "INSERT INTO parking_reservations (spot_id, user_id, parking_timestamp, is_active) VALUES (?, ?, ?, 1)",
+                (spot_id, user_id, now)
+            )
+            conn.execute(
+                "UPDATE parking_lots SET current_occupied_spots = current_occupied_spots + 1, updated_at = CURRENT_TIMESTAMP WHERE id = ?",
+                (lot_id,)
+            )
+            conn.commit()
+        except BaseException:
+            conn.rollback()
+            if claimed:
+                self._push(lot_id, spot_id)
+            raise
+        finally:
+            for held_id in held:
+                self._push(lot_id, held_id)
+        return reservation_id, spot_id
+
+    def release(self, conn, reservation_id, user_id, leaving_timestamp, total_cost):
+        """Closes an active reservation and frees its spot in one transaction. Returns the lot id.
+
+        leaving_timestamp is UTC epoch seconds, like parking_timestamp.
+        """
+        begin_write(conn)
+        try:
+            row = conn.execute(
+                'SELECT pr.spot_id, ps.lot_id FROM parking_reservations pr '
+                'JOIN parking_spots ps ON pr.spot_id = ps.id '
+                'WHERE pr.id = ? AND pr.user_id = ? AND pr.is_active = 1',
+                (reservation_id, user_id)
+            ).fetchone()
+            if row is None:
+                raise AllocationError('Active reservation not found or you do not have permission to release it.')
+            spot_id, lot_id = row[0], row[1]
+            self._close(conn, reservation_id, spot_id, lot_id, leaving_timestamp, total_cost)
+            conn.commit()
+        except BaseException:
+            conn.rollback()
+            raise
+        self._push(lot_id, spot_id)
+        return lot_id
+
+    def release_many(self, conn, releases):
+        """Closes a batch of reservations in one transaction, skipping any no longer active.
+
+        releases is [(reservation_id, leaving_timestamp, total_cost)]; returns the
+        (reservation_id, spot_id, lot_id) of the ones actually closed.
+        """
+        closed = []
+        begin_write(conn)
+        try:
+            for reservation_id, leaving_timestamp, total_cost in releases:
+                row = conn.execute(
+                    'SELECT pr.spot_id, ps.lot_id FROM parking_reservations pr '
+                    'JOIN parking_spots ps ON pr.spot_id = ps.id WHERE pr.id = ? AND pr.is_active = 1',
+                    (reservation_id,)
+                ).fetchone()
+                if row is None:
+                    continue  # the user released it in the meantime
+                self._close(conn, reservation_id, row[0], row[1], leaving_timestamp, total_cost)
+                closed.append((reservation_id, row[0], row[1]))
+            conn.commit()
+        except BaseException:
+            conn.rollback()
+            raise
+        for _, spot_id, lot_id in closed:
+            self._push(lot_id, spot_id)
+        return closed
+
+    @staticmethod
+    def _close(conn, reservation_id, spot_id, lot_id, leaving_timestamp, total_cost):
+        conn.execute(
+            "UPDATE parking_reservations SET leaving_timestamp = ?, total_cost = ?, is_active = 0, updated_at = CURRENT_TIMESTAMP WHERE id = ?",
+            (leaving_timestamp, total_cost, reservation_id)
+        )
+        conn.execute(
+            "UPDATE parking_spots SET status = 'Available', updated_at = CURRENT_TIMESTAMP WHERE id = ?",
+            (spot_id,)
+        )
+        conn.execute(
+            "UPDATE parking_lots SET current_occupied_spots = current_occupied_spots - 1, updated_at = CURRENT_TIMESTAMP WHERE id = ?",
+            (lot_id,)
+        )
+
+
+_allocators = {}
+_allocators_lock = threading.Lock()
+
+def get_allocator(database):
+    """Returns the process-wide allocator for a database file."""
+    with _allocators_lock:
+        if database not in _allocators:
+            _allocators[database] = SpotAllocator()
+        return _allocators[database]
+
+
+def stress_test(database, lots=4, spots_per_lot=100, users=400, threads=16, seconds=5.0):
+    """Hammers book/release from many threads, then checks nobody ever shared a spot.
+
+    Needs an initialized database; returns a dict of counts and raises AssertionError on a violation.
+    """
+    from models.database import get_db_connection
+
+    setup = get_db_connection(database)
+    lot_ids = []
+    for n in range(lots):
+        lot_id = insert(
+            setup, "INSERT INTO parking_lots (prime_location_name, address, pin_code, price_per_hour, maximum_number_of_spots) VALUES (?, ?, ?, ?, ?)",
+            (f'Stress Lot {time.time_ns()}-{n}', 'stress', '000000', 10.0, spots_per_lot)
+        )
+        setup.executemany(
+            "INSERT INTO parking_spots (lot_id, spot_number, status) VALUES (?, ?, 'Available')",
+            [(lot_id, f'S{i}') for i in range(1, spots_per_lot + 1)]
+        )
+        lot_ids.append(lot_id)
+    first_user = setup.execute('SELECT COALESCE(MAX(id), 0) + 1 FROM users').fetchone()[0]
+    setup.executemany(
+        "INSERT INTO users (username, password_hash, email, role) VALUES (?, 'x', ?, 'user')",
+        [(f'stress{first_user + i}', f'stress{first_user + i}@example.com') for i in range(users)]
+    )
+    setup.commit()
+    user_ids = list(range(first_user, first_user + users))
+
+    allocator = get_allocator(database)
+    counts = {'booked': 0, 'released': 0, 'rejected': 0}
+    counts_lock = threading.Lock()
+    deadline = time.monotonic() + seconds
+
+    def worker(seed):
+        rng = random.Random(seed)
+        conn = get_db_connection(database)
+        local = {'booked': 0, 'released': 0, 'rejected': 0}
+        mine = {}
+        while time.monotonic() < deadline:
+            user_id = rng.choice(user_ids)
+            if user_id in mine:
+                try:
+                    allocator.release(conn, mine.pop(user_id), user_id, int(time.time()), 0.0)
+                    local['released'] += 1
+                except AllocationError:
+                    local['rejected'] += 1
+                continue
+            try:
+                reservation_id, _ = allocator.book(conn, rng.choice(lot_ids), user_id)
+                mine[user_id] = reservation_id
+                local['booked'] += 1
+            except AllocationError:
+                local['rejected'] += 1
+        conn.close()
+        with counts_lock:
+            for key in counts:
+                counts[key] += local[key]
+
+    # workers pick users at random, so the same user often books from two threads at once
+    workers = [threading.Thread(target=worker, args=(seed,)) for seed in range(threads)]
+    started = time.monotonic()
+    for t in workers:
+        t.start()
+    for t in workers:
+        t.join()
+    elapsed = time.monotonic() - started
+
+    shared = setup.execute(
+        'SELECT spot_id FROM parking_reservations WHERE is_active = 1 GROUP BY spot_id HAVING COUNT(*) > 1'
+    ).fetchall()
+    assert not shared, f'spots booked twice: {[r[0] for r in shared]}'
+    double_parked = setup.execute(
+        'SELECT user_id FROM parking_reservations WHERE is_active = 1 GROUP BY user_id HAVING COUNT(*) > 1'
+    ).fetchall()
+    assert not double_parked, f'users with two active reservations: {[r[0] for r in double_parked]}'
+    for lot_id in lot_ids:
+        counter = setup.execute('SELECT current_occupied_spots FROM parking_lots WHERE id = ?', (lot_id,)).fetchone()[0]
+        occupied = setup.execute(
+            "SELECT COUNT(*) FROM parking_spots WHERE lot_id = ? AND status = 'Occupied'", (lot_id,)
+        ).fetchone()[0]
+        active = setup.execute(
+            'SELECT COUNT(*) FROM parking_reservations pr JOIN parking_spots ps ON pr.spot_id = ps.id '
+            'WHERE ps.lot_id = ? AND pr.is_active = 1', (lot_id,)
+        ).fetchone()[0]
+        assert counter == occupied == active, f'lot {lot_id}: counter {counter}, occupied {occupied}, active {active}'
+    setup.close()
+
+    counts['seconds'] = round(elapsed, 2)
+    counts['ops_per_second'] = round((counts['booked'] + counts['released'] + counts['rejected']) / elapsed, 1)
+    return counts
+
+
+if __name__ == '__main__':
+    import os
+    import sys
+    import tempfile
+    from models.database import init_db
+
+    workdir = tempfile.mkdtemp()
+    database = os.path.join(workdir, 'stress.db')
+    init_db(database)
+    result = stress_test(database, threads=int(sys.argv[1]) if len(sys.argv) > 1 else 16)
+    print(f"No double bookings. {result}")
@@ -0,0 +1,94 @@
+import heapq
+import time
+
+from models.database import begin_write
+
+# Completed reservations older than ARCHIVE_AFTER_DAYS move from parking_reservations
+# into parking_reservations_archive (migration 9), so the live table only holds
+# active stays and recent history. Readers of a user's history go through
+# history_page/user_summary, which read both tables.
+
+ARCHIVE_AFTER_DAYS = 90
+ARCHIVE_BATCH_SIZE = 1000
+ARCHIVE_PAUSE_SECONDS = 0.05  # gap between batches so bookings can grab the write lock
+
+HISTORY_TABLES = ('parking_reservations', 'parking_reservations_archive')
+
+def archive_completed(conn, older_than_days=ARCHIVE_AFTER_DAYS, batch_size=ARCHIVE_BATCH_SIZE,
+                      pause=ARCHIVE_PAUSE_SECONDS):
+    """Moves completed reservations that ended before the cutoff, one short transaction per batch.
+
+    Returns the number of reservations archived.
+    """
+    cutoff = int(time.time()) - older_than_days * 86400
+    moved = 0
+    while True:
+        begin_write(conn)
+        try:
+            ids = [row[0] for row in conn.execute(
+                'SELECT id FROM parking_reservations WHERE is_active = 0 AND leaving_timestamp < ? '
+                'ORDER BY leaving_timestamp LIMIT ?', (cutoff, batch_size)
+            )]
+            if ids:
+                marks = ','.join('?' * len(ids))
+                conn.execute(f'''
+                    INSERT INTO parking_reservations_archive
+                        (id, spot_id, user_id, parking_timestamp, leaving_timestamp, total_cost, created_at, updated_at)
+                    SELECT id, spot_id, user_id, parking_timestamp, leaving_timestamp, total_cost, created_at, updated_at
+                    FROM parking_reservations WHERE id IN ({marks})
+                ''', ids)
+                conn.execute(f'DELETE FROM parking_reservations WHERE id IN ({marks})', ids)
+            conn.commit()
+        except BaseException:
+            conn.rollback()
+            raise
+        moved += len(ids)
+        if len(ids) < batch_size:
+            return moved
+        time.sleep(pause)
+
+def history_page(conn, user_id, before=None, limit=20):
+    """One page of a user's completed reservations, newest first, across live and archived rows.
+
+    before is the (leaving_timestamp, id) cursor of the previous page's last row. Each
+    table is asked for at most limit + 1 rows through its history index and the two
+    runs are merged, so a page costs the same however long the history is.
+    Returns (rows, next_cursor).
+    """
+    keyset_clause, keyset_params = '', ()
+    if before is not None:
+        keyset_clause, keyset_params = 'AND (pr.leaving_timestamp, pr.id) < (?, ?)', tuple(before)
+    runs = []
+    for table in HISTORY_TABLES:
+        active_clause = 'AND pr.is_active = 0' if table == 'parking_reservations' else ''
+        runs.append(conn.execute(f'''
+            SELECT pr.id, ps.lot_id, pl.prime_location_name, ps.spot_number,
+                   pr.parking_timestamp, pr.leaving_timestamp, pr.total_cost
+            FROM {table} pr
+            JOIN parking_spots ps ON pr.spot_id = ps.id
+            JOIN parking_lots pl ON ps.lot_id = pl.id
+            WHERE pr.user_id = ? {active_clause} {keyset_clause}
+            ORDER BY pr.leaving_timestamp DESC, pr.id DESC
+            LIMIT ?
+        ''', (user_id, *keyset_params, limit + 1)).fetchall())
+
+    merged = list(heapq.merge(*runs, key=lambda row: (row['leaving_timestamp'], row['id']), reverse=True))
+    rows = merged[:limit]
+    next_cursor = None
+    if len(merged) > limit:
+        next_cursor = {'before_ts': rows[-1]['leaving_timestamp'], 'before_id': rows[-1]['id']}
+    return rows, next_cursor
+
+def user_summary(conn, user_id):
+    """Reservation count, completed count and total spent for a user, over live and archived rows."""
+    return conn.execute('''
+        SELECT live.total + archived.total AS total_reservations,
+               live.completed + archived.total AS completed_parks,
+               live.spent + archived.spent AS total_amount_spent
+        FROM (SELECT COUNT(*) AS total,
+                     COALESCE(SUM(is_active = 0), 0) AS completed,
+                     COALESCE(SUM(CASE WHEN is_active = 0 THEN total_cost END), 0.0) AS spent
+              FROM parking_reservations WHERE user_id = ?) AS live,
+             (SELECT COUNT(*) AS total, COALESCE(SUM(total_cost), 0.0) AS spent
+              FROM parking_reservations_archive WHERE user_id = ?) AS archived
+    ''', (user_id, user_id)).fetchone()
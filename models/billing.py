@@ -0,0 +1,188 @@
+import math
+import time
+from datetime import datetime
+
+from models.database import begin_write
+from models.timefmt import LOCAL_TIMEZONE
+
+try:
+    import numpy as np
+except ImportError:  # optional; batches fall back to plain Python
+    np = None
+
+# Parking cost calculation. A stay is billed in whole hours, rounded up, and never for
+# less than MIN_BILLED_HOURS, so a release in the same second as the booking isn't
+# free. Each billed hour is charged at the lot's hourly price, or its night price when
+# the hour starts inside the night window (local time). The first hour can have its own price, and a
+# daily cap limits what any 24 hour block of the stay can cost.
+#
+# The arithmetic is closed form (no loop over the hours of a stay) so it vectorizes:
+# compute_costs runs the same formula over whole NumPy arrays of reservations.
+
+MIN_BILLED_HOURS = 1
+NIGHT_START_HOUR = 22
+NIGHT_END_HOUR = 6
+RECOMPUTE_BATCH_SIZE = 50000
+
+_LOCAL_OFFSET = int(LOCAL_TIMEZONE.utcoffset(datetime(2000, 1, 1)).total_seconds())  # IST has no DST
+_NIGHT_HOURS = [(h >= NIGHT_START_HOUR or h < NIGHT_END_HOUR) for h in range(24)]
+# night hours in [0, i) over two days, so any window of < 24 hours is cum[s + r] - cum[s]
+_NIGHT_CUMULATIVE = [0]
+for _h in range(48):
+    _NIGHT_CUMULATIVE.append(_NIGHT_CUMULATIVE[-1] + _NIGHT_HOURS[_h % 24])
+_NIGHT_PER_DAY = _NIGHT_CUMULATIVE[24]
+
+
+class Tariff:
+    """Pricing of one lot. Only price_per_hour is required; the rest switch on extra rules."""
+
+    def __init__(self, price_per_hour, first_hour_price=None, daily_cap=None, night_price_per_hour=None):
+        self.price_per_hour = price_per_hour
+        self.first_hour_price = first_hour_price
+        self.daily_cap = daily_cap
+        self.night_price_per_hour = night_price_per_hour
+
+    @classmethod
+    def from_row(cls, row):
+        """Builds the tariff from a row carrying the parking_lots tariff columns."""
+        return cls(row['price_per_hour'], row['first_hour_price'], row['daily_cap'], row['night_price_per_hour'])
+
+    def key(self):
+        return (self.price_per_hour, self.first_hour_price, self.daily_cap, self.night_price_per_hour)
+
+
+def compute_cost(parking_epoch, leaving_epoch, tariff):
+    """Cost of a single stay between two UTC epoch timestamps."""
+    duration = leaving_epoch - parking_epoch
+    hours = max(math.ceil(duration / 3600.0), MIN_BILLED_HOURS)
+    price = tariff.price_per_hour
+    night = tariff.night_price_per_hour if tariff.night_price_per_hour is not None else price
+
+    start_hour = int(((parking_epoch + _LOCAL_OFFSET) % 86400) // 3600)
+    full_days, rest = divmod(hours, 24)
+    day_cost = price * (24 - _NIGHT_PER_DAY) + night * _NIGHT_PER_DAY
+    rest_night = _NIGHT_CUMULATIVE[start_hour + rest] - _NIGHT_CUMULATIVE[start_hour]
+    rest_cost = price * (rest - rest_night) + night * rest_night
+
+    first_adjust = 0.0
+    if tariff.first_hour_price is not None:
+        first_adjust = tariff.first_hour_price - (night if _NIGHT_HOURS[start_hour] else price)
+
+    cap = tariff.daily_cap
+    if cap is None:
+        total = full_days * day_cost + rest_cost + first_adjust
+    elif full_days == 0:
+        total = min(rest_cost + first_adjust, cap)
+    else:
+        total = min(day_cost + first_adjust, cap) + (full_days - 1) * min(day_cost, cap) + min(rest_cost, cap)
+    return round(total, 2)
+
+def compute_costs(parking_epochs, leaving_epochs, tariff):
+    """Costs for a batch of stays that share one tariff. Returns a list of floats.
+
+    Uses NumPy when it's installed, otherwise applies compute_cost to each stay.
+    """
+    if np is None:
+        return [compute_cost(p, l, tariff) for p, l in zip(parking_epochs, leaving_epochs)]
+
+    parking = np.asarray(parking_epochs, dtype=np.float64)
+    duration = np.asarray(leaving_epochs, dtype=np.float64) - parking
+    hours = np.maximum(np.ceil(duration / 3600.0), MIN_BILLED_HOURS).astype(np.int64)
+    price = tariff.price_per_hour
+    night = tariff.night_price_per_hour if tariff.night_price_per_hour is not None else price
+
+    night_hours = np.asarray(_NIGHT_HOURS)
+    night_cumulative = np.asarray(_NIGHT_CUMULATIVE)
+    start_hour = (((parking + _LOCAL_OFFSET) % 86400) // 3600).astype(np.int64)
+    full_days, rest = np.divmod(hours, 24)
+    day_cost = price * (24 - _NIGHT_PER_DAY) + night * _NIGHT_PER_DAY
+    rest_night = night_cumulative[start_hour + rest] - night_cumulative[start_hour]
+    rest_cost = price * (rest - rest_night) + night * rest_night
+
+    if tariff.first_hour_price is not None:
+        first_adjust = tariff.first_hour_price - np.where(night_hours[start_hour], night, price)
+    else:
+        first_adjust = 0.0
+
+    cap = tariff.daily_cap
+    if cap is None:
+        total = full_days * day_cost + rest_cost + first_adjust
+    else:
+        capped_day = min(day_cost, cap)
+        total = np.where(
+            full_days == 0,
+            np.minimum(rest_cost + first_adjust, cap),
+            np.minimum(day_cost + first_adjust, cap) + np.maximum(full_days - 1, 0) * capped_day + np.minimum(rest_cost, cap),
+        )
+    return np.round(total, 2).tolist()
+
+
+def recompute_costs(conn, lot_id=None, batch_size=RECOMPUTE_BATCH_SIZE, dry_run=False):
+    """Re-bills completed reservations (live and archived) with each lot's current tariff, in keyset batches.
+
+    Each batch is read, priced with compute_costs and written back (only the rows whose
+    cost changed) in its own short transaction. Returns (reservations seen, costs changed).
+    """
+    lot_filter, lot_params = ('AND ps.lot_id = ?', (lot_id,)) if lot_id is not None else ('', ())
+    seen = changed = 0
+    for table in ('parking_reservations', 'parking_reservations_archive'):
+        active_clause = 'AND pr.is_active = 0' if table == 'parking_reservations' else ''
+        last_id = 0
+        while True:
+            rows = conn.execute(f'''
+                SELECT pr.id, pr.parking_timestamp, pr.leaving_timestamp, pr.total_cost,
+                       pl.price_per_hour, pl.first_hour_price, pl.daily_cap, pl.night_price_per_hour
+                FROM {table} pr
+                JOIN parking_spots ps ON pr.spot_id = ps.id
+                JOIN parking_lots pl ON ps.lot_id = pl.id
+                WHERE pr.id > ? {active_clause} AND pr.leaving_timestamp IS NOT NULL {lot_filter}
+                ORDER BY pr.id
+                LIMIT ?
+            ''', (last_id, *lot_params, batch_size)).fetchall()
+            if not rows:
+                break
+            last_id = rows[-1]['id']
+            seen += len(rows)
+
+            by_tariff = {}
+            for row in rows:
+                tariff = Tariff.from_row(row)
+                by_tariff.setdefault(tariff.key(), (tariff, []))[1].append(row)
+            updates = []
+            for tariff, group in by_tariff.values():
+                costs = compute_costs([r['parking_timestamp'] for r in group],
+                                      [r['leaving_timestamp'] for r in group], tariff)
+                updates.extend((cost, r['id']) for r, cost in zip(group, costs) if cost != r['total_cost'])
+            changed += len(updates)
+
+            if updates and not dry_run:
+                begin_write(conn)
+                try:
+                    conn.executemany(f'UPDATE {table} SET total_cost = ?, updated_at = CURRENT_TIMESTAMP WHERE id = ?', updates)
+                    conn.commit()
+                except BaseException:
+                    conn.rollback()
+                    raise
+    return seen, changed
+
+
+def benchmark(n=1_000_000, tariff=None):
+    """Times compute_costs over n synthetic stays; returns reservations per second."""
+    import random
+
+    rng = random.Random(42)
+    tariff = tariff or Tariff(40.0, first_hour_price=60.0, daily_cap=600.0, night_price_per_hour=20.0)
+    now = time.time()
+    parking = [now - rng.uniform(0, 365 * 86400) for _ in range(n)]
+    leaving = [p + rng.uniform(60, 3 * 86400) for p in parking]
+    started = time.perf_counter()
+    compute_costs(parking, leaving, tariff)
+    return n / (time.perf_counter() - started)
+
+
+if __name__ == '__main__':
+    import sys
+
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 1_000_000
+    engine = 'NumPy' if np is not None else 'pure Python'
+    print(f"Billing {count} reservations ({engine}): {benchmark(count):,.0f} reservations/second")
@@ -1,82 +1,246 @@
 import sqlite3
 from werkzeug.security import generate_password_hash 
+from flask import current_app, g
 import os 
+import queue
+import threading
+from urllib.request import pathname2url
+from models import migrations, profiling
 
-DATABASE = 'models/database.db' 
+# DATABASE_PATH overrides the default file, which sits next to this module wherever the app is started from
+DATABASE = os.environ.get('DATABASE_PATH') or os.path.join(os.path.dirname(os.path.abspath(__file__)), 'database.db')
+BUSY_TIMEOUT_MS = 5000
+POOL_SIZE = 8
+DEFAULT_ADMIN_USERNAME = 'admin'
+DEFAULT_ADMIN_PASSWORD = 'adminpassword'
 
-def get_db_connection():
-    """Establishes a connection to the SQLite database."""
-    conn = sqlite3.connect(DATABASE)
-    conn.row_factory = sqlite3.Row 
-    return conn
+class SQLiteBackend:
+    """Everything that depends on the database engine, behind one object.
 
-def init_db():
-    """Initializes the database schema and creates the default admin user."""
-    conn = get_db_connection()
+    That is connecting, write transactions, new row ids, transaction state, the driver's
+    errors, and the schema itself: the base tables created here plus the migrations in
+    models/migrations.py, whose triggers and PRAGMA user_version bookkeeping are SQLite's.
+    The query modules only issue portable SQL with qmark (?) parameters and come here
+    for the rest. Only this backend exists; a PostgreSQL one would need its own
+    schema and migrations, and connections that accept ? parameters.
+    """
+
+    name = 'sqlite'
+    Error = sqlite3.Error
+    IntegrityError = sqlite3.IntegrityError
+
+    def connect(self, database):
+        # query profiling (models/profiling.py) hooks into SQLite's connection class
+        factory = profiling.ProfiledConnection if profiling.enabled else sqlite3.Connection
+        conn = sqlite3.connect(database, timeout=BUSY_TIMEOUT_MS / 1000, check_same_thread=False, factory=factory)
+        conn.row_factory = sqlite3.Row 
+        # WAL lets dashboard reads carry on while a booking is committing
+        conn.execute('PRAGMA journal_mode = WAL')
+        conn.execute('PRAGMA synchronous = NORMAL')
+        conn.execute(f'PRAGMA busy_timeout = {BUSY_TIMEOUT_MS}')
+        conn.execute('PRAGMA foreign_keys = ON')
+        return conn
+
+    def begin_write(self, conn):
+        # take the write lock up front, so the reads that decide a write can't go stale before it
+        conn.execute('BEGIN IMMEDIATE')
+
+    def in_transaction(self, conn):
+        return conn.in_transaction
+
+    def insert(self, conn, sql, params=()):
+        return conn.execute(sql, params).lastrowid
+
+    def migrate(self, conn, verbose=False):
+        return migrations.migrate(conn, verbose)
+
+    def latest_version(self):
+        return migrations.latest_version()
+
+    def read_schema_version(self, database):
+        """The schema version, read without creating or writing anything (None if there's no database)."""
+        if not os.path.exists(database):
+            return None
+        conn = sqlite3.connect(f'file:{pathname2url(os.path.abspath(database))}?mode=ro', uri=True)
+        try:
+            return migrations.get_schema_version(conn)
+        finally:
+            conn.close()
+
+    def create_schema(self, conn):
+        """Drops every table and builds the current schema from scratch."""
+        cursor = conn.cursor()
+
+        # tables added by migrations go too, so a reset doesn't bring back old history or counters
+        cursor.execute("DROP TABLE IF EXISTS spot_slots")  # references spots and users, so it goes first
+        cursor.execute("DROP TABLE IF EXISTS parking_reservations_archive")
+        cursor.execute("DROP TABLE IF EXISTS lot_hourly_stats")
+        cursor.execute("DROP TABLE IF EXISTS parking_summary")
+        cursor.execute("DROP TABLE IF EXISTS change_seq")
+        cursor.execute("DROP TABLE IF EXISTS parking_reservations")
+        cursor.execute("DROP TABLE IF EXISTS parking_spots")
+        cursor.execute("DROP TABLE IF EXISTS parking_lots")
+        cursor.execute("DROP TABLE IF EXISTS users")
+
+        cursor.execute('''
+            CREATE TABLE users (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                username TEXT NOT NULL UNIQUE,
+                password_hash TEXT NOT NULL,
+                role TEXT NOT NULL DEFAULT 'user', -- 'user' or 'admin'
+                email TEXT UNIQUE,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+        ''')
+
+        cursor.execute('''
+            CREATE TABLE parking_lots (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                prime_location_name TEXT NOT NULL UNIQUE,
+                address TEXT NOT NULL,
+                pin_code TEXT NOT NULL,
+                price_per_hour REAL NOT NULL,
+                maximum_number_of_spots INTEGER NOT NULL,
+                current_occupied_spots INTEGER DEFAULT 0,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+        ''')
+
+        cursor.execute('''
+            CREATE TABLE parking_spots (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                lot_id INTEGER NOT NULL,
+                spot_number TEXT NOT NULL, -- e.g., 'A1', 'B2'
+                status TEXT NOT NULL DEFAULT 'Available', -- 'Available' or 'Occupied'
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                FOREIGN KEY (lot_id) REFERENCES parking_lots (id) ON DELETE CASCADE,
+                UNIQUE (lot_id, spot_number) -- Ensure spot numbers are unique within a lot
+            )
+        ''')
+
+        cursor.execute('''
+            CREATE TABLE parking_reservations (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                spot_id INTEGER NOT NULL,
+                user_id INTEGER NOT NULL,
+                parking_timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                leaving_timestamp TIMESTAMP, -- Nullable until vehicle leaves
+                total_cost REAL, -- Nullable until vehicle leaves
+                is_active INTEGER NOT NULL DEFAULT 1, -- 1 for active, 0 for completed/inactive
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                FOREIGN KEY (spot_id) REFERENCES parking_spots (id) ON DELETE CASCADE,
+                FOREIGN KEY (user_id) REFERENCES users (id) ON DELETE CASCADE
+            )
+        ''')
+
+        cursor.execute('PRAGMA user_version = 0')
+        self.migrate(conn)
+
+BACKENDS = {'sqlite': SQLiteBackend}
+
+def _load_backend(name):
+    if name not in BACKENDS:
+        raise RuntimeError(f"Unknown DATABASE_BACKEND {name!r}; available: {', '.join(sorted(BACKENDS))}.")
+    return BACKENDS[name]()
+
+# DATABASE_BACKEND picks the driver; sqlite is the only one shipped
+backend = _load_backend(os.environ.get('DATABASE_BACKEND', 'sqlite'))
+
+# driver errors under neutral names, so app code catches these instead of importing the driver
+DatabaseError = backend.Error
+IntegrityError = backend.IntegrityError
+
+def get_db_connection(database=None):
+    """Opens a configured connection to the database."""
+    return backend.connect(database or DATABASE)
+
+def begin_write(conn):
+    """Starts a transaction that holds the write lock until commit or rollback."""
+    backend.begin_write(conn)
+
+def migrate(conn, verbose=False):
+    """Brings an existing database up to the current schema; returns its version."""
+    return backend.migrate(conn, verbose)
+
+def insert(conn, sql, params=()):
+    """Runs an INSERT of one row and returns the new row's id."""
+    return backend.insert(conn, sql, params)
+
+class ConnectionPool:
+    """Keeps configured connections around so requests don't reconnect every time."""
+
+    def __init__(self, database, size=POOL_SIZE):
+        self.database = database
+        self._idle = queue.LifoQueue(maxsize=size)
+
+    def acquire(self):
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            return get_db_connection(self.database)
+
+    def release(self, conn):
+        if backend.in_transaction(conn):
+            conn.rollback()
+        try:
+            self._idle.put_nowait(conn)
+        except queue.Full:
+            conn.close()
+
+    def fill(self, count):
+        """Opens connections up front until count are idle, so the first requests don't connect."""
+        while self._idle.qsize() < min(count, self._idle.maxsize):
+            self._idle.put_nowait(get_db_connection(self.database))
+
+    def close_all(self):
+        while True:
+            try:
+                self._idle.get_nowait().close()
+            except queue.Empty:
+                break
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+def get_pool(database=None, size=POOL_SIZE):
+    """Returns the shared pool for a database file, creating it (with room for size idle connections) on first use."""
+    database = database or DATABASE
+    with _pools_lock:
+        if database not in _pools:
+            _pools[database] = ConnectionPool(database, size)
+        return _pools[database]
+
+def get_db():
+    """Returns the pooled connection bound to the current request."""
+    if 'db' not in g:
+        g.db = get_pool(current_app.config.get('DATABASE', DATABASE)).acquire()
+    return g.db
+
+def close_db(e=None):
+    """Hands the request's connection back to the pool."""
+    conn = g.pop('db', None)
+    if conn is not None:
+        get_pool(current_app.config.get('DATABASE', DATABASE)).release(conn)
+
+def init_app(app):
+    app.teardown_appcontext(close_db)
+
+def init_db(database=None, admin_password=None):
+    """Initializes the database schema and creates the default admin user.
+
+    admin_password overrides ADMIN_PASSWORD for the admin account.
+    """
+    conn = get_db_connection(database)
     cursor = conn.cursor()
 
-    cursor.execute("DROP TABLE IF EXISTS parking_reservations")
-    cursor.execute("DROP TABLE IF EXISTS parking_spots")
-    cursor.execute("DROP TABLE IF EXISTS parking_lots")
-    cursor.execute("DROP TABLE IF EXISTS users")
-
-    cursor.execute('''
-        CREATE TABLE users (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            username TEXT NOT NULL UNIQUE,
-            password_hash TEXT NOT NULL,
-            role TEXT NOT NULL DEFAULT 'user', -- 'user' or 'admin'
-            email TEXT UNIQUE,
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-        )
-    ''')
-
-    cursor.execute('''
-        CREATE TABLE parking_lots (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            prime_location_name TEXT NOT NULL UNIQUE,
-            address TEXT NOT NULL,
-            pin_code TEXT NOT NULL,
-            price_per_hour REAL NOT NULL,
-            maximum_number_of_spots INTEGER NOT NULL,
-            current_occupied_spots INTEGER DEFAULT 0,
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-        )
-    ''')
-
-    cursor.execute('''
-        CREATE TABLE parking_spots (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            lot_id INTEGER NOT NULL,
-            spot_number TEXT NOT NULL, -- e.g., 'A1', 'B2'
-            status TEXT NOT NULL DEFAULT 'Available', -- 'Available' or 'Occupied'
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            FOREIGN KEY (lot_id) REFERENCES parking_lots (id) ON DELETE CASCADE,
-            UNIQUE (lot_id, spot_number) -- Ensure spot numbers are unique within a lot
-        )
-    ''')
-
-    cursor.execute('''
-        CREATE TABLE parking_reservations (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            spot_id INTEGER NOT NULL,
-            user_id INTEGER NOT NULL,
-            parking_timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            leaving_timestamp TIMESTAMP, -- Nullable until vehicle leaves
-            total_cost REAL, -- Nullable until vehicle leaves
-            is_active INTEGER NOT NULL DEFAULT 1, -- 1 for active, 0 for completed/inactive
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            FOREIGN KEY (spot_id) REFERENCES parking_spots (id) ON DELETE CASCADE,
-            FOREIGN KEY (user_id) REFERENCES users (id) ON DELETE CASCADE
-        )
-    ''')
-
-    admin_username = os.environ.get('ADMIN_USERNAME', 'admin') 
-    admin_password = os.environ.get('ADMIN_PASSWORD', 'adminpassword') 
+    backend.create_schema(conn)
+
+    admin_username = os.environ.get('ADMIN_USERNAME', DEFAULT_ADMIN_USERNAME) 
+    admin_password = admin_password or os.environ.get('ADMIN_PASSWORD', DEFAULT_ADMIN_PASSWORD) 
     admin_email = os.environ.get('ADMIN_EMAIL', 'admin@example.com') 
 
     hashed_password = generate_password_hash(admin_password)
@@ -86,7 +250,7 @@ def init_db():
                        (admin_username, hashed_password, 'admin', admin_email))
         conn.commit()
         print(f"Admin user '{admin_username}' created successfully.")
-    except sqlite3.IntegrityError:
+    except IntegrityError:
         print(f"Admin user '{admin_username}' already exists.")
         conn.rollback() 
 
@@ -0,0 +1,142 @@
+import json
+import queue
+import threading
+import time
+
+from models.database import DatabaseError, get_db_connection
+
+SUBSCRIBER_QUEUE_SIZE = 100
+KEEPALIVE_SECONDS = 15
+POLL_SECONDS = 1.0  # how often open streams look for changes made by other processes
+
+class EventBroker:
+    """Tiny in-process pub/sub: each publish is handed once to every open stream's queue.
+
+    Changes this process commits are published right away, with spot details. While any
+    stream is open, a poller thread also follows the change sequence (migration 6) and
+    publishes the counts of lots changed by other workers, the CLI or the overstay sweep.
+    Lot versions already published here are skipped, so a local change isn't sent twice.
+    """
+
+    def __init__(self, database=None, poll_seconds=POLL_SECONDS, logger=None):
+        self.database = database
+        self.poll_seconds = poll_seconds
+        self.logger = logger
+        self._subscribers = set()
+        self._lock = threading.Lock()
+        self._poller = None
+        self._seq = None
+        self._published = {}  # lot id -> last version sent to the streams
+
+    def subscribe(self):
+        q = queue.Queue(maxsize=SUBSCRIBER_QUEUE_SIZE)
+        with self._lock:
+            self._subscribers.add(q)
+            if self.database is not None and self._poller is None:
+                self._poller = threading.Thread(target=self._poll, name='occupancy-poller', daemon=True)
+                self._poller.start()
+        return q
+
+    def unsubscribe(self, q):
+        with self._lock:
+            self._subscribers.discard(q)
+
+    def publish(self, event, version=None):
+        """Queues event for every stream; version is the lot's version the event reflects, if known."""
+        with self._lock:
+            subscribers = list(self._subscribers)
+            if version is not None:
+                lot_id = event['lot_id']
+                self._published[lot_id] = max(version, self._published.get(lot_id, version))
+        for q in subscribers:
+            try:
+                q.put_nowait(event)
+            except queue.Full:
+                # a stalled client shouldn't hold anyone up; it loses the oldest delta instead
+                try:
+                    q.get_nowait()
+                    q.put_nowait(event)
+                except (queue.Empty, queue.Full):
+                    pass
+
+    def _poll(self):
+        conn = get_db_connection(self.database)
+        try:
+            self._seq = None
+            while True:
+                try:
+                    self._publish_changes(conn)
+                except DatabaseError as e:
+                    if self.logger:
+                        self.logger.warning('Polling for occupancy changes failed: %s', e)
+                time.sleep(self.poll_seconds)
+                with self._lock:
+                    if not self._subscribers:
+                        self._poller = None
+                        return
+        finally:
+            conn.close()
+
+    def _publish_changes(self, conn):
+        seq = conn.execute('SELECT seq FROM change_seq WHERE id = 1').fetchone()[0]
+        if self._seq is None or seq < self._seq:
+            # first look, or the database was re-initialized: start from here
+            if self._seq is not None:
+                with self._lock:
+                    self._published.clear()
+            self._seq = seq
+            return
+        if seq == self._seq:
+            return
+        lots = conn.execute('''
+            SELECT id, version, current_occupied_spots, maximum_number_of_spots
+            FROM parking_lots WHERE version > ?
+        ''', (self._seq,)).fetchall()
+        self._seq = seq
+        for lot in lots:
+            with self._lock:
+                if self._published.get(lot['id'], -1) >= lot['version']:
+                    continue
+            self.publish(lot_event(lot), lot['version'])
+
+    def stream(self, lot_id=None):
+        """Yields Server-Sent Events for occupancy changes, optionally only for one lot."""
+        q = self.subscribe()
+        try:
+            yield 'retry: 5000\n\n'
+            while True:
+                try:
+                    event = q.get(timeout=KEEPALIVE_SECONDS)
+                except queue.Empty:
+                    yield ': keepalive\n\n'
+                    continue
+                if lot_id is not None and event['lot_id'] != lot_id:
+                    continue
+                yield f"event: occupancy\ndata: {json.dumps(event)}\n\n"
+        finally:
+            self.unsubscribe(q)
+
+
+def lot_event(lot, delta=0, spot_id=None, spot_number=None, spot_status=None):
+    """The occupancy event for a parking_lots row (id, current_occupied_spots, maximum_number_of_spots)."""
+    return {
+        'lot_id': lot['id'],
+        'delta': delta,
+        'occupied': lot['current_occupied_spots'],
+        'capacity': lot['maximum_number_of_spots'],
+        'available': lot['maximum_number_of_spots'] - lot['current_occupied_spots'],
+        'spot_id': spot_id,
+        'spot_number': spot_number,
+        'spot_status': spot_status,
+    }
+
+
+_brokers = {}
+_brokers_lock = threading.Lock()
+
+def get_event_broker(database, logger=None):
+    """Returns the process-wide event broker for a database file."""
+    with _brokers_lock:
+        if database not in _brokers:
+            _brokers[database] = EventBroker(database, logger=logger)
+        return _brokers[database]
@@ -0,0 +1,101 @@
+import csv
+import io
+import json
+
+# Streaming report exports. Each report is one or more plain SELECTs walked with
+# fetchmany, and rows are encoded a chunk at a time, so an export of any size holds
+# only EXPORT_CHUNK_ROWS rows in memory and the first bytes go out right away.
+# The row-level queries ORDER BY the reservation's primary key, which SQLite answers
+# by scanning the table in rowid order: the order is fixed without a sort step that
+# would have to read the whole result before returning the first row.
+
+EXPORT_CHUNK_ROWS = 1000
+EXPORT_FORMATS = {'csv': 'text/csv', 'ndjson': 'application/x-ndjson'}
+
+RESERVATION_COLUMNS = ('id', 'lot_id', 'prime_location_name', 'spot_number', 'user_id', 'username',
+                       'parking_timestamp', 'leaving_timestamp', 'total_cost', 'is_active')
+
+def _reservation_queries(lot_id):
+    # archived (older) rows first, then the live table; each read in rowid order
+    lot_filter, params = ('WHERE ps.lot_id = ?', (lot_id,)) if lot_id is not None else ('', ())
+    for table, is_active in (('parking_reservations_archive', '0'), ('parking_reservations', 'pr.is_active')):
+        yield f'''
+            SELECT pr.id, ps.lot_id, pl.prime_location_name, ps.spot_number, pr.user_id, u.username,
+                   pr.parking_timestamp, pr.leaving_timestamp, pr.total_cost, {is_active} AS is_active
+            FROM {table} pr
+            JOIN parking_spots ps ON pr.spot_id = ps.id
+            JOIN parking_lots pl ON ps.lot_id = pl.id
+            LEFT JOIN users u ON pr.user_id = u.id
+            {lot_filter}
+            ORDER BY pr.id
+        ''', params
+
+def _revenue_queries(lot_id):
+    # daily revenue per lot; the GROUP BY b-tree holds one row per lot and day, not per reservation
+    lot_filter, params = ('WHERE s.lot_id = ?', (lot_id,)) if lot_id is not None else ('', ())
+    yield f'''
+        SELECT s.lot_id, pl.prime_location_name, substr(s.hour, 1, 10) AS day,
+               SUM(s.bookings) AS bookings, SUM(s.releases) AS releases, ROUND(SUM(s.revenue), 2) AS revenue
+        FROM lot_hourly_stats s
+        JOIN parking_lots pl ON s.lot_id = pl.id
+        {lot_filter}
+        GROUP BY s.lot_id, day
+        ORDER BY s.lot_id, day
+    ''', params
+
+def _utilization_queries(lot_id):
+    lot_filter, params = ('WHERE s.lot_id = ?', (lot_id,)) if lot_id is not None else ('', ())
+    yield f'''
+        SELECT s.lot_id, pl.prime_location_name, s.hour, s.bookings, s.releases, s.revenue,
+               s.peak_occupied, s.capacity,
+               CASE WHEN s.capacity > 0 THEN ROUND(100.0 * s.peak_occupied / s.capacity, 1) END AS utilization
+        FROM lot_hourly_stats s
+        JOIN parking_lots pl ON s.lot_id = pl.id
+        {lot_filter}
+        ORDER BY s.lot_id, s.hour
+    ''', params
+
+REPORTS = {
+    'reservations': _reservation_queries,
+    'revenue': _revenue_queries,
+    'utilization': _utilization_queries,
+}
+
+def iter_rows(conn, report, lot_id=None, chunk_rows=EXPORT_CHUNK_ROWS):
+    """Yields (column names, list of row tuples) chunks of a report."""
+    for sql, params in REPORTS[report](lot_id):
+        cursor = conn.execute(sql, params)
+        columns = [d[0] for d in cursor.description]
+        try:
+            while True:
+                rows = cursor.fetchmany(chunk_rows)
+                if not rows:
+                    break
+                yield columns, [tuple(row) for row in rows]
+        finally:
+            cursor.close()
+
+def stream_report(conn, report, fmt='csv', lot_id=None, chunk_rows=EXPORT_CHUNK_ROWS):
+    """Yields a report encoded as CSV (with a header line) or NDJSON, one text chunk per batch of rows."""
+    if fmt == 'ndjson':
+        for columns, rows in iter_rows(conn, report, lot_id, chunk_rows):
+            yield ''.join(json.dumps(dict(zip(columns, row))) + '\n' for row in rows)
+        return
+
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    header_written = False
+    for columns, rows in iter_rows(conn, report, lot_id, chunk_rows):
+        if not header_written:
+            writer.writerow(columns)
+            header_written = True
+        writer.writerows(rows)
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate(0)
+    if not header_written:
+        # empty report: still send the header so the file opens with the right columns
+        cursor = conn.execute(*next(REPORTS[report](lot_id)))
+        writer.writerow([d[0] for d in cursor.description])
+        cursor.close()
+        yield buffer.getvalue()
@@ -0,0 +1,84 @@
+import sys
+import threading
+from collections import OrderedDict
+
+# Rendered-HTML cache for the dashboards. An entry is stored under a key such as
+# ('spots', lot_id) along with the version it was rendered at: the change tracker's
+# lot/user version or its global sequence, which booking, release and spot edits
+# bump through the migration 6 triggers. A lookup with any other version is a miss,
+# and the stale entry is replaced by the next put, so entries never need explicit
+# invalidation. The total size of the cached strings is held under a budget,
+# evicting the least recently used entries first.
+
+FRAGMENT_CACHE_BYTES = 8 * 1024 * 1024
+
+class FragmentCache:
+    """LRU of rendered fragments by key, each valid for one version, within max_bytes."""
+
+    def __init__(self, max_bytes=FRAGMENT_CACHE_BYTES):
+        self.max_bytes = max_bytes
+        self.size = 0
+        self._entries = OrderedDict()  # key -> (version, html, size)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key, version):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[0] != version:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def put(self, key, version, html):
+        size = sys.getsizeof(html)
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self.size -= old[2]
+            if size > self.max_bytes:
+                return  # would evict everything else for one page
+            self._entries[key] = (version, html, size)
+            self.size += size
+            while self.size > self.max_bytes:
+                _, (_, _, evicted) = self._entries.popitem(last=False)
+                self.size -= evicted
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.size = 0
+
+    def render(self):
+        """Counters in Prometheus text exposition format, for /metrics."""
+        with self._lock:
+            values = (('hits', self.hits), ('misses', self.misses), ('evictions', self.evictions))
+            entries, size = len(self._entries), self.size
+        lines = []
+        for name, value in values:
+            lines += [f'# HELP parking_fragment_cache_{name}_total Fragment cache {name}.',
+                      f'# TYPE parking_fragment_cache_{name}_total counter',
+                      f'parking_fragment_cache_{name}_total {value}']
+        lines += ['# HELP parking_fragment_cache_entries Fragments currently cached.',
+                  '# TYPE parking_fragment_cache_entries gauge',
+                  f'parking_fragment_cache_entries {entries}',
+                  '# HELP parking_fragment_cache_bytes Memory held by cached fragments.',
+                  '# TYPE parking_fragment_cache_bytes gauge',
+                  f'parking_fragment_cache_bytes {size}']
+        return '\n'.join(lines) + '\n'
+
+
+_caches = {}
+_caches_lock = threading.Lock()
+
+def get_fragment_cache(database, max_bytes=FRAGMENT_CACHE_BYTES):
+    """Returns the process-wide fragment cache for a database file."""
+    with _caches_lock:
+        if database not in _caches:
+            _caches[database] = FragmentCache(max_bytes)
+        return _caches[database]
@@ -0,0 +1,195 @@
+import heapq
+import math
+import threading
+import time
+
+from models.versions import VERSION_SYNC_INTERVAL
+
+# Nearest-available-lot search. LotIndex keeps every lot that has coordinates in a
+# uniform latitude/longitude grid, where a lot sits in a cell only while it has a free spot.
+# A query walks rings of cells outward from the searcher and stops once no
+# unvisited ring can hold anything closer than the k-th lot already found, so it
+# only looks at lots near the answer however many lots exist.
+#
+# Like the change tracker it mirrors the database incrementally: lots whose version
+# moved past the last seen change sequence are re-read (idx_lots_version), at most
+# once per sync interval or right after this process wrote.
+
+GRID_CELL_DEGREES = 0.02  # about 2.2 km north-south
+EARTH_RADIUS_KM = 6371.0088
+KM_PER_DEGREE = math.pi * EARTH_RADIUS_KM / 180
+NEAREST_DEFAULT = 5
+NEAREST_MAX = 50
+
+def haversine_km(lat1, lng1, lat2, lng2):
+    lat1, lng1, lat2, lng2 = map(math.radians, (lat1, lng1, lat2, lng2))
+    a = math.sin((lat2 - lat1) / 2) ** 2 + math.cos(lat1) * math.cos(lat2) * math.sin((lng2 - lng1) / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * math.asin(min(1.0, math.sqrt(a)))
+
+
+class LotIndex:
+    """Grid of lots with free spots, for k-nearest queries."""
+
+    def __init__(self, cell_degrees=GRID_CELL_DEGREES, sync_interval=VERSION_SYNC_INTERVAL):
+        self.cell_degrees = cell_degrees
+        self.sync_interval = sync_interval
+        self.seq = None
+        self._lots = {}   # lot id -> (lat, lng, pin_code, free spots)
+        self._cells = {}  # (row, col) -> set of lot ids with a free spot
+        self._pins = {}   # pin code -> set of lot ids
+        self._next_sync = 0.0
+        self._lock = threading.RLock()
+
+    def _cell(self, lat, lng):
+        return int(math.floor(lat / self.cell_degrees)), int(math.floor(lng / self.cell_degrees))
+
+    def _remove(self, lot_id):
+        old = self._lots.pop(lot_id, None)
+        if old is None:
+            return
+        cell = self._cell(old[0], old[1])
+        members = self._cells.get(cell)
+        if members is not None:
+            members.discard(lot_id)
+            if not members:
+                del self._cells[cell]
+        pins = self._pins.get(old[2])
+        if pins is not None:
+            pins.discard(lot_id)
+            if not pins:
+                del self._pins[old[2]]
+
+    def update(self, lot_id, lat, lng, pin_code, free):
+        """Adds, moves or drops a lot; lots without coordinates aren't indexed."""
+        with self._lock:
+            self._remove(lot_id)
+            if lat is None or lng is None:
+                return
+            self._lots[lot_id] = (lat, lng, pin_code, free)
+            self._pins.setdefault(pin_code, set()).add(lot_id)
+            if free > 0:
+                self._cells.setdefault(self._cell(lat, lng), set()).add(lot_id)
+
+    def _load(self, rows, replace):
+        if replace:
+            self._lots, self._cells, self._pins = {}, {}, {}
+        for row in rows:
+            self.update(row['id'], row['latitude'], row['longitude'], row['pin_code'], row['free'])
+
+    def mark_dirty(self):
+        self._next_sync = 0.0
+
+    def sync(self, get_conn):
+        """Catches up with changes from any process if due; get_conn is only called when a check is needed."""
+        if time.monotonic() < self._next_sync:
+            return
+        with self._lock:
+            if time.monotonic() < self._next_sync:
+                return
+            conn = get_conn()
+            seq = conn.execute('SELECT seq FROM change_seq WHERE id = 1').fetchone()[0]
+            if seq != self.seq:
+                select = ('SELECT id, latitude, longitude, pin_code, '
+                          'maximum_number_of_spots - current_occupied_spots AS free FROM parking_lots')
+                if self.seq is None or seq < self.seq:
+                    self._load(conn.execute(select), replace=True)
+                else:
+                    self._load(conn.execute(f'{select} WHERE version > ?', (self.seq,)), replace=False)
+                    located = conn.execute('SELECT COUNT(*) FROM parking_lots WHERE latitude IS NOT NULL').fetchone()[0]
+                    if located != len(self._lots):
+                        # a lot was deleted; deletions leave no version behind to pick up
+                        self._load(conn.execute(select), replace=True)
+                self.seq = seq
+            self._next_sync = time.monotonic() + self.sync_interval
+
+    def pin_centroid(self, pin_code):
+        """Mean position of the indexed lots with this pin code, or None."""
+        with self._lock:
+            points = [self._lots[lot_id][:2] for lot_id in self._pins.get(pin_code, ())]
+        if not points:
+            return None
+        return sum(p[0] for p in points) / len(points), sum(p[1] for p in points) / len(points)
+
+    def nearest(self, lat, lng, k=NEAREST_DEFAULT):
+        """The k closest lots with a free spot, as [(distance km, lot id, free spots)], closest first."""
+        with self._lock:
+            if not self._cells:
+                return []
+            row, col = self._cell(lat, lng)
+            found = []  # max-heap of the best k by negated distance
+            ring = 0
+            while True:
+                if 8 * ring > len(self._cells):
+                    # the ring walk would touch more empty cells than there are filled ones: finish by scanning
+                    cells = [cell for cell in self._cells if max(abs(cell[0] - row), abs(cell[1] - col)) >= ring]
+                    for cell in cells:
+                        self._collect(self._cells[cell], lat, lng, k, found)
+                    break
+                for cell in self._ring(row, col, ring):
+                    members = self._cells.get(cell)
+                    if members:
+                        self._collect(members, lat, lng, k, found)
+                # anything in ring + 1 or beyond is at least ring cells away in latitude or longitude;
+                # a degree of longitude is shortest at the latitude farthest from the equator
+                edge_lat = min(90.0, abs(lat) + (ring + 1) * self.cell_degrees)
+                reach_km = ring * self.cell_degrees * KM_PER_DEGREE * math.cos(math.radians(edge_lat))
+                if len(found) == k and -found[0][0] <= reach_km:
+                    break
+                ring += 1
+            return sorted((-neg, lot_id, free) for neg, lot_id, free in found)
+
+    @staticmethod
+    def _ring(row, col, ring):
+        if ring == 0:
+            yield row, col
+            return
+        for c in range(col - ring, col + ring + 1):
+            yield row - ring, c
+            yield row + ring, c
+        for r in range(row - ring + 1, row + ring):
+            yield r, col - ring
+            yield r, col + ring
+
+    def _collect(self, members, lat, lng, k, found):
+        for lot_id in members:
+            lot_lat, lot_lng, _, free = self._lots[lot_id]
+            distance = haversine_km(lat, lng, lot_lat, lot_lng)
+            if len(found) < k:
+                heapq.heappush(found, (-distance, lot_id, free))
+            elif distance < -found[0][0]:
+                heapq.heapreplace(found, (-distance, lot_id, free))
+
+
+_indexes = {}
+_indexes_lock = threading.Lock()
+
+def get_lot_index(database):
+    """Returns the process-wide lot index for a database file."""
+    with _indexes_lock:
+        if database not in _indexes:
+            _indexes[database] = LotIndex()
+        return _indexes[database]
+
+
+def benchmark(lots=50000, queries=10000, seed=7):
+    """Builds an index of random lots around a city and times nearest() queries; returns microseconds per query."""
+    import random
+
+    rng = random.Random(seed)
+    index = LotIndex()
+    for lot_id in range(1, lots + 1):
+        # a 100 x 100 km metro area, a third of the lots full
+        index.update(lot_id, 12.5 + rng.uniform(-0.45, 0.45), 77.5 + rng.uniform(-0.45, 0.45),
+                     str(560000 + lot_id % 100), rng.choice((0, 3, 10)))
+    points = [(12.5 + rng.uniform(-0.5, 0.5), 77.5 + rng.uniform(-0.5, 0.5)) for _ in range(queries)]
+    started = time.perf_counter()
+    for lat, lng in points:
+        index.nearest(lat, lng, NEAREST_DEFAULT)
+    return (time.perf_counter() - started) / queries * 1e6
+
+
+if __name__ == '__main__':
+    import sys
+
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 50000
+    print(f"{count} lots: {benchmark(count):.1f} microseconds per nearest-5 query")
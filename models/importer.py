@@ -0,0 +1,132 @@
+import csv
+import json
+
+from models.database import begin_write
+from models.lots import insert_lot, parse_lot_form
+from models.provisioning import iter_spot_rows
+
+# Bulk import of parking lots for `flask import-lots`. Records are read one at a time
+# (CSV or NDJSON; a plain JSON array is loaded whole) and checked with the same
+# parse_lot_form as the add lot form. Valid lots are written IMPORT_BATCH_LOTS at a
+# time: one transaction per batch, with all of the batch's spots in one executemany.
+#
+# A record may carry an explicit spot layout in a `spots` field: a JSON list of spot
+# names, or in CSV the names separated by '|'. Without it, spots are named from the
+# lot's template like lots added through the form.
+
+IMPORT_BATCH_LOTS = 200
+IMPORT_FORMATS = ('csv', 'ndjson', 'json')
+SPOT_SEPARATOR = '|'
+
+def guess_format(filename):
+    ext = filename.rsplit('.', 1)[-1].lower()
+    return {'json': 'json', 'ndjson': 'ndjson', 'jsonl': 'ndjson'}.get(ext, 'csv')
+
+def read_records(stream, fmt='csv'):
+    """Yields (line or record number, record dict or None, error or None) from an open text file."""
+    if fmt == 'csv':
+        reader = csv.DictReader(stream)
+        for record in reader:
+            yield reader.line_num, record, None
+    elif fmt == 'ndjson':
+        for line_no, line in enumerate(stream, 1):
+            if not line.strip():
+                continue
+            try:
+                record = json.loads(line)
+            except ValueError as e:
+                yield line_no, None, f'Invalid JSON: {e}'
+                continue
+            yield line_no, record, None if isinstance(record, dict) else 'Expected a JSON object.'
+    else:
+        records = json.load(stream)
+        if not isinstance(records, list):
+            raise ValueError('JSON import file must hold a list of lots.')
+        for number, record in enumerate(records, 1):
+            yield number, record, None if isinstance(record, dict) else 'Expected a JSON object.'
+
+def _explicit_spots(record):
+    """Returns (spot names or None, error or None) for the record's optional `spots` field."""
+    spots = record.get('spots')
+    if spots in (None, '', []):
+        return None, None
+    if isinstance(spots, str):
+        spots = spots.split(SPOT_SEPARATOR)
+    if not isinstance(spots, list):
+        return None, 'Spots must be a list of spot names.'
+    spots = [str(name).strip() for name in spots]
+    if not all(spots):
+        return None, 'Spot names cannot be blank.'
+    if len(set(spots)) != len(spots):
+        return None, 'Spot names must be unique within a lot.'
+    return spots, None
+
+def parse_record(record):
+    """Validates one import record. Returns (lot, explicit spot names or None, error or None)."""
+    spots, error = _explicit_spots(record)
+    if error:
+        return None, None, error
+    if spots is not None:
+        declared = record.get('maximum_number_of_spots')
+        if declared in (None, ''):
+            record = {**record, 'maximum_number_of_spots': len(spots)}
+        elif str(declared).strip() != str(len(spots)):
+            return None, None, f'Spot layout lists {len(spots)} spots but maximum_number_of_spots is {declared}.'
+    lot, error = parse_lot_form(record)
+    return lot, spots, error
+
+def _write_batch(conn, batch, errors):
+    names = [lot['prime_location_name'] for _, lot, _ in batch]
+    marks = ','.join('?' * len(names))
+    begin_write(conn)
+    try:
+        existing = {row[0] for row in conn.execute(
+            f'SELECT prime_location_name FROM parking_lots WHERE prime_location_name IN ({marks})', names
+        )}
+        lots, spot_rows = 0, []
+        for ref, lot, explicit in batch:
+            if lot['prime_location_name'] in existing:
+                errors.append((ref, f"A parking lot named '{lot['prime_location_name']}' already exists."))
+                continue
+            lot_id = insert_lot(conn, lot)
+            if explicit is not None:
+                spot_rows.extend((lot_id, name) for name in explicit)
+            else:
+                spot_rows.extend(iter_spot_rows(lot_id, 1, lot['maximum_number_of_spots'], lot['spot_name_template'],
+                                                lot['spots_per_level'], lot['spots_per_row']))
+            lots += 1
+        conn.executemany("INSERT INTO parking_spots (lot_id, spot_number, status) VALUES (?, ?, 'Available')", spot_rows)
+        conn.commit()
+    except BaseException:
+        conn.rollback()
+        raise
+    return lots, len(spot_rows)
+
+def import_lots(conn, records, batch_size=IMPORT_BATCH_LOTS):
+    """Imports the records from read_records. Bad records are skipped, not fatal.
+
+    Returns (lots imported, spots created, [(line or record number, error), ...]).
+    """
+    errors = []
+    seen_names = set()
+    batch = []
+    lots = spots = 0
+    for ref, record, error in records:
+        lot = explicit = None
+        if error is None:
+            lot, explicit, error = parse_record(record)
+        if error is None and lot['prime_location_name'] in seen_names:
+            error = f"Parking lot '{lot['prime_location_name']}' appears more than once in the file."
+        if error:
+            errors.append((ref, error))
+            continue
+        seen_names.add(lot['prime_location_name'])
+        batch.append((ref, lot, explicit))
+        if len(batch) >= batch_size:
+            added = _write_batch(conn, batch, errors)
+            lots, spots = lots + added[0], spots + added[1]
+            batch = []
+    if batch:
+        added = _write_batch(conn, batch, errors)
+        lots, spots = lots + added[0], spots + added[1]
+    return lots, spots, errors
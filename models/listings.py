@@ -0,0 +1,65 @@
+# Keyset-paginated, searchable listings for the admin dashboard. Each page costs
+# one indexed range scan of at most `limit + 1` rows, however many rows exist.
+
+ADMIN_PAGE_SIZE = 25
+
+def _prefix_upper_bound(prefix):
+    # every string starting with prefix sorts below prefix + U+10FFFF, so the index can range-scan
+    return prefix + '\U0010ffff'
+
+def _keyset_page(conn, select, key, where, params, after, before, limit):
+    """Returns (rows, prev_cursor, next_cursor) for a listing ordered by a unique key column."""
+    clauses = list(where)
+    params = list(params)
+    if before is not None:
+        clauses.append(f'{key} < ?')
+        params.append(before)
+        order = 'DESC'
+    else:
+        if after is not None:
+            clauses.append(f'{key} > ?')
+            params.append(after)
+        order = 'ASC'
+    where_sql = f"WHERE {' AND '.join(clauses)}" if clauses else ''
+    rows = conn.execute(
+        f'{select} {where_sql} ORDER BY {key} {order} LIMIT ?', (*params, limit + 1)
+    ).fetchall()
+
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+    if before is not None:
+        rows.reverse()
+        prev_cursor = rows[0][key] if has_more and rows else None
+        next_cursor = rows[-1][key] if rows else None
+    else:
+        prev_cursor = rows[0][key] if after is not None and rows else None
+        next_cursor = rows[-1][key] if has_more else None
+    return rows, prev_cursor, next_cursor
+
+def list_users(conn, q=None, after=None, before=None, limit=ADMIN_PAGE_SIZE):
+    """Users ordered by username, optionally filtered by a username prefix.
+
+    A search containing '@' is an email prefix instead, and that listing is ordered
+    (and its cursors keyed) by email. Either way the filter and the order come from
+    the same UNIQUE index, so a broad prefix still reads one page; an OR across both
+    columns would have to sort every match.
+    """
+    key, where, params = 'username', [], []
+    if q:
+        if '@' in q:
+            key = 'email'
+        where.append(f'{key} >= ? AND {key} < ?')
+        params += [q, _prefix_upper_bound(q)]
+    return _keyset_page(conn, 'SELECT id, username, email, role, created_at FROM users',
+                        key, where, params, after, before, limit)
+
+def list_lots(conn, q=None, after=None, before=None, limit=ADMIN_PAGE_SIZE, available_only=False):
+    """Parking lots ordered by name, optionally filtered by a name prefix or an exact pin code."""
+    where, params = [], []
+    if available_only:
+        where.append('maximum_number_of_spots > current_occupied_spots')
+    if q:
+        where.append('((prime_location_name >= ? AND prime_location_name < ?) OR pin_code = ?)')
+        params += [q, _prefix_upper_bound(q), q]
+    return _keyset_page(conn, 'SELECT * FROM parking_lots',
+                        'prime_location_name', where, params, after, before, limit)
@@ -0,0 +1,228 @@
+import http.cookiejar
+import json
+import random
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+
+from werkzeug.security import generate_password_hash
+
+from models.billing import Tariff, compute_cost
+from models.database import DEFAULT_ADMIN_PASSWORD, DEFAULT_ADMIN_USERNAME, get_db_connection, insert
+from models.provisioning import provision_spots
+
+# Load test of the booking lifecycle (`flask loadtest`). Seeds a throwaway database,
+# then workers loop register -> login -> user_dashboard -> book -> release ->
+# user_dashboard -> logout, with an admin_dashboard visit every few rounds. Requests
+# go through the Flask test client, or over HTTP to a local threaded werkzeug server
+# with --http. Latencies are kept per route and summarized as p50/p95/p99 and
+# requests/second in a JSON-ready dict, so runs can be saved and compared.
+
+LOADTEST_PASSWORD = 'loadtest'
+ADMIN_EVERY = 5  # rounds between admin dashboard visits
+
+def seed(database, lots=20, spots_per_lot=50, users=500, history=20000, seed=1):
+    """Fills an initialized database with lots, users (password LOADTEST_PASSWORD) and completed reservations.
+
+    Returns the (lot ids, usernames) the workers drive.
+    """
+    rng = random.Random(seed)
+    conn = get_db_connection(database)
+    lot_ids = []
+    for n in range(lots):
+        lot_id = insert(
+            conn, "INSERT INTO parking_lots (prime_location_name, address, pin_code, price_per_hour, maximum_number_of_spots) VALUES (?, ?, ?, ?, ?)",
+            (f'Load Lot {n + 1}', 'loadtest', f'{560000 + n}', float(rng.choice((20, 30, 40, 60))), spots_per_lot)
+        )
+        provision_spots(conn, lot_id, 1, spots_per_lot)
+        lot_ids.append(lot_id)
+
+    # one hash for everyone; hashing each password would dominate the seeding time
+    password_hash = generate_password_hash(LOADTEST_PASSWORD)
+    usernames = [f'load{n + 1}' for n in range(users)]
+    conn.executemany(
+        "INSERT INTO users (username, password_hash, email, role) VALUES (?, ?, ?, 'user')",
+        [(name, password_hash, f'{name}@example.com') for name in usernames]
+    )
+    user_ids = [row[0] for row in conn.execute("SELECT id FROM users WHERE role = 'user' ORDER BY id")]
+
+    spots = conn.execute(
+        'SELECT ps.id, pl.price_per_hour FROM parking_spots ps JOIN parking_lots pl ON ps.lot_id = pl.id'
+    ).fetchall()
+    now = int(time.time())
+    rows = []
+    for _ in range(history):
+        spot_id, price = rng.choice(spots)
+        parked = now - rng.randint(3600, 365 * 86400)
+        left = parked + rng.randint(600, 12 * 3600)
+        rows.append((spot_id, rng.choice(user_ids), parked, left, compute_cost(parked, left, Tariff(price))))
+    conn.executemany(
+        'INSERT INTO parking_reservations (spot_id, user_id, parking_timestamp, leaving_timestamp, total_cost, is_active) '
+        'VALUES (?, ?, ?, ?, ?, 0)', rows
+    )
+    conn.commit()
+    conn.close()
+    return lot_ids, usernames
+
+
+class _TestClientSession:
+    def __init__(self, app):
+        self.client = app.test_client()
+
+    def request(self, method, path, data=None):
+        return self.client.open(path, method=method, data=data).status_code
+
+
+class _NoRedirect(urllib.request.HTTPRedirectHandler):
+    def redirect_request(self, *args, **kwargs):
+        return None  # time the route itself, not the page it redirects to
+
+
+class _HTTPSession:
+    def __init__(self, base_url):
+        self.base_url = base_url
+        self.opener = urllib.request.build_opener(
+            urllib.request.HTTPCookieProcessor(http.cookiejar.CookieJar()), _NoRedirect()
+        )
+
+    def request(self, method, path, data=None):
+        body = urllib.parse.urlencode(data).encode() if data is not None else None
+        try:
+            with self.opener.open(urllib.request.Request(self.base_url + path, data=body, method=method)) as response:
+                response.read()
+                return response.status
+        except urllib.error.HTTPError as e:
+            return e.code
+
+
+def percentile(sorted_values, pct):
+    """Nearest-rank percentile of an already sorted list."""
+    if not sorted_values:
+        return None
+    rank = max(1, round(pct / 100 * len(sorted_values) + 0.5))
+    return sorted_values[min(rank, len(sorted_values)) - 1]
+
+def summarize(latencies, errors, elapsed):
+    """Per-route count, errors, throughput and latency percentiles (milliseconds)."""
+    routes = {}
+    for route, values in sorted(latencies.items()):
+        values.sort()
+        routes[route] = {
+            'requests': len(values),
+            'errors': errors.get(route, 0),
+            'rps': round(len(values) / elapsed, 1),
+            'mean_ms': round(1000 * sum(values) / len(values), 2),
+            'p50_ms': round(1000 * percentile(values, 50), 2),
+            'p95_ms': round(1000 * percentile(values, 95), 2),
+            'p99_ms': round(1000 * percentile(values, 99), 2),
+            'max_ms': round(1000 * values[-1], 2),
+        }
+    total = sum(r['requests'] for r in routes.values())
+    return {
+        'seconds': round(elapsed, 2),
+        'requests': total,
+        'errors': sum(errors.values()),
+        'rps': round(total / elapsed, 1),
+        'routes': routes,
+    }
+
+def run(app, lot_ids, usernames, workers=8, seconds=10.0, http=False, admin_username=None, admin_password=None):
+    """Drives the lifecycle from `workers` threads for `seconds`; returns summarize()'s dict.
+
+    The admin rounds log in with the app's ADMIN_USERNAME / ADMIN_PASSWORD unless others are given.
+    """
+    database = app.config['DATABASE']
+    admin_username = admin_username or app.config.get('ADMIN_USERNAME', DEFAULT_ADMIN_USERNAME)
+    admin_password = admin_password or app.config.get('ADMIN_PASSWORD', DEFAULT_ADMIN_PASSWORD)
+    server = None
+    if http:
+        from werkzeug.serving import make_server
+
+        server = make_server('127.0.0.1', 0, app, threaded=True)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        base_url = f'http://127.0.0.1:{server.server_port}'
+
+    latencies, errors = {}, {}
+    lock = threading.Lock()
+    deadline = time.monotonic() + seconds
+
+    def worker(n):
+        rng = random.Random(n)
+        session = _HTTPSession(base_url) if http else _TestClientSession(app)
+        conn = get_db_connection(database)
+        mine = usernames[n::workers] or usernames
+        local, local_errors = {}, {}
+
+        def call(route, method, path, data=None):
+            started = time.perf_counter()
+            try:
+                status = session.request(method, path, data)
+            except Exception:
+                status = None
+            local.setdefault(route, []).append(time.perf_counter() - started)
+            if status is None or status >= 400:
+                local_errors[route] = local_errors.get(route, 0) + 1
+
+        rounds = 0
+        while time.monotonic() < deadline:
+            rounds += 1
+            username = mine[rounds % len(mine)]
+            fresh = f'new{n}x{rounds}x{time.time_ns()}'
+            call('register', 'POST', '/register', {'username': fresh, 'password': fresh, 'email': f'{fresh}@example.com'})
+            call('login', 'POST', '/login', {'username': username, 'password': LOADTEST_PASSWORD})
+            call('user_dashboard', 'GET', '/user_dashboard')
+            call('book_parking_spot', 'POST', f'/user/book_parking_spot/{rng.choice(lot_ids)}')
+            active = conn.execute(
+                'SELECT pr.id FROM parking_reservations pr JOIN users u ON pr.user_id = u.id '
+                'WHERE u.username = ? AND pr.is_active = 1', (username,)
+            ).fetchone()
+            if active:
+                call('release_parking_spot', 'POST', f'/user/release_parking_spot/{active[0]}')
+            call('user_dashboard', 'GET', '/user_dashboard')
+            call('logout', 'GET', '/logout')
+            if rounds % ADMIN_EVERY == 0:
+                call('login', 'POST', '/login', {'username': admin_username, 'password': admin_password})
+                call('admin_dashboard', 'GET', '/admin_dashboard')
+                call('logout', 'GET', '/logout')
+        conn.close()
+        with lock:
+            for route, values in local.items():
+                latencies.setdefault(route, []).extend(values)
+            for route, count in local_errors.items():
+                errors[route] = errors.get(route, 0) + count
+
+    threads = [threading.Thread(target=worker, args=(n,)) for n in range(workers)]
+    started = time.monotonic()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    elapsed = time.monotonic() - started
+    if server is not None:
+        server.shutdown()
+    return summarize(latencies, errors, elapsed)
+
+def compare(result, baseline, tolerance=0.2):
+    """Routes whose p95 got more than `tolerance` slower than in a saved baseline result.
+
+    Returns a list of (route, baseline p95, new p95).
+    """
+    slower = []
+    for route, stats in result['routes'].items():
+        before = baseline.get('routes', {}).get(route)
+        if before and stats['p95_ms'] > before['p95_ms'] * (1 + tolerance):
+            slower.append((route, before['p95_ms'], stats['p95_ms']))
+    return slower
+
+def format_table(result):
+    lines = [f"{'route':<22}{'requests':>9}{'errors':>7}{'rps':>9}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}"]
+    for route, s in result['routes'].items():
+        lines.append(f"{route:<22}{s['requests']:>9}{s['errors']:>7}{s['rps']:>9}{s['p50_ms']:>9}{s['p95_ms']:>9}{s['p99_ms']:>9}")
+    lines.append(f"{result['requests']} requests in {result['seconds']}s ({result['rps']} req/s), {result['errors']} errors")
+    return '\n'.join(lines)
+
+def load_result(path):
+    with open(path) as f:
+        return json.load(f)
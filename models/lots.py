@@ -0,0 +1,121 @@
+import math
+
+from models.database import insert
+from models.provisioning import DEFAULT_SPOT_TEMPLATE, validate_layout
+
+# Validation of parking lot fields, shared by the admin forms and `flask import-lots`
+# so a lot is accepted or rejected by the same rules however it arrives.
+
+TARIFF_FIELDS = ('first_hour_price', 'daily_cap', 'night_price_per_hour')
+
+def _field(form, name):
+    value = form.get(name)
+    return '' if value is None else str(value).strip()
+
+def read_tariff_form(form):
+    """Parses the optional tariff inputs of the lot forms; a blank input switches that rule off."""
+    values = {}
+    for field in TARIFF_FIELDS:
+        raw = _field(form, field)
+        if not raw:
+            values[field] = None
+            continue
+        try:
+            values[field] = float(raw)
+        except ValueError:
+            return None, 'Tariff values must be valid numbers.'
+        if values[field] < 0:
+            return None, 'Tariff values cannot be negative.'
+    return values, None
+
+def read_coordinates(form):
+    """Parses the optional latitude/longitude inputs. Returns ((lat, lng), None) or (None, error); both blank is (None, None)."""
+    lat, lng = _field(form, 'latitude'), _field(form, 'longitude')
+    if not lat and not lng:
+        return (None, None), None
+    if not lat or not lng:
+        return None, 'Give both latitude and longitude, or neither.'
+    try:
+        lat, lng = float(lat), float(lng)
+    except ValueError:
+        return None, 'Latitude and longitude must be valid numbers.'
+    if not (-90 <= lat <= 90 and -180 <= lng <= 180):
+        return None, 'Latitude must be within -90..90 and longitude within -180..180.'
+    return (lat, lng), None
+
+def read_max_stay(form):
+    """Parses the optional maximum stay in hours; blank means no limit. Returns (hours or None, error)."""
+    raw = _field(form, 'max_stay_hours')
+    if not raw:
+        return None, None
+    try:
+        hours = float(raw)
+    except ValueError:
+        return None, 'Maximum stay must be a valid number of hours.'
+    if not math.isfinite(hours):
+        return None, 'Maximum stay must be a finite number of hours.'
+    if hours <= 0:
+        return None, 'Maximum stay must be positive.'
+    return hours, None
+
+def parse_lot_form(form):
+    """Checks the fields of a new lot. Returns (lot dict ready for insert_lot, None) or (None, error)."""
+    name = _field(form, 'prime_location_name')
+    address = _field(form, 'address')
+    pin_code = _field(form, 'pin_code')
+    price_per_hour = _field(form, 'price_per_hour')
+    max_spots = _field(form, 'maximum_number_of_spots')
+    spot_name_template = _field(form, 'spot_name_template') or DEFAULT_SPOT_TEMPLATE
+    spots_per_level = _field(form, 'spots_per_level') or None
+    spots_per_row = _field(form, 'spots_per_row') or None
+
+    if not name or not address or not pin_code or not price_per_hour or not max_spots:
+        return None, 'All fields are required.'
+    try:
+        price_per_hour = float(price_per_hour)
+        max_spots = int(max_spots)
+    except ValueError:
+        return None, 'Price per hour and maximum spots must be valid numbers.'
+    if max_spots <= 0 or price_per_hour < 0:
+        return None, 'Maximum spots must be positive and price cannot be negative.'
+    try:
+        spots_per_level = int(spots_per_level) if spots_per_level else None
+        spots_per_row = int(spots_per_row) if spots_per_row else None
+    except ValueError:
+        return None, 'Spots per level and spots per row must be valid numbers.'
+    error = validate_layout(spot_name_template, spots_per_level, spots_per_row)
+    if error:
+        return None, error
+    tariff, error = read_tariff_form(form)
+    if error:
+        return None, error
+    coordinates, error = read_coordinates(form)
+    if error:
+        return None, error
+    max_stay_hours, error = read_max_stay(form)
+    if error:
+        return None, error
+
+    return {
+        'prime_location_name': name,
+        'address': address,
+        'pin_code': pin_code,
+        'price_per_hour': price_per_hour,
+        'maximum_number_of_spots': max_spots,
+        'spot_name_template': spot_name_template,
+        'spots_per_level': spots_per_level,
+        'spots_per_row': spots_per_row,
+        'latitude': coordinates[0],
+        'longitude': coordinates[1],
+        'max_stay_hours': max_stay_hours,
+        **tariff,
+    }, None
+
+LOT_COLUMNS = ('prime_location_name', 'address', 'pin_code', 'price_per_hour', 'maximum_number_of_spots',
+               'spot_name_template', 'spots_per_level', 'spots_per_row',
+               'first_hour_price', 'daily_cap', 'night_price_per_hour', 'latitude', 'longitude', 'max_stay_hours')
+
+def insert_lot(conn, lot):
+    """Inserts a lot row (without its spots) and returns the new id."""
+    return insert(conn, f"INSERT INTO parking_lots ({', '.join(LOT_COLUMNS)}) VALUES ({', '.join('?' * len(LOT_COLUMNS))})",
+                  [lot[column] for column in LOT_COLUMNS])
@@ -0,0 +1,425 @@
+import sqlite3
+
+# Versioned schema changes applied on top of the base tables created by init_db.
+# The applied version is tracked in SQLite's PRAGMA user_version, so existing
+# databases are upgraded in place instead of being dropped and recreated.
+
+def _0001_hot_path_indexes(conn):
+    # first available spot in a lot (book_parking_spot)
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_spots_lot_status ON parking_spots (lot_id, status)')
+    # "does this user already have an active reservation" and the active list on the dashboard
+    conn.execute('''
+        CREATE INDEX IF NOT EXISTS idx_reservations_user_active
+        ON parking_reservations (user_id, parking_timestamp) WHERE is_active = 1
+    ''')
+    # history listing plus the count/sum summary, covered without touching the table
+    conn.execute('''
+        CREATE INDEX IF NOT EXISTS idx_reservations_user_history
+        ON parking_reservations (user_id, is_active, leaving_timestamp, total_cost)
+    ''')
+    # active reservation checks on a spot (edit_spot, delete_spot, delete_parking_lot)
+    conn.execute('''
+        CREATE INDEX IF NOT EXISTS idx_reservations_spot_active
+        ON parking_reservations (spot_id) WHERE is_active = 1
+    ''')
+
+def _0002_history_keyset_index(conn):
+    # keyset pagination orders history by (leaving_timestamp, id); putting id right
+    # after leaving_timestamp lets SQLite walk the index instead of sorting
+    conn.execute('DROP INDEX IF EXISTS idx_reservations_user_history')
+    conn.execute('''
+        CREATE INDEX IF NOT EXISTS idx_reservations_user_history
+        ON parking_reservations (user_id, is_active, leaving_timestamp, id, total_cost)
+    ''')
+
+def _0003_spot_layout_columns(conn):
+    # how a lot's spots are named, so later resizes keep numbering the same way
+    conn.execute("ALTER TABLE parking_lots ADD COLUMN spot_name_template TEXT NOT NULL DEFAULT 'S{n}'")
+    conn.execute('ALTER TABLE parking_lots ADD COLUMN spots_per_level INTEGER')
+    conn.execute('ALTER TABLE parking_lots ADD COLUMN spots_per_row INTEGER')
+
+def _0004_summary_tables(conn):
+    # Pre-aggregated numbers for the admin dashboard, kept current by triggers so
+    # every write path (booking, release, spot edits, resizes, imports) updates them.
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS parking_summary (
+            id INTEGER PRIMARY KEY CHECK (id = 1),
+            total_lots INTEGER NOT NULL DEFAULT 0,
+            total_spots INTEGER NOT NULL DEFAULT 0,
+            occupied_spots INTEGER NOT NULL DEFAULT 0,
+            total_revenue REAL NOT NULL DEFAULT 0
+        )
+    ''')
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS lot_hourly_stats (
+            lot_id INTEGER NOT NULL,
+            hour TEXT NOT NULL, -- UTC, 'YYYY-MM-DD HH:00:00'
+            bookings INTEGER NOT NULL DEFAULT 0,
+            releases INTEGER NOT NULL DEFAULT 0,
+            revenue REAL NOT NULL DEFAULT 0,
+            peak_occupied INTEGER, -- highest occupancy seen during the hour
+            capacity INTEGER,
+            PRIMARY KEY (lot_id, hour)
+        ) WITHOUT ROWID
+    ''')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_lot_hourly_stats_hour ON lot_hourly_stats (hour)')
+
+    conn.execute('''
+        INSERT OR REPLACE INTO parking_summary (id, total_lots, total_spots, occupied_spots, total_revenue)
+        SELECT 1, COUNT(*), COALESCE(SUM(maximum_number_of_spots), 0), COALESCE(SUM(current_occupied_spots), 0),
+               (SELECT COALESCE(SUM(total_cost), 0) FROM parking_reservations WHERE is_active = 0)
+        FROM parking_lots
+    ''')
+    # one-off backfill of the buckets from existing history
+    conn.execute('''
+        INSERT INTO lot_hourly_stats (lot_id, hour, bookings)
+        SELECT ps.lot_id, strftime('%Y-%m-%d %H:00:00', pr.parking_timestamp), COUNT(*)
+        FROM parking_reservations pr JOIN parking_spots ps ON pr.spot_id = ps.id
+        WHERE pr.parking_timestamp IS NOT NULL
+        GROUP BY 1, 2
+    ''')
+    conn.execute('''
+        INSERT INTO lot_hourly_stats (lot_id, hour, releases, revenue)
+        SELECT ps.lot_id, strftime('%Y-%m-%d %H:00:00', pr.leaving_timestamp), COUNT(*), COALESCE(SUM(pr.total_cost), 0)
+        FROM parking_reservations pr JOIN parking_spots ps ON pr.spot_id = ps.id
+        WHERE pr.is_active = 0 AND pr.leaving_timestamp IS NOT NULL
+        GROUP BY 1, 2
+        ON CONFLICT (lot_id, hour) DO UPDATE SET releases = excluded.releases, revenue = excluded.revenue
+    ''')
+
+    conn.execute('''
+        CREATE TRIGGER IF NOT EXISTS trg_summary_lot_insert AFTER INSERT ON parking_lots
+        BEGIN
+            UPDATE parking_summary SET total_lots = total_lots + 1,
+                total_spots = total_spots + NEW.maximum_number_of_spots,
+                occupied_spots = occupied_spots + COALESCE(NEW.current_occupied_spots, 0)
+            WHERE id = 1;
+        END
+    ''')
+    conn.execute('''
+        CREATE TRIGGER IF NOT EXISTS trg_summary_lot_delete AFTER DELETE ON parking_lots
+        BEGIN
+            UPDATE parking_summary SET total_lots = total_lots - 1,
+                total_spots = total_spots - OLD.maximum_number_of_spots,
+                occupied_spots = occupied_spots - COALESCE(OLD.current_occupied_spots, 0)
+            WHERE id = 1;
+        END
+    ''')
+    conn.execute('''
+        CREATE TRIGGER IF NOT EXISTS trg_summary_lot_update
+        AFTER UPDATE OF maximum_number_of_spots, current_occupied_spots ON parking_lots
+        BEGIN
+            UPDATE parking_summary SET
+                total_spots = total_spots + NEW.maximum_number_of_spots - OLD.maximum_number_of_spots,
+                occupied_spots = occupied_spots + COALESCE(NEW.current_occupied_spots, 0) - COALESCE(OLD.current_occupied_spots, 0)
+            WHERE id = 1;
+            INSERT INTO lot_hourly_stats (lot_id, hour, peak_occupied, capacity)
+            VALUES (NEW.id, strftime('%Y-%m-%d %H:00:00', 'now'), NEW.current_occupied_spots, NEW.maximum_number_of_spots)
+            ON CONFLICT (lot_id, hour) DO UPDATE SET
+                peak_occupied = MAX(COALESCE(peak_occupied, 0), excluded.peak_occupied),
+                capacity = excluded.capacity;
+        END
+    ''')
+    conn.execute('''
+        CREATE TRIGGER IF NOT EXISTS trg_stats_reservation_insert AFTER INSERT ON parking_reservations
+        BEGIN
+            INSERT INTO lot_hourly_stats (lot_id, hour, bookings)
+            SELECT lot_id, strftime('%Y-%m-%d %H:00:00', NEW.parking_timestamp), 1 FROM parking_spots WHERE id = NEW.spot_id
+            ON CONFLICT (lot_id, hour) DO UPDATE SET bookings = bookings + 1;
+        END
+    ''')
+    conn.execute('''
+        CREATE TRIGGER IF NOT EXISTS trg_stats_reservation_closed
+        AFTER UPDATE OF is_active ON parking_reservations
+        WHEN OLD.is_active = 1 AND NEW.is_active = 0
+        BEGIN
+            INSERT INTO lot_hourly_stats (lot_id, hour, releases, revenue)
+            SELECT lot_id, strftime('%Y-%m-%d %H:00:00', COALESCE(NEW.leaving_timestamp, 'now')), 1, COALESCE(NEW.total_cost, 0)
+            FROM parking_spots WHERE id = NEW.spot_id
+            ON CONFLICT (lot_id, hour) DO UPDATE SET releases = releases + 1, revenue = revenue + excluded.revenue;
+            UPDATE parking_summary SET total_revenue = total_revenue + COALESCE(NEW.total_cost, 0) WHERE id = 1;
+        END
+    ''')
+    conn.execute('''
+        CREATE TRIGGER IF NOT EXISTS trg_stats_reservation_insert_closed
+        AFTER INSERT ON parking_reservations
+        WHEN NEW.is_active = 0
+        BEGIN
+            INSERT INTO lot_hourly_stats (lot_id, hour, releases, revenue)
+            SELECT lot_id, strftime('%Y-%m-%d %H:00:00', COALESCE(NEW.leaving_timestamp, 'now')), 1, COALESCE(NEW.total_cost, 0)
+            FROM parking_spots WHERE id = NEW.spot_id
+            ON CONFLICT (lot_id, hour) DO UPDATE SET releases = releases + 1, revenue = revenue + excluded.revenue;
+            UPDATE parking_summary SET total_revenue = total_revenue + COALESCE(NEW.total_cost, 0) WHERE id = 1;
+        END
+    ''')
+
+def _0005_admin_listing_indexes(conn):
+    # users.username, users.email and parking_lots.prime_location_name are already
+    # indexed through their UNIQUE constraints; lot search also matches pin codes
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_lots_pin_code ON parking_lots (pin_code)')
+
+def _0006_change_versions(conn):
+    # A global change sequence plus per-lot and per-user stamps taken from it. Any
+    # writer (this process, another worker, a CLI import) moves them forward, which
+    # is what the API's ETags and the in-process change tracker key off.
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS change_seq (
+            id INTEGER PRIMARY KEY CHECK (id = 1),
+            seq INTEGER NOT NULL DEFAULT 0
+        )
+    ''')
+    conn.execute('INSERT OR IGNORE INTO change_seq (id, seq) VALUES (1, 0)')
+    conn.execute('ALTER TABLE parking_lots ADD COLUMN version INTEGER NOT NULL DEFAULT 0')
+    conn.execute('ALTER TABLE users ADD COLUMN version INTEGER NOT NULL DEFAULT 0')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_lots_version ON parking_lots (version)')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_users_version ON users (version)')
+
+    bump_lot = '''
+        UPDATE change_seq SET seq = seq + 1 WHERE id = 1;
+        UPDATE parking_lots SET version = (SELECT seq FROM change_seq WHERE id = 1) WHERE id = {lot};
+    '''
+    bump_user = '''
+        UPDATE change_seq SET seq = seq + 1 WHERE id = 1;
+        UPDATE users SET version = (SELECT seq FROM change_seq WHERE id = 1) WHERE id = {user};
+    '''
+    triggers = {
+        'trg_version_lot_insert': ('AFTER INSERT ON parking_lots', bump_lot.format(lot='NEW.id')),
+        'trg_version_lot_update': ('AFTER UPDATE ON parking_lots WHEN NEW.version IS OLD.version', bump_lot.format(lot='NEW.id')),
+        'trg_version_lot_delete': ('AFTER DELETE ON parking_lots', 'UPDATE change_seq SET seq = seq + 1 WHERE id = 1;'),
+        'trg_version_spot_insert': ('AFTER INSERT ON parking_spots', bump_lot.format(lot='NEW.lot_id')),
+        'trg_version_spot_update': ('AFTER UPDATE ON parking_spots', bump_lot.format(lot='NEW.lot_id')),
+        'trg_version_spot_delete': ('AFTER DELETE ON parking_spots', bump_lot.format(lot='OLD.lot_id')),
+        'trg_version_reservation_insert': ('AFTER INSERT ON parking_reservations', bump_user.format(user='NEW.user_id')),
+        'trg_version_reservation_update': ('AFTER UPDATE ON parking_reservations', bump_user.format(user='NEW.user_id')),
+        'trg_version_reservation_delete': ('AFTER DELETE ON parking_reservations', bump_user.format(user='OLD.user_id')),
+    }
+    for name, (event, body) in triggers.items():
+        conn.execute(f'CREATE TRIGGER IF NOT EXISTS {name} {event} BEGIN {body} END')
+
+def _0007_lot_tariffs(conn):
+    # optional tariff rules on top of price_per_hour, see models/billing.py
+    conn.execute('ALTER TABLE parking_lots ADD COLUMN first_hour_price REAL')
+    conn.execute('ALTER TABLE parking_lots ADD COLUMN daily_cap REAL')
+    conn.execute('ALTER TABLE parking_lots ADD COLUMN night_price_per_hour REAL')
+    # re-billing a completed stay moves the revenue summaries by the difference
+    conn.execute('''
+        CREATE TRIGGER IF NOT EXISTS trg_stats_reservation_rebilled
+        AFTER UPDATE OF total_cost ON parking_reservations
+        WHEN OLD.is_active = 0 AND NEW.is_active = 0 AND NEW.total_cost IS NOT OLD.total_cost
+        BEGIN
+            UPDATE lot_hourly_stats
+            SET revenue = revenue + COALESCE(NEW.total_cost, 0) - COALESCE(OLD.total_cost, 0)
+            WHERE lot_id = (SELECT lot_id FROM parking_spots WHERE id = NEW.spot_id)
+              AND hour = strftime('%Y-%m-%d %H:00:00', NEW.leaving_timestamp);
+            UPDATE parking_summary
+            SET total_revenue = total_revenue + COALESCE(NEW.total_cost, 0) - COALESCE(OLD.total_cost, 0)
+            WHERE id = 1;
+        END
+    ''')
+
+def _0008_epoch_timestamps(conn):
+    # Reservation timestamps become integer UTC epoch seconds: durations and costs are
+    # plain subtraction, and date ranges are integer range scans. Rows are converted in
+    # place; the summary triggers that bucket by hour are recreated to read epochs.
+    for column in ('parking_timestamp', 'leaving_timestamp'):
+        conn.execute(f'''
+            UPDATE parking_reservations SET {column} = CAST(strftime('%s', {column}) AS INTEGER)
+            WHERE typeof({column}) = 'text'
+        ''')
+    conn.execute('''
+        CREATE INDEX IF NOT EXISTS idx_reservations_leaving
+        ON parking_reservations (leaving_timestamp) WHERE is_active = 0
+    ''')
+
+    hour_of = "strftime('%Y-%m-%d %H:00:00', {}, 'unixepoch')"
+    leaving_hour = hour_of.format("COALESCE(NEW.leaving_timestamp, CAST(strftime('%s', 'now') AS INTEGER))")
+    for name in ('trg_stats_reservation_insert', 'trg_stats_reservation_closed',
+                 'trg_stats_reservation_insert_closed', 'trg_stats_reservation_rebilled'):
+        conn.execute(f'DROP TRIGGER IF EXISTS {name}')
+    conn.execute(f'''
+        CREATE TRIGGER trg_stats_reservation_insert AFTER INSERT ON parking_reservations
+        BEGIN
+            INSERT INTO lot_hourly_stats (lot_id, hour, bookings)
+            SELECT lot_id, {hour_of.format('NEW.parking_timestamp')}, 1 FROM parking_spots WHERE id = NEW.spot_id
+            ON CONFLICT (lot_id, hour) DO UPDATE SET bookings = bookings + 1;
+        END
+    ''')
+    closed_body = f'''
+        BEGIN
+            INSERT INTO lot_hourly_stats (lot_id, hour, releases, revenue)
+            SELECT lot_id, {leaving_hour}, 1, COALESCE(NEW.total_cost, 0)
+            FROM parking_spots WHERE id = NEW.spot_id
+            ON CONFLICT (lot_id, hour) DO UPDATE SET releases = releases + 1, revenue = revenue + excluded.revenue;
+            UPDATE parking_summary SET total_revenue = total_revenue + COALESCE(NEW.total_cost, 0) WHERE id = 1;
+        END
+    '''
+    conn.execute(f'''
+        CREATE TRIGGER trg_stats_reservation_closed
+        AFTER UPDATE OF is_active ON parking_reservations
+        WHEN OLD.is_active = 1 AND NEW.is_active = 0
+        {closed_body}
+    ''')
+    conn.execute(f'''
+        CREATE TRIGGER trg_stats_reservation_insert_closed
+        AFTER INSERT ON parking_reservations
+        WHEN NEW.is_active = 0
+        {closed_body}
+    ''')
+    conn.execute(f'''
+        CREATE TRIGGER trg_stats_reservation_rebilled
+        AFTER UPDATE OF total_cost ON parking_reservations
+        WHEN OLD.is_active = 0 AND NEW.is_active = 0 AND NEW.total_cost IS NOT OLD.total_cost
+        BEGIN
+            UPDATE lot_hourly_stats
+            SET revenue = revenue + COALESCE(NEW.total_cost, 0) - COALESCE(OLD.total_cost, 0)
+            WHERE lot_id = (SELECT lot_id FROM parking_spots WHERE id = NEW.spot_id)
+              AND hour = {hour_of.format('NEW.leaving_timestamp')};
+            UPDATE parking_summary
+            SET total_revenue = total_revenue + COALESCE(NEW.total_cost, 0) - COALESCE(OLD.total_cost, 0)
+            WHERE id = 1;
+        END
+    ''')
+
+def _0009_reservation_archive(conn):
+    # old completed stays, moved out of the live table by models/archive.py; no foreign
+    # keys, so archived history isn't cascaded away with the live rows
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS parking_reservations_archive (
+            id INTEGER PRIMARY KEY,
+            spot_id INTEGER NOT NULL,
+            user_id INTEGER NOT NULL,
+            parking_timestamp INTEGER,
+            leaving_timestamp INTEGER,
+            total_cost REAL,
+            created_at TIMESTAMP,
+            updated_at TIMESTAMP
+        )
+    ''')
+    conn.execute('''
+        CREATE INDEX IF NOT EXISTS idx_archive_user_history
+        ON parking_reservations_archive (user_id, leaving_timestamp, id, total_cost)
+    ''')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_archive_leaving ON parking_reservations_archive (leaving_timestamp)')
+    conn.execute('''
+        CREATE TRIGGER IF NOT EXISTS trg_stats_archive_rebilled
+        AFTER UPDATE OF total_cost ON parking_reservations_archive
+        WHEN NEW.total_cost IS NOT OLD.total_cost
+        BEGIN
+            UPDATE lot_hourly_stats
+            SET revenue = revenue + COALESCE(NEW.total_cost, 0) - COALESCE(OLD.total_cost, 0)
+            WHERE lot_id = (SELECT lot_id FROM parking_spots WHERE id = NEW.spot_id)
+              AND hour = strftime('%Y-%m-%d %H:00:00', NEW.leaving_timestamp, 'unixepoch');
+            UPDATE parking_summary
+            SET total_revenue = total_revenue + COALESCE(NEW.total_cost, 0) - COALESCE(OLD.total_cost, 0)
+            WHERE id = 1;
+        END
+    ''')
+
+def _0010_lot_coordinates(conn):
+    # optional location of a lot, for the nearest-lot search in models/geo.py
+    conn.execute('ALTER TABLE parking_lots ADD COLUMN latitude REAL')
+    conn.execute('ALTER TABLE parking_lots ADD COLUMN longitude REAL')
+
+def _0011_spot_slots(conn):
+    # advance bookings of a spot for a time window, see models/slots.py
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS spot_slots (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            spot_id INTEGER NOT NULL REFERENCES parking_spots (id) ON DELETE CASCADE,
+            user_id INTEGER NOT NULL REFERENCES users (id) ON DELETE CASCADE,
+            start_ts INTEGER NOT NULL,
+            end_ts INTEGER NOT NULL,
+            status TEXT NOT NULL DEFAULT 'booked', -- 'booked', 'checked_in' or 'cancelled'
+            reservation_id INTEGER,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            CHECK (end_ts > start_ts)
+        )
+    ''')
+    # overlap checks only ever look at booked slots, by spot or by user, ordered by start
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_slots_spot_booked ON spot_slots (spot_id, start_ts, end_ts) WHERE status = 'booked'")
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_slots_user ON spot_slots (user_id, start_ts)')
+
+def _0012_more_change_versions(conn):
+    # registrations show up in the admin user list, which is now served from the fragment
+    # cache (models/fragments.py); slots belong to a user's bookings like reservations do
+    bump_user = '''
+        UPDATE change_seq SET seq = seq + 1 WHERE id = 1;
+        UPDATE users SET version = (SELECT seq FROM change_seq WHERE id = 1) WHERE id = {user};
+    '''
+    triggers = {
+        'trg_version_user_insert': ('AFTER INSERT ON users', bump_user.format(user='NEW.id')),
+        'trg_version_user_delete': ('AFTER DELETE ON users', 'UPDATE change_seq SET seq = seq + 1 WHERE id = 1;'),
+        'trg_version_slot_insert': ('AFTER INSERT ON spot_slots', bump_user.format(user='NEW.user_id')),
+        'trg_version_slot_update': ('AFTER UPDATE ON spot_slots', bump_user.format(user='NEW.user_id')),
+    }
+    for name, (event, body) in triggers.items():
+        conn.execute(f'CREATE TRIGGER IF NOT EXISTS {name} {event} BEGIN {body} END')
+
+def _0013_overstay_limits(conn):
+    # per-lot maximum stay, enforced by the overstay sweep (models/overstay.py)
+    conn.execute('ALTER TABLE parking_lots ADD COLUMN max_stay_hours REAL')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_lots_max_stay ON parking_lots (max_stay_hours)')
+    # active reservations by age: the sweep reads only the ones older than the shortest limit
+    conn.execute('''
+        CREATE INDEX IF NOT EXISTS idx_reservations_active_since
+        ON parking_reservations (parking_timestamp, id) WHERE is_active = 1
+    ''')
+
+def _0014_archive_change_versions(conn):
+    # archived stays are part of a user's history too: re-billing them (models/billing.py)
+    # has to move the user's version like re-billing a live reservation does
+    bump_user = '''
+        UPDATE change_seq SET seq = seq + 1 WHERE id = 1;
+        UPDATE users SET version = (SELECT seq FROM change_seq WHERE id = 1) WHERE id = {user};
+    '''
+    triggers = {
+        'trg_version_archive_insert': ('AFTER INSERT ON parking_reservations_archive', bump_user.format(user='NEW.user_id')),
+        'trg_version_archive_update': ('AFTER UPDATE ON parking_reservations_archive', bump_user.format(user='NEW.user_id')),
+        'trg_version_archive_delete': ('AFTER DELETE ON parking_reservations_archive', bump_user.format(user='OLD.user_id')),
+    }
+    for name, (event, body) in triggers.items():
+        conn.execute(f'CREATE TRIGGER IF NOT EXISTS {name} {event} BEGIN {body} END')
+
+MIGRATIONS = [
+    (1, 'hot path indexes for spots and reservations', _0001_hot_path_indexes),
+    (2, 'history index usable for keyset pagination', _0002_history_keyset_index),
+    (3, 'spot naming layout on parking lots', _0003_spot_layout_columns),
+    (4, 'materialized occupancy and revenue summaries', _0004_summary_tables),
+    (5, 'index for admin lot search by pin code', _0005_admin_listing_indexes),
+    (6, 'change sequence and per-lot/per-user versions', _0006_change_versions),
+    (7, 'tariff columns on parking lots', _0007_lot_tariffs),
+    (8, 'reservation timestamps as integer epoch seconds', _0008_epoch_timestamps),
+    (9, 'archive table for old completed reservations', _0009_reservation_archive),
+    (10, 'latitude and longitude on parking lots', _0010_lot_coordinates),
+    (11, 'advance time-slot bookings of spots', _0011_spot_slots),
+    (12, 'version bumps for new users and slot changes', _0012_more_change_versions),
+    (13, 'per-lot maximum stay and an index of active reservations by age', _0013_overstay_limits),
+    (14, 'version bumps for archived reservations', _0014_archive_change_versions),
+]
+
+def get_schema_version(conn):
+    return conn.execute('PRAGMA user_version').fetchone()[0]
+
+def migrate(conn, verbose=False):
+    """Applies every pending migration, each in its own write transaction. Returns the new version."""
+    current = get_schema_version(conn)
+    for version, description, apply in MIGRATIONS:
+        if version <= current:
+            continue
+        if conn.in_transaction:
+            conn.commit()
+        try:
+            conn.execute('BEGIN IMMEDIATE')
+            apply(conn)
+            conn.execute(f'PRAGMA user_version = {version}')
+            conn.commit()
+        except sqlite3.Error:
+            conn.rollback()
+            raise
+        current = version
+        if verbose:
+            print(f"Applied migration {version}: {description}")
+    return current
+
+def latest_version():
+    return MIGRATIONS[-1][0] if MIGRATIONS else 0
@@ -0,0 +1,117 @@
+import math
+import random
+import threading
+import time
+
+from models.billing import Tariff, compute_cost
+from models.database import DatabaseError, get_db_connection
+
+# Overstay detection. A lot can set max_stay_hours (migration 13); an active
+# reservation older than that is released automatically and billed like a normal
+# release, up to the moment of the sweep.
+#
+# The sweep reads candidates through idx_reservations_active_since, a partial index of
+# active reservations by age, starting at the shortest limit any lot has, so it never
+# scans parking_reservations. Reads happen outside any transaction; each batch is then
+# closed in one short write transaction (SpotAllocator.release_many), with a pause
+# between batches so bookings and releases from requests get the write lock in between.
+
+OVERSTAY_CHECK_SECONDS = 60
+OVERSTAY_BATCH_SIZE = 100
+OVERSTAY_PAUSE_SECONDS = 0.05
+
+def find_overstays(conn, now, after=(-1, 0), limit=OVERSTAY_BATCH_SIZE):
+    """Active reservations past their lot's maximum stay, oldest first, after the (parking_timestamp, id) cursor."""
+    shortest = conn.execute('SELECT MIN(max_stay_hours) FROM parking_lots').fetchone()[0]
+    if shortest is None or not math.isfinite(shortest):
+        return []  # no limits, or only infinite ones saved before the form rejected them
+    return conn.execute('''
+        SELECT pr.id, pr.parking_timestamp,
+               pl.price_per_hour, pl.first_hour_price, pl.daily_cap, pl.night_price_per_hour
+        FROM parking_reservations pr
+        JOIN parking_spots ps ON pr.spot_id = ps.id
+        JOIN parking_lots pl ON ps.lot_id = pl.id
+        WHERE pr.is_active = 1 AND pr.parking_timestamp < ? AND (pr.parking_timestamp, pr.id) > (?, ?)
+          AND pl.max_stay_hours IS NOT NULL AND pr.parking_timestamp < ? - pl.max_stay_hours * 3600
+        ORDER BY pr.parking_timestamp, pr.id
+        LIMIT ?
+    ''', (now - int(shortest * 3600), after[0], after[1], now, limit)).fetchall()
+
+def release_overstays(conn, allocator, now=None, batch_size=OVERSTAY_BATCH_SIZE, pause=OVERSTAY_PAUSE_SECONDS,
+                      on_batch=None):
+    """Releases every overstayed reservation in batches. Returns the (reservation_id, spot_id, lot_id) closed.
+
+    on_batch(closed) is called after each committed batch.
+    """
+    now = int(time.time()) if now is None else now
+    released = []
+    after = (-1, 0)
+    while True:
+        rows = find_overstays(conn, now, after, batch_size)
+        if not rows:
+            break
+        after = (rows[-1]['parking_timestamp'], rows[-1]['id'])
+        closed = allocator.release_many(conn, [
+            (row['id'], now, compute_cost(row['parking_timestamp'], now, Tariff.from_row(row))) for row in rows
+        ])
+        released += closed
+        if closed and on_batch:
+            on_batch(closed)
+        if len(rows) < batch_size:
+            break
+        time.sleep(pause)
+    return released
+
+
+class OverstayScheduler:
+    """Daemon thread that runs release_overstays every interval seconds on its own connection."""
+
+    def __init__(self, database, allocator, interval=OVERSTAY_CHECK_SECONDS, on_batch=None, logger=None):
+        self.database = database
+        self.allocator = allocator
+        self.interval = interval
+        self.on_batch = on_batch
+        self.logger = logger
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name='overstay', daemon=True)
+            self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+
+    def _run(self):
+        conn = get_db_connection(self.database)
+        try:
+            # jittered, so several workers running their own scheduler don't sweep in lockstep
+            while not self._stop.wait(self.interval * random.uniform(0.8, 1.2)):
+                try:
+                    released = release_overstays(conn, self.allocator, on_batch=self.on_batch)
+                except DatabaseError as e:
+                    if self.logger:
+                        self.logger.warning('Overstay sweep failed: %s', e)
+                    continue
+                except Exception:
+                    # anything else is a bug, but the thread is the only sweeper this process has
+                    if self.logger:
+                        self.logger.exception('Overstay sweep failed')
+                    continue
+                if released and self.logger:
+                    self.logger.info('Released %d overstayed reservations', len(released))
+        finally:
+            conn.close()
+
+
+_schedulers = {}
+_schedulers_lock = threading.Lock()
+
+def start_overstay_scheduler(database, allocator, interval=OVERSTAY_CHECK_SECONDS, on_batch=None, logger=None):
+    """Starts this process's overstay scheduler for a database file, once."""
+    with _schedulers_lock:
+        if database not in _schedulers:
+            _schedulers[database] = OverstayScheduler(database, allocator, interval, on_batch, logger).start()
+        return _schedulers[database]
@@ -0,0 +1,109 @@
+import collections
+import functools
+import threading
+import time
+
+from werkzeug.security import generate_password_hash
+
+# Password hashing settings and the login throttle.
+#
+# PASSWORD_HASH_METHOD is any Werkzeug method string, e.g. 'scrypt:16384:8:1' or
+# 'pbkdf2:sha256:600000'. Hashes made with other settings still verify; login
+# rewrites them with the current ones (see needs_rehash).
+#
+# LoginThrottle counts failed logins per username and per client IP over a sliding
+# window. Once either is over its limit, login answers 429 before looking the user
+# up or hashing anything, so a credential-stuffing burst costs almost no CPU.
+
+DEFAULT_HASH_METHOD = 'scrypt'  # Werkzeug's default, scrypt:32768:8:1
+LOGIN_WINDOW_SECONDS = 300
+LOGIN_MAX_FAILURES_PER_USER = 5
+LOGIN_MAX_FAILURES_PER_IP = 20
+THROTTLE_MAX_KEYS = 100000
+
+@functools.lru_cache(maxsize=8)
+def method_prefix(method):
+    """The method part Werkzeug writes in front of hashes made with method, defaults filled in.
+
+    Raises ValueError for a method Werkzeug doesn't know, so a bad setting fails at startup.
+    """
+    return generate_password_hash('', method=method).split('$', 1)[0]
+
+def hash_password(password, method=DEFAULT_HASH_METHOD):
+    return generate_password_hash(password, method=method)
+
+def needs_rehash(password_hash, method=DEFAULT_HASH_METHOD):
+    """True when a stored hash was made with different settings than method."""
+    return password_hash.split('$', 1)[0] != method_prefix(method)
+
+
+class LoginThrottle:
+    """Sliding-window count of failed logins per username and per IP address."""
+
+    def __init__(self, window=LOGIN_WINDOW_SECONDS, per_user=LOGIN_MAX_FAILURES_PER_USER,
+                 per_ip=LOGIN_MAX_FAILURES_PER_IP, max_keys=THROTTLE_MAX_KEYS):
+        self.window = window
+        self.limits = {'user': per_user, 'ip': per_ip}
+        self.max_keys = max_keys
+        self._failures = {}  # (kind, value) -> deque of failure times, oldest first
+        self._lock = threading.Lock()
+        self.rejected = 0
+
+    def _recent(self, key, now):
+        failures = self._failures.get(key)
+        if failures is None:
+            return None
+        while failures and failures[0] <= now - self.window:
+            failures.popleft()
+        if not failures:
+            del self._failures[key]
+            return None
+        return failures
+
+    def retry_after(self, username, ip):
+        """Seconds until a login for username from ip may be tried again; 0 when it's allowed now."""
+        now = time.monotonic()
+        wait = 0.0
+        with self._lock:
+            for kind, value in (('user', username), ('ip', ip)):
+                failures = self._recent((kind, value), now)
+                if failures is not None and len(failures) >= self.limits[kind]:
+                    wait = max(wait, failures[-self.limits[kind]] + self.window - now)
+            if wait:
+                self.rejected += 1
+        return wait
+
+    def failed(self, username, ip):
+        now = time.monotonic()
+        with self._lock:
+            for key in (('user', username), ('ip', ip)):
+                failures = self._failures.pop(key, None) or collections.deque()
+                failures.append(now)
+                self._failures[key] = failures  # re-inserted, so dict order is least recently failed first
+                if len(failures) > self.limits[key[0]]:
+                    failures.popleft()  # only the last `limit` failures matter for retry_after
+            if len(self._failures) > self.max_keys:
+                self._evict(now)
+
+    def succeeded(self, username):
+        with self._lock:
+            self._failures.pop(('user', username), None)
+
+    def _evict(self, now):
+        for key in list(self._failures):
+            self._recent(key, now)
+        # still too many live keys (a very wide attack): forget the least recently failed ones
+        while len(self._failures) > self.max_keys:
+            del self._failures[next(iter(self._failures))]
+
+
+_throttles = {}
+_throttles_lock = threading.Lock()
+
+def get_login_throttle(database, window=LOGIN_WINDOW_SECONDS, per_user=LOGIN_MAX_FAILURES_PER_USER,
+                       per_ip=LOGIN_MAX_FAILURES_PER_IP):
+    """Returns the process-wide login throttle for a database file."""
+    with _throttles_lock:
+        if database not in _throttles:
+            _throttles[database] = LoginThrottle(window, per_user, per_ip)
+        return _throttles[database]
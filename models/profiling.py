@@ -0,0 +1,203 @@
+import re
+import sqlite3
+import threading
+import time
+
+from flask import current_app, request
+
+# Query profiling, off unless QUERY_PROFILING is set. When it's on, get_db_connection
+# builds connections with ProfiledConnection, whose cursors time every statement
+# (execute plus the fetches that step through its rows) and count the rows returned.
+# Statements run while a request is being handled are collected per request;
+# at teardown they're folded into process-wide per-route and per-statement totals
+# (served by /metrics in Prometheus text format), and any statement slower than
+# SLOW_QUERY_MS is logged with its EXPLAIN QUERY PLAN.
+# When it's off nothing here is installed: plain sqlite3 connections and no hooks.
+
+SLOW_QUERY_MS = 100.0
+REQUEST_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+
+enabled = False
+_local = threading.local()
+
+
+class _Record:
+    __slots__ = ('sql', 'params', 'conn', 'seconds', 'rows')
+
+    def __init__(self, sql, params, conn, seconds, rows):
+        self.sql, self.params, self.conn, self.seconds, self.rows = sql, params, conn, seconds, rows
+
+
+class ProfiledCursor(sqlite3.Cursor):
+    _record = None
+
+    def _track(self, sql, params, conn, started, rows=0):
+        records = getattr(_local, 'records', None)
+        if records is not None:
+            self._record = _Record(sql, params, conn, time.perf_counter() - started, rows)
+            records.append(self._record)
+
+    def _fetched(self, started, rows):
+        if self._record is not None:
+            self._record.seconds += time.perf_counter() - started
+            self._record.rows += rows
+
+    def execute(self, sql, parameters=()):
+        started = time.perf_counter()
+        super().execute(sql, parameters)
+        self._track(sql, parameters, self.connection, started)
+        return self
+
+    def executemany(self, sql, seq_of_parameters):
+        started = time.perf_counter()
+        super().executemany(sql, seq_of_parameters)
+        self._track(sql, None, self.connection, started, max(self.rowcount, 0))
+        return self
+
+    def fetchone(self):
+        started = time.perf_counter()
+        row = super().fetchone()
+        self._fetched(started, row is not None)
+        return row
+
+    def fetchmany(self, size=None):
+        started = time.perf_counter()
+        rows = super().fetchmany(self.arraysize if size is None else size)
+        self._fetched(started, len(rows))
+        return rows
+
+    def fetchall(self):
+        started = time.perf_counter()
+        rows = super().fetchall()
+        self._fetched(started, len(rows))
+        return rows
+
+    def __next__(self):
+        started = time.perf_counter()
+        row = super().__next__()  # StopIteration passes straight through
+        self._fetched(started, 1)
+        return row
+
+
+class ProfiledConnection(sqlite3.Connection):
+    """sqlite3 connection whose execute shortcuts go through ProfiledCursor."""
+
+    def cursor(self, factory=ProfiledCursor):
+        return super().cursor(factory)
+
+    def execute(self, sql, parameters=()):
+        return self.cursor().execute(sql, parameters)
+
+    def executemany(self, sql, seq_of_parameters):
+        return self.cursor().executemany(sql, seq_of_parameters)
+
+
+def normalize(sql):
+    """Statement text as a metric label: whitespace collapsed, IN (?, ?, ...) lists folded."""
+    sql = ' '.join(sql.split())
+    return re.sub(r'\?(?:\s*,\s*\?)+', '?, ...', sql)
+
+
+class QueryStats:
+    """Process-wide totals per route and per statement."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.routes = {}      # route -> [requests, seconds, buckets, queries, query seconds, rows]
+        self.statements = {}  # sql -> [calls, seconds, rows]
+
+    def add_request(self, route, seconds, records):
+        query_seconds = sum(r.seconds for r in records)
+        rows = sum(r.rows for r in records)
+        with self._lock:
+            stats = self.routes.setdefault(route, [0, 0.0, [0] * len(REQUEST_BUCKETS), 0, 0.0, 0])
+            stats[0] += 1
+            stats[1] += seconds
+            for i, bound in enumerate(REQUEST_BUCKETS):
+                if seconds <= bound:
+                    stats[2][i] += 1
+            stats[3] += len(records)
+            stats[4] += query_seconds
+            stats[5] += rows
+            for r in records:
+                statement = self.statements.setdefault(normalize(r.sql), [0, 0.0, 0])
+                statement[0] += 1
+                statement[1] += r.seconds
+                statement[2] += r.rows
+
+    def render(self):
+        """The totals in Prometheus text exposition format."""
+        def label(value):
+            return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+        with self._lock:
+            routes = {k: (v[0], v[1], list(v[2]), v[3], v[4], v[5]) for k, v in self.routes.items()}
+            statements = {k: tuple(v) for k, v in self.statements.items()}
+
+        lines = ['# HELP parking_request_duration_seconds Time spent handling requests, by route.',
+                 '# TYPE parking_request_duration_seconds histogram']
+        for route, (count, seconds, buckets, *_) in sorted(routes.items()):
+            for bound, hits in zip(REQUEST_BUCKETS, buckets):
+                lines.append(f'parking_request_duration_seconds_bucket{{route="{label(route)}",le="{bound}"}} {hits}')
+            lines.append(f'parking_request_duration_seconds_bucket{{route="{label(route)}",le="+Inf"}} {count}')
+            lines.append(f'parking_request_duration_seconds_sum{{route="{label(route)}"}} {seconds:.6f}')
+            lines.append(f'parking_request_duration_seconds_count{{route="{label(route)}"}} {count}')
+
+        per_route = (('parking_route_queries_total', 'SQL statements run, by route.', 3, '{}'),
+                     ('parking_route_query_seconds_total', 'Time spent in SQL statements, by route.', 4, '{:.6f}'),
+                     ('parking_route_rows_total', 'Rows returned or changed by SQL statements, by route.', 5, '{}'))
+        for name, help_text, index, fmt in per_route:
+            lines += [f'# HELP {name} {help_text}', f'# TYPE {name} counter']
+            for route, stats in sorted(routes.items()):
+                lines.append(f'{name}{{route="{label(route)}"}} {fmt.format(stats[index])}')
+
+        per_statement = (('parking_statement_calls_total', 'Executions, by statement.', 0, '{}'),
+                         ('parking_statement_seconds_total', 'Time spent, by statement.', 1, '{:.6f}'),
+                         ('parking_statement_rows_total', 'Rows returned or changed, by statement.', 2, '{}'))
+        for name, help_text, index, fmt in per_statement:
+            lines += [f'# HELP {name} {help_text}', f'# TYPE {name} counter']
+            for sql, stats in sorted(statements.items()):
+                lines.append(f'{name}{{statement="{label(sql)}"}} {fmt.format(stats[index])}')
+        return '\n'.join(lines) + '\n'
+
+
+stats = QueryStats()
+
+
+def _explain(record):
+    """EXPLAIN QUERY PLAN lines for a recorded statement, or '' when it can't be explained."""
+    if record.params is None:
+        return ''  # executemany: the parameters were consumed
+    try:
+        plan = record.conn.execute('EXPLAIN QUERY PLAN ' + record.sql, record.params).fetchall()
+    except sqlite3.Error:
+        return ''
+    return ''.join(f'\n    {row[3]}' for row in plan)
+
+def _start_request():
+    _local.records = []
+    _local.started = time.perf_counter()
+
+def _finish_request(exc=None):
+    records = getattr(_local, 'records', None)
+    if records is None:
+        return
+    _local.records = None  # stop collecting before running the EXPLAINs below
+    seconds = time.perf_counter() - _local.started
+    stats.add_request(request.endpoint or 'unknown', seconds, records)
+
+    threshold = current_app.config['SLOW_QUERY_MS'] / 1000
+    for record in records:
+        if record.seconds >= threshold:
+            current_app.logger.warning('Slow query (%.1f ms, %d rows) in %s: %s%s', record.seconds * 1000,
+                                       record.rows, request.endpoint, normalize(record.sql), _explain(record))
+
+def init_app(app):
+    """Switches profiling on when app.config['QUERY_PROFILING'] is set; otherwise installs nothing."""
+    global enabled
+    if not app.config.get('QUERY_PROFILING'):
+        return
+    enabled = True
+    app.config.setdefault('SLOW_QUERY_MS', SLOW_QUERY_MS)
+    app.before_request(_start_request)
+    app.teardown_request(_finish_request)
@@ -0,0 +1,109 @@
+import string
+
+from models.timefmt import now_epoch
+
+# Free spots with an advance slot still ahead of them are never removed: deleting the
+# spot would cascade the booking away.
+REMOVABLE_SPOT = """
+    lot_id = ? AND status = 'Available' AND NOT EXISTS (
+        SELECT 1 FROM spot_slots s WHERE s.spot_id = parking_spots.id AND s.status = 'booked' AND s.end_ts > ?)
+"""
+
+# Bulk creation of parking_spots rows. Spot names come from a template so
+# multi-storey lots can be laid out as levels and rows, e.g. 'L{level}-{row_letter}{slot}'.
+# Available fields:
+#   {n}           running number of the spot within the lot, starting at 1
+#   {level}       1-based level, when spots_per_level is set
+#   {row}         1-based row within the level, when spots_per_row is set
+#   {row_letter}  the row as A, B, ... Z, AA, AB, ...
+#   {slot}        1-based position within the row
+
+DEFAULT_SPOT_TEMPLATE = 'S{n}'
+TEMPLATE_FIELDS = {'n', 'level', 'row', 'row_letter', 'slot'}
+
+def _row_letter(row):
+    letters = ''
+    while row > 0:
+        row, rem = divmod(row - 1, 26)
+        letters = string.ascii_uppercase[rem] + letters
+    return letters
+
+def spot_name(n, template=DEFAULT_SPOT_TEMPLATE, spots_per_level=None, spots_per_row=None):
+    index = n - 1
+    level, in_level = divmod(index, spots_per_level) if spots_per_level else (0, index)
+    row, slot = divmod(in_level, spots_per_row) if spots_per_row else (0, in_level)
+    return template.format(n=n, level=level + 1, row=row + 1, row_letter=_row_letter(row + 1), slot=slot + 1)
+
+def iter_spot_rows(lot_id, start, count, template=DEFAULT_SPOT_TEMPLATE, spots_per_level=None, spots_per_row=None):
+    """Yields (lot_id, spot_number) for spots start .. start + count - 1, ready for executemany."""
+    for n in range(start, start + count):
+        yield lot_id, spot_name(n, template, spots_per_level, spots_per_row)
+
+def validate_layout(template, spots_per_level=None, spots_per_row=None):
+    """Returns an error message for a template that can't give every spot a distinct name, else None."""
+    try:
+        fields = {name for _, name, _, _ in string.Formatter().parse(template) if name is not None}
+    except ValueError:
+        return 'Spot naming template is malformed.'
+    unknown = fields - TEMPLATE_FIELDS
+    if unknown:
+        return f"Unknown field(s) in spot naming template: {', '.join(sorted(unknown))}."
+    if (spots_per_level is not None and spots_per_level <= 0) or (spots_per_row is not None and spots_per_row <= 0):
+        return 'Spots per level and spots per row must be positive.'
+    try:
+        # format specs and conversions ({slot:q}, {n!x}) only fail once a name is actually built
+        spot_name(1, template, spots_per_level, spots_per_row)
+    except (ValueError, KeyError, IndexError):
+        return 'Spot naming template is malformed.'
+    if 'n' in fields:
+        return None
+    # without {n} the name must pin down level, row and slot on its own
+    if 'slot' not in fields:
+        return 'Spot naming template needs {n} or {slot}.'
+    if spots_per_row and not ({'row', 'row_letter'} & fields):
+        return 'Spot naming template needs {row} or {row_letter} when rows are used.'
+    if spots_per_level and 'level' not in fields:
+        return 'Spot naming template needs {level} when levels are used.'
+    return None
+
+def provision_spots(conn, lot_id, start, count, template=DEFAULT_SPOT_TEMPLATE, spots_per_level=None, spots_per_row=None):
+    """Inserts count available spots numbered from start in a single executemany."""
+    conn.executemany(
+        "INSERT INTO parking_spots (lot_id, spot_number, status) VALUES (?, ?, 'Available')",
+        iter_spot_rows(lot_id, start, count, template, spots_per_level, spots_per_row)
+    )
+
+def resize_spots(conn, lot, new_count):
+    """Adds spots to, or removes free spots from the end of, a lot so it has exactly new_count.
+
+    Runs inside the caller's transaction in a fixed number of statements however many
+    spots change. Returns an error message when there aren't enough removable spots
+    (free, with no booked advance slot still to come).
+    """
+    lot_id = lot['id']
+    current = conn.execute('SELECT COUNT(*) FROM parking_spots WHERE lot_id = ?', (lot_id,)).fetchone()[0]
+    if new_count > current:
+        taken = {row[0] for row in conn.execute('SELECT spot_number FROM parking_spots WHERE lot_id = ?', (lot_id,))}
+        rows, n = [], current + 1
+        while len(rows) < new_count - current:
+            name = spot_name(n, lot['spot_name_template'], lot['spots_per_level'], lot['spots_per_row'])
+            if name not in taken:  # renamed or deleted spots can leave gaps and collisions
+                rows.append((lot_id, name))
+            n += 1
+        conn.executemany("INSERT INTO parking_spots (lot_id, spot_number, status) VALUES (?, ?, 'Available')", rows)
+    elif new_count < current:
+        to_remove = current - new_count
+        now = now_epoch()
+        free = conn.execute(f'SELECT COUNT(*) FROM parking_spots WHERE {REMOVABLE_SPOT}', (lot_id, now)).fetchone()[0]
+        if free < to_remove:
+            return (f'Cannot reduce to {new_count} spots: only {free} of the {current} spots are free '
+                    'and have no upcoming advance bookings.')
+        conn.execute(f'''
+            DELETE FROM parking_spots WHERE id IN (
+                SELECT id FROM parking_spots
+                WHERE {REMOVABLE_SPOT}
+                ORDER BY id DESC
+                LIMIT ?
+            )
+        ''', (lot_id, now, to_remove))
+    return None
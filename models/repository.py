@@ -0,0 +1,189 @@
+# Data access for the route functions in app.py: every statement a view runs lives
+# here, next to the other query modules (listings, archive, stats, allocator).
+# Functions take a connection and never commit; the caller owns the transaction.
+
+from models import database
+from models.timefmt import now_epoch
+
+def begin_write(conn):
+    """Starts a write transaction; what that means for the driver is up to the database backend."""
+    database.begin_write(conn)
+
+# users
+
+def get_user(conn, user_id):
+    return conn.execute('SELECT * FROM users WHERE id = ?', (user_id,)).fetchone()
+
+def get_user_by_username(conn, username):
+    return conn.execute('SELECT * FROM users WHERE username = ?', (username,)).fetchone()
+
+def user_exists(conn, username, email):
+    """True when the username or the email is already registered."""
+    return conn.execute('SELECT id FROM users WHERE username = ? OR email = ?', (username, email)).fetchone() is not None
+
+def create_user(conn, username, password_hash, email, role='user'):
+    return database.insert(
+        conn, 'INSERT INTO users (username, password_hash, email, role) VALUES (?, ?, ?, ?)',
+        (username, password_hash, email, role)
+    )
+
+def set_password_hash(conn, user_id, password_hash):
+    conn.execute('UPDATE users SET password_hash = ?, updated_at = CURRENT_TIMESTAMP WHERE id = ?', (password_hash, user_id))
+
+# lots
+
+def get_lot(conn, lot_id):
+    return conn.execute('SELECT * FROM parking_lots WHERE id = ?', (lot_id,)).fetchone()
+
+def update_lot(conn, lot_id, name, address, pin_code, price_per_hour, max_spots, tariff, coordinates=(None, None),
+               max_stay_hours=None):
+    conn.execute('''
+        UPDATE parking_lots
+        SET prime_location_name = ?, address = ?, pin_code = ?, price_per_hour = ?, maximum_number_of_spots = ?,
+            first_hour_price = ?, daily_cap = ?, night_price_per_hour = ?, latitude = ?, longitude = ?,
+            max_stay_hours = ?, updated_at = CURRENT_TIMESTAMP
+        WHERE id = ?
+    ''', (name, address, pin_code, price_per_hour, max_spots,
+          tariff['first_hour_price'], tariff['daily_cap'], tariff['night_price_per_hour'], *coordinates,
+          max_stay_hours, lot_id))
+
+def get_lots(conn, lot_ids):
+    """Lots by id, in the order the ids were given (missing ids are skipped)."""
+    if not lot_ids:
+        return []
+    rows = {row['id']: row for row in conn.execute(
+        f"SELECT * FROM parking_lots WHERE id IN ({','.join('?' * len(lot_ids))})", list(lot_ids)
+    )}
+    return [rows[lot_id] for lot_id in lot_ids if lot_id in rows]
+
+def delete_lot(conn, lot_id):
+    """Deletes a lot; its spots and reservations go with it (ON DELETE CASCADE).
+
+    Returns False, changing nothing, when the lot has active reservations or booked
+    advance slots still to come; call it inside begin_write so that check holds.
+    """
+    if count_active_in_lot(conn, lot_id) > 0 or lot_has_upcoming_slot(conn, lot_id, now_epoch()):
+        return False
+    conn.execute('DELETE FROM parking_lots WHERE id = ?', (lot_id,))
+    return True
+
+def count_active_in_lot(conn, lot_id):
+    return conn.execute('''
+        SELECT COUNT(pr.id)
+        FROM parking_reservations pr
+        JOIN parking_spots ps ON pr.spot_id = ps.id
+        WHERE ps.lot_id = ? AND pr.is_active = 1
+    ''', (lot_id,)).fetchone()[0]
+
+def lot_has_upcoming_slot(conn, lot_id, now):
+    """True when an advance slot is still booked on any spot of the lot."""
+    return conn.execute('''
+        SELECT 1 FROM spot_slots s JOIN parking_spots ps ON s.spot_id = ps.id
+        WHERE ps.lot_id = ? AND s.status = 'booked' AND s.end_ts > ?
+        LIMIT 1
+    ''', (lot_id, now)).fetchone() is not None
+
+def available_lots(conn):
+    """Lots with at least one free spot, by name."""
+    return conn.execute('''
+        SELECT id, prime_location_name, address, pin_code, price_per_hour, maximum_number_of_spots, current_occupied_spots
+        FROM parking_lots
+        WHERE (maximum_number_of_spots - current_occupied_spots) > 0
+        ORDER BY prime_location_name
+    ''').fetchall()
+
+def lot_choices(conn):
+    """Every lot's id, name and pin code, by name (full lots included)."""
+    return conn.execute('SELECT id, prime_location_name, pin_code FROM parking_lots ORDER BY prime_location_name').fetchall()
+
+# spots
+
+def get_spot(conn, spot_id):
+    return conn.execute('SELECT * FROM parking_spots WHERE id = ?', (spot_id,)).fetchone()
+
+def lot_spots(conn, lot_id):
+    return conn.execute('SELECT * FROM parking_spots WHERE lot_id = ? ORDER BY id', (lot_id,)).fetchall()
+
+def spot_page(conn, lot_id, after=0, limit=50):
+    """Spots of a lot by id, keyset paginated. Returns (rows, next cursor or None)."""
+    spots = conn.execute(
+        'SELECT id, spot_number, status FROM parking_spots WHERE lot_id = ? AND id > ? ORDER BY id LIMIT ?',
+        (lot_id, after, limit + 1)
+    ).fetchall()
+    next_cursor = spots[limit - 1]['id'] if len(spots) > limit else None
+    return spots[:limit], next_cursor
+
+def spot_number_taken(conn, lot_id, spot_number):
+    return conn.execute(
+        'SELECT id FROM parking_spots WHERE lot_id = ? AND spot_number = ?', (lot_id, spot_number)
+    ).fetchone() is not None
+
+def spot_has_active_reservation(conn, spot_id):
+    return conn.execute(
+        'SELECT id FROM parking_reservations WHERE spot_id = ? AND is_active = 1', (spot_id,)
+    ).fetchone() is not None
+
+def spot_has_upcoming_slot(conn, spot_id, now):
+    """True when an advance slot is still booked on the spot (it would be cascaded away with it)."""
+    return conn.execute(
+        "SELECT 1 FROM spot_slots WHERE spot_id = ? AND status = 'booked' AND end_ts > ?", (spot_id, now)
+    ).fetchone() is not None
+
+def update_spot(conn, spot_id, spot_number, status):
+    conn.execute(
+        'UPDATE parking_spots SET spot_number = ?, status = ?, updated_at = CURRENT_TIMESTAMP WHERE id = ?',
+        (spot_number, status, spot_id)
+    )
+
+def delete_spot(conn, spot):
+    """Deletes a spot and shrinks its lot's capacity (and occupancy, if the spot was taken) to match.
+
+    Returns False, changing nothing, when the spot has an active reservation or a booked
+    advance slot still to come; call it inside begin_write so that check holds.
+    """
+    if spot_has_active_reservation(conn, spot['id']) or spot_has_upcoming_slot(conn, spot['id'], now_epoch()):
+        return False
+    conn.execute('DELETE FROM parking_spots WHERE id = ?', (spot['id'],))
+    conn.execute('''
+        UPDATE parking_lots
+        SET maximum_number_of_spots = maximum_number_of_spots - 1,
+            current_occupied_spots = current_occupied_spots - ?,
+            updated_at = CURRENT_TIMESTAMP
+        WHERE id = ?
+    ''', (1 if spot['status'] == 'Occupied' else 0, spot['lot_id']))
+    return True
+
+# reservations
+
+def active_reservations(conn, user_id):
+    """A user's active reservations, newest first."""
+    return conn.execute('''
+        SELECT pr.id, ps.lot_id, pl.prime_location_name, ps.spot_number, pr.parking_timestamp
+        FROM parking_reservations pr
+        JOIN parking_spots ps ON pr.spot_id = ps.id
+        JOIN parking_lots pl ON ps.lot_id = pl.id
+        WHERE pr.user_id = ? AND pr.is_active = 1
+        ORDER BY pr.parking_timestamp DESC
+    ''', (user_id,)).fetchall()
+
+def reservation_to_release(conn, reservation_id, user_id):
+    """The user's active reservation with its lot's tariff columns, or None."""
+    return conn.execute('''
+        SELECT pr.id, pr.spot_id, pr.parking_timestamp,
+               pl.price_per_hour, pl.first_hour_price, pl.daily_cap, pl.night_price_per_hour
+        FROM parking_reservations pr
+        JOIN parking_spots ps ON pr.spot_id = ps.id
+        JOIN parking_lots pl ON ps.lot_id = pl.id
+        WHERE pr.id = ? AND pr.user_id = ? AND pr.is_active = 1
+    ''', (reservation_id, user_id)).fetchone()
+
+def upcoming_slots(conn, user_id, now):
+    """A user's booked advance slots that haven't ended, soonest first."""
+    return conn.execute('''
+        SELECT s.id, s.start_ts, s.end_ts, pl.prime_location_name, ps.spot_number
+        FROM spot_slots s
+        JOIN parking_spots ps ON s.spot_id = ps.id
+        JOIN parking_lots pl ON ps.lot_id = pl.id
+        WHERE s.user_id = ? AND s.status = 'booked' AND s.end_ts > ?
+        ORDER BY s.start_ts
+    ''', (user_id, now)).fetchall()
@@ -0,0 +1,231 @@
+import itertools
+import os
+import queue
+import signal
+import sys
+import threading
+import time
+import traceback
+
+from werkzeug.serving import BaseWSGIServer, WSGIRequestHandler
+
+from models.database import backend
+
+# Production launch (flask serve). The parent opens the listening socket, checks the
+# schema once, then forks the workers, which share that socket; each one warms
+# its connection pool and in-process caches before it starts accepting, and
+# answers requests from a fixed pool of threads. The parent only supervises:
+# it replaces workers that die and stops them all on SIGTERM or Ctrl-C.
+#
+# Long-lived responses (the occupancy event stream) call detach_for_stream(): the
+# thread keeps that one connection and the pool starts a replacement, so open
+# dashboards never use up the request threads. Streams are capped per worker, as
+# is the queue of accepted connections waiting for a thread; past either limit
+# the client gets a 503 instead of waiting behind everyone else. Idle keep-alive
+# connections are closed after KEEPALIVE_SECONDS for the same reason.
+#
+# Workers are forked after the app module is imported, so they all share one
+# SECRET_KEY; set it (SECRET_KEY=...) so sessions also survive restarts.
+
+DEFAULT_WORKERS = 2
+DEFAULT_THREADS = 8
+DEFAULT_MAX_STREAMS = 256  # open event streams per worker
+DEFAULT_QUEUED_PER_THREAD = 8  # accepted connections that may wait per request thread
+KEEPALIVE_SECONDS = 5.0
+RESTART_PAUSE_SECONDS = 1.0  # between replacing workers that keep dying
+
+BUSY_RESPONSE = b'HTTP/1.1 503 Service Unavailable\r\nRetry-After: 1\r\nContent-Length: 0\r\nConnection: close\r\n\r\n'
+
+_local = threading.local()
+
+
+class SchemaError(Exception):
+    """Raised at startup when the database is missing or not at the code's schema version."""
+
+
+def check_schema(database):
+    """Reads the schema version without writing anything; raises SchemaError unless it's current."""
+    version = backend.read_schema_version(database)
+    if version is None:
+        raise SchemaError(f'No database at {database}; run flask init-db first.')
+    if version < backend.latest_version():
+        raise SchemaError(f'Database is at schema version {version}, the code needs {backend.latest_version()}; '
+                          'run flask migrate-db first.')
+    if version > backend.latest_version():
+        raise SchemaError(f'Database is at schema version {version}, newer than this code ({backend.latest_version()}).')
+    return version
+
+
+class RequestHandler(WSGIRequestHandler):
+    """werkzeug's handler, dropping keep-alive connections that sit idle for KEEPALIVE_SECONDS."""
+
+    timeout = KEEPALIVE_SECONDS
+
+    def log_error(self, format, *args):
+        if format.startswith('Request timed out'):
+            return  # an idle keep-alive connection, not an error
+        super().log_error(format, *args)
+
+
+class PooledWSGIServer(BaseWSGIServer):
+    """werkzeug's server with requests handled on a fixed number of pooled threads."""
+
+    multithread = True
+
+    def __init__(self, host, port, app, threads=DEFAULT_THREADS, fd=None, max_streams=DEFAULT_MAX_STREAMS,
+                 max_queued=None):
+        super().__init__(host, port, app, handler=RequestHandler, fd=fd)
+        self._requests = queue.Queue(maxsize=max_queued or threads * DEFAULT_QUEUED_PER_THREAD)
+        self._streams = threading.BoundedSemaphore(max_streams)
+        self._pool = []
+        self._pool_lock = threading.Lock()
+        self._thread_names = itertools.count()
+        for _ in range(threads):
+            self._start_thread()
+
+    def _start_thread(self):
+        thread = threading.Thread(target=self._work, name=f'request-{next(self._thread_names)}', daemon=True)
+        with self._pool_lock:
+            self._pool.append(thread)
+        thread.start()
+
+    def process_request(self, request, client_address):
+        try:
+            self._requests.put_nowait((request, client_address))
+        except queue.Full:
+            self._refuse(request)
+
+    def _refuse(self, request):
+        try:
+            request.sendall(BUSY_RESPONSE)
+        except OSError:
+            pass
+        self.shutdown_request(request)
+
+    def _work(self):
+        _local.server = self
+        while True:
+            item = self._requests.get()
+            if item is None:
+                return
+            request, client_address = item
+            _local.detached = False
+            try:
+                self.finish_request(request, client_address)
+            except Exception:
+                self.handle_error(request, client_address)
+            finally:
+                self.shutdown_request(request)
+            if _local.detached:
+                # a replacement took this thread's place in the pool when the stream began
+                self._streams.release()
+                return
+
+    def detach(self):
+        """Hands the calling request thread over to a long-lived response. False when at the stream limit."""
+        if not self._streams.acquire(blocking=False):
+            return False
+        _local.detached = True
+        with self._pool_lock:
+            self._pool.remove(threading.current_thread())
+        self._start_thread()
+        return True
+
+    def close(self):
+        """Waits for the requests in flight, then closes the socket; open streams end with the process."""
+        with self._pool_lock:
+            pool = list(self._pool)
+        for _ in pool:
+            self._requests.put(None)
+        for thread in pool:
+            thread.join()
+        self.server_close()
+
+
+def detach_for_stream():
+    """Called by a view before returning a response that stays open indefinitely.
+
+    Under flask serve the thread leaves the request pool for the life of the stream;
+    returns False when this worker already has its maximum of streams open. Other
+    servers (flask run, the test client) start a thread per connection anyway, so
+    there it always returns True.
+    """
+    server = getattr(_local, 'server', None)
+    return server.detach() if server is not None else True
+
+
+def _run_worker(app, warm, host, port, threads, fd):
+    def stop(signum, frame):
+        raise KeyboardInterrupt
+    signal.signal(signal.SIGTERM, stop)
+    server = PooledWSGIServer(host, port, app, threads, fd=fd)
+    if fd is not None:
+        # workers share the socket: one that loses the race for a connection must not block in accept
+        server.socket.setblocking(False)
+    warm()
+    app.logger.info('Worker %d ready', os.getpid())
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.close()
+
+
+def serve(app, warm, host='127.0.0.1', port=8000, workers=DEFAULT_WORKERS, threads=DEFAULT_THREADS):
+    """Runs the app on host:port with `workers` forked processes of `threads` threads each.
+
+    warm() is called in every worker before it accepts its first connection.
+    """
+    if workers == 1:
+        _run_worker(app, warm, host, port, threads, None)
+        return
+    if not hasattr(os, 'fork'):
+        raise RuntimeError('More than one worker needs os.fork; use --workers 1 on this platform.')
+
+    listener = BaseWSGIServer(host, port, app)  # binds and listens; the workers accept on its socket
+    fd = listener.fileno()
+    children = set()
+    stopping = False
+
+    def spawn():
+        pid = os.fork()
+        if pid == 0:
+            code = 0
+            try:
+                signal.signal(signal.SIGINT, signal.SIG_IGN)  # the parent relays Ctrl-C as SIGTERM
+                _run_worker(app, warm, host, port, threads, fd)
+            except BaseException:
+                traceback.print_exc()
+                code = 1
+            finally:
+                os._exit(code)
+        children.add(pid)
+
+    def stop(signum, frame):
+        nonlocal stopping
+        stopping = True
+        for pid in children:
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+    for _ in range(workers):
+        spawn()
+    print(f' * Serving on http://{host}:{port} with {workers} workers x {threads} threads', file=sys.stderr)
+
+    while children:
+        try:
+            pid, status = os.wait()
+        except ChildProcessError:
+            break
+        children.discard(pid)
+        if not stopping:
+            app.logger.warning('Worker %d exited (status %d), starting a new one', pid, status)
+            time.sleep(RESTART_PAUSE_SECONDS)
+            if not stopping:
+                spawn()
+    listener.server_close()
@@ -0,0 +1,290 @@
+import bisect
+import threading
+import time
+
+from models.allocator import AllocationError
+from models.database import begin_write, insert
+
+# Advance bookings: a user reserves a spot in a lot for a future [start, end) window
+# (spot_slots, migration 11), then checks in when they arrive, which opens a normal
+# parking reservation on that spot.
+#
+# SlotAllocator keeps, per lot, each spot's booked windows as parallel sorted start
+# and end lists. Windows of one spot never overlap, so whether a spot is free for a
+# window is one bisect, and finding a free spot in a lot costs one bisect per spot, however many slots
+# are booked. The index is loaded per lot on first use, like SpotAllocator's heaps.
+# The insert re-checks the database inside a write transaction, so a stale index (other
+# processes) only causes a reload and never a double booking.
+#
+# A spot that's occupied right now is never offered: a walk-in stay has no end time.
+# In the other direction, walk-in booking skips spots whose next slot starts within
+# SLOT_HOLD_SECONDS (see SpotAllocator.book). A walk-in who parked earlier can still
+# be on the spot at check-in; the booking then moves to another spot of the lot
+# that's free for the rest of its window.
+
+CHECK_IN_EARLY_SECONDS = 15 * 60
+MAX_SLOT_SECONDS = 24 * 3600
+MAX_ADVANCE_SECONDS = 30 * 86400
+
+
+class _LotSlots:
+    __slots__ = ('spot_ids', 'starts', 'ends', 'slot_ids', 'occupied')
+
+    def __init__(self, spot_ids, occupied):
+        self.spot_ids = spot_ids  # by id, which is also the order spots are offered in
+        self.starts = {spot_id: [] for spot_id in spot_ids}
+        self.ends = {spot_id: [] for spot_id in spot_ids}
+        self.slot_ids = {spot_id: [] for spot_id in spot_ids}
+        self.occupied = occupied
+
+    def is_free(self, spot_id, start, end):
+        starts = self.starts[spot_id]
+        i = bisect.bisect_left(starts, end)  # windows before i start before `end`
+        return i == 0 or self.ends[spot_id][i - 1] <= start
+
+    def add(self, spot_id, start, end, slot_id):
+        i = bisect.bisect_left(self.starts[spot_id], start)
+        self.starts[spot_id].insert(i, start)
+        self.ends[spot_id].insert(i, end)
+        self.slot_ids[spot_id].insert(i, slot_id)
+
+    def remove(self, spot_id, slot_id):
+        ids = self.slot_ids.get(spot_id, [])
+        if slot_id in ids:
+            i = ids.index(slot_id)
+            del self.starts[spot_id][i], self.ends[spot_id][i], ids[i]
+
+
+class SlotAllocator:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._lots = {}
+
+    def _load(self, conn, lot_id):
+        spots = conn.execute('SELECT id, status FROM parking_spots WHERE lot_id = ? ORDER BY id', (lot_id,)).fetchall()
+        lot = _LotSlots([row[0] for row in spots], {row[0] for row in spots if row[1] == 'Occupied'})
+        rows = conn.execute('''
+            SELECT s.spot_id, s.start_ts, s.end_ts, s.id
+            FROM spot_slots s JOIN parking_spots ps ON s.spot_id = ps.id
+            WHERE ps.lot_id = ? AND s.status = 'booked' AND s.end_ts > ?
+            ORDER BY s.spot_id, s.start_ts
+        ''', (lot_id, int(time.time())))
+        for spot_id, start, end, slot_id in rows:
+            lot.starts[spot_id].append(start)
+            lot.ends[spot_id].append(end)
+            lot.slot_ids[spot_id].append(slot_id)
+        self._lots[lot_id] = lot
+        return lot
+
+    def _lot(self, conn, lot_id):
+        lot = self._lots.get(lot_id)
+        return lot if lot is not None else self._load(conn, lot_id)
+
+    def invalidate(self, lot_id=None):
+        """Forgets a lot's (or every lot's) index after spots or occupancy changed."""
+        with self._lock:
+            if lot_id is None:
+                self._lots.clear()
+            else:
+                self._lots.pop(lot_id, None)
+
+    def set_occupied(self, lot_id, spot_id, occupied):
+        """Records a walk-in parking on or leaving a spot."""
+        with self._lock:
+            lot = self._lots.get(lot_id)
+            if lot is not None:
+                (lot.occupied.add if occupied else lot.occupied.discard)(spot_id)
+
+    def free_spots(self, conn, lot_id, start, end, limit=None):
+        """Ids of the lot's spots free for the whole [start, end) window, lowest id first."""
+        free = []
+        with self._lock:
+            lot = self._lot(conn, lot_id)
+            for spot_id in lot.spot_ids:
+                if spot_id not in lot.occupied and lot.is_free(spot_id, start, end):
+                    free.append(spot_id)
+                    if len(free) == limit:
+                        break
+        return free
+
+    @staticmethod
+    def check_window(start, end, now=None):
+        """Returns an error message for a window that can't be booked, else None."""
+        now = int(time.time()) if now is None else now
+        if end <= start:
+            return 'The slot must end after it starts.'
+        if start < now - 60:
+            return 'The slot cannot start in the past.'
+        if end - start > MAX_SLOT_SECONDS:
+            return f'A slot can be at most {MAX_SLOT_SECONDS // 3600} hours long.'
+        if start > now + MAX_ADVANCE_SECONDS:
+            return f'Slots can be booked at most {MAX_ADVANCE_SECONDS // 86400} days ahead.'
+        return None
+
+    def reserve(self, conn, lot_id, user_id, start, end):
+        """Books the first spot of the lot that's free for [start, end). Returns (slot_id, spot_id)."""
+        error = self.check_window(start, end)
+        if error:
+            raise AllocationError(error)
+        begin_write(conn)
+        try:
+            if conn.execute(
+                "SELECT 1 FROM spot_slots WHERE user_id = ? AND status = 'booked' AND start_ts < ? AND end_ts > ?",
+                (user_id, end, start)
+            ).fetchone():
+                raise AllocationError('You already have a slot booked that overlaps this time.')
+
+            for attempt in range(2):
+                for spot_id in self.free_spots(conn, lot_id, start, end):
+                    taken = conn.execute('''
+                        SELECT 1 FROM parking_spots ps
+                        WHERE ps.id = ? AND (ps.status != 'Available' OR EXISTS (
+                            SELECT 1 FROM spot_slots s
+                            WHERE s.spot_id = ps.id AND s.status = 'booked' AND s.start_ts < ? AND s.end_ts > ?))
+                    ''', (spot_id, end, start)).fetchone()
+                    if taken:
+                        continue  # the index is behind; reloaded below if nothing else fits
+                    slot_id = insert(
+                        conn, 'INSERT INTO spot_slots (spot_id, user_id, start_ts, end_ts) VALUES (?, ?, ?, ?)',
+                        (spot_id, user_id, start, end)
+                    )
+                    conn.commit()
+                    with self._lock:
+                        lot = self._lots.get(lot_id)
+                        if lot is not None:
+                            lot.add(spot_id, start, end, slot_id)
+                    return slot_id, spot_id
+                self.invalidate(lot_id)
+            raise AllocationError('No spot in this parking lot is free for that whole time.')
+        except BaseException:
+            conn.rollback()
+            raise
+
+    def cancel(self, conn, slot_id, user_id):
+        """Cancels a booked slot of the user. Returns the lot id."""
+        row = conn.execute('''
+            SELECT s.spot_id, ps.lot_id FROM spot_slots s JOIN parking_spots ps ON s.spot_id = ps.id
+            WHERE s.id = ? AND s.user_id = ? AND s.status = 'booked'
+        ''', (slot_id, user_id)).fetchone()
+        if row is None:
+            raise AllocationError('Booked slot not found.')
+        conn.execute("UPDATE spot_slots SET status = 'cancelled' WHERE id = ?", (slot_id,))
+        conn.commit()
+        with self._lock:
+            lot = self._lots.get(row[1])
+            if lot is not None:
+                lot.remove(row[0], slot_id)
+        return row[1]
+
+    def check_in(self, conn, slot_id, user_id):
+        """Turns a booked slot into an active reservation on its spot. Returns (reservation_id, spot_id, lot_id)."""
+        now = int(time.time())
+        begin_write(conn)
+        try:
+            slot = conn.execute('''
+                SELECT s.spot_id, s.start_ts, s.end_ts, ps.lot_id FROM spot_slots s
+                JOIN parking_spots ps ON s.spot_id = ps.id
+                WHERE s.id = ? AND s.user_id = ? AND s.status = 'booked'
+            ''', (slot_id, user_id)).fetchone()
+            if slot is None:
+                raise AllocationError('Booked slot not found.')
+            spot_id, start, end, lot_id = slot
+            if now < start - CHECK_IN_EARLY_SECONDS:
+                raise AllocationError(f'Check-in opens {CHECK_IN_EARLY_SECONDS // 60} minutes before the slot starts.')
+            if now >= end:
+                raise AllocationError('This slot has already ended.')
+            if conn.execute(
+                'SELECT 1 FROM parking_reservations WHERE user_id = ? AND is_active = 1', (user_id,)
+            ).fetchone():
+                raise AllocationError('You already have an active parking reservation. Please release it before checking in.')
+            booked_spot = spot_id
+            if conn.execute(
+                "UPDATE parking_spots SET status = 'Occupied', updated_at = CURRENT_TIMESTAMP WHERE id = ? AND status = 'Available'",
+                (spot_id,)
+            ).rowcount != 1:
+                spot_id = self._move_slot(conn, lot_id, slot_id, max(now, start), end)
+            reservation_id = insert(
+                conn, 'INSERT INTO parking_reservations (spot_id, user_id, parking_timestamp, is_active) VALUES (?, ?, ?, 1)',
+                (spot_id, user_id, now)
+            )
+            conn.execute(
+                'UPDATE parking_lots SET current_occupied_spots = current_occupied_spots + 1, updated_at = CURRENT_TIMESTAMP WHERE id = ?',
+                (lot_id,)
+            )
+            conn.execute("UPDATE spot_slots SET status = 'checked_in', reservation_id = ? WHERE id = ?", (reservation_id, slot_id))
+            conn.commit()
+        except BaseException:
+            conn.rollback()
+            raise
+        with self._lock:
+            lot = self._lots.get(lot_id)
+            if lot is not None:
+                lot.remove(booked_spot, slot_id)
+                lot.occupied.add(spot_id)
+        return reservation_id, spot_id, lot_id
+
+    def _move_slot(self, conn, lot_id, slot_id, start, end):
+        """Claims another spot of the lot free for [start, end) and moves the slot onto it. Returns the spot id."""
+        for _ in range(2):
+            for spot_id in self.free_spots(conn, lot_id, start, end):
+                if conn.execute('''
+                    UPDATE parking_spots SET status = 'Occupied', updated_at = CURRENT_TIMESTAMP
+                    WHERE id = ? AND status = 'Available' AND NOT EXISTS (
+                        SELECT 1 FROM spot_slots s
+                        WHERE s.spot_id = parking_spots.id AND s.status = 'booked' AND s.start_ts < ? AND s.end_ts > ?)
+                ''', (spot_id, end, start)).rowcount == 1:
+                    conn.execute('UPDATE spot_slots SET spot_id = ? WHERE id = ?', (spot_id, slot_id))
+                    return spot_id
+            self.invalidate(lot_id)  # the index is behind; reload once
+        raise AllocationError('Your spot is still occupied and no other spot in this lot is free for your slot. '
+                              'Please contact the parking attendant.')
+
+
+_allocators = {}
+_allocators_lock = threading.Lock()
+
+def get_slot_allocator(database):
+    """Returns the process-wide slot allocator for a database file."""
+    with _allocators_lock:
+        if database not in _allocators:
+            _allocators[database] = SlotAllocator()
+        return _allocators[database]
+
+
+def benchmark(lots=100, spots_per_lot=100, slots_per_spot=50, queries=20000, seed=11):
+    """Times free-spot lookups against an index of lots * spots_per_lot * slots_per_spot booked slots.
+
+    Returns lookups per second. Only the in-memory index is measured, no database.
+    """
+    import random
+
+    rng = random.Random(seed)
+    allocator = SlotAllocator()
+    now = int(time.time())
+    spot_id = 0
+    for lot_id in range(1, lots + 1):
+        lot = _LotSlots(list(range(spot_id + 1, spot_id + spots_per_lot + 1)), set())
+        for sid in lot.spot_ids:
+            t = now
+            for n in range(slots_per_spot):
+                t += rng.randint(0, 6) * 3600
+                length = rng.randint(1, 4) * 3600
+                lot.add(sid, t, t + length, n)
+                t += length
+        spot_id += spots_per_lot
+        allocator._lots[lot_id] = lot
+    windows = []
+    for _ in range(queries):
+        start = now + rng.randint(0, 10 * 86400) // 900 * 900
+        windows.append((rng.randint(1, lots), start, start + rng.randint(1, 8) * 1800))
+    started = time.perf_counter()
+    for lot_id, start, end in windows:
+        allocator.free_spots(None, lot_id, start, end, limit=1)
+    return queries / (time.perf_counter() - started)
+
+
+if __name__ == '__main__':
+    import sys
+
+    spots = int(sys.argv[1]) if len(sys.argv) > 1 else 100
+    print(f"{spots} spots per lot, 50 slots per spot: {benchmark(spots_per_lot=spots):,.0f} free-spot lookups/second")
@@ -0,0 +1,33 @@
+import calendar
+import time
+
+# Reads of the pre-aggregated tables kept up to date by the triggers in migration 4.
+# Hour buckets are 'YYYY-MM-DD HH:00:00' UTC text; they're converted here, not in SQL.
+
+HOUR_FORMAT = '%Y-%m-%d %H:00:00'
+
+def get_summary(conn):
+    """Returns the single parking_summary row (lots, spots, occupancy, revenue)."""
+    return conn.execute(
+        'SELECT total_lots, total_spots, occupied_spots, total_revenue FROM parking_summary WHERE id = 1'
+    ).fetchone()
+
+def hourly_series(conn, hours=24):
+    """Revenue, bookings and utilization per hour across all lots for the last `hours` hours (UTC buckets).
+
+    Rows are dicts; hour_epoch is the bucket's start in UTC epoch seconds.
+    """
+    since = time.strftime(HOUR_FORMAT, time.gmtime(time.time() - (hours - 1) * 3600))
+    rows = conn.execute('''
+        SELECT hour,
+               SUM(bookings) AS bookings,
+               SUM(releases) AS releases,
+               SUM(revenue) AS revenue,
+               CASE WHEN SUM(capacity) > 0
+                    THEN ROUND(100.0 * SUM(peak_occupied) / SUM(capacity), 1) END AS utilization
+        FROM lot_hourly_stats
+        WHERE hour >= ?
+        GROUP BY hour
+        ORDER BY hour
+    ''', (since,)).fetchall()
+    return [dict(row, hour_epoch=calendar.timegm(time.strptime(row['hour'], HOUR_FORMAT))) for row in rows]
@@ -0,0 +1,31 @@
+import functools
+import time
+from datetime import datetime
+import pytz
+
+LOCAL_TIMEZONE = pytz.timezone('Asia/Kolkata')
+DISPLAY_FORMAT = '%Y-%m-%d %H:%M:%S'
+
+# Reservation timestamps are stored as integer UTC epoch seconds (migration 8).
+# Display goes through the one formatter below: the zone's offset is looked up once
+# per hour of time and cached, after which each value is integer arithmetic plus
+# a gmtime/strftime.
+
+def now_epoch():
+    return int(time.time())
+
+@functools.lru_cache(maxsize=8192)
+def _local_offset(epoch_hour):
+    return int(datetime.fromtimestamp(epoch_hour * 3600, LOCAL_TIMEZONE).utcoffset().total_seconds())
+
+def format_local_epoch(epoch, fmt=DISPLAY_FORMAT):
+    epoch = int(epoch)
+    return time.strftime(fmt, time.gmtime(epoch + _local_offset(epoch // 3600)))
+
+def parse_local(value, fmt='%Y-%m-%dT%H:%M'):
+    """Local wall-clock text (an <input type="datetime-local"> value by default) to UTC epoch seconds."""
+    return int(LOCAL_TIMEZONE.localize(datetime.strptime(value, fmt)).timestamp())
+
+def format_local(values, placeholder='N/A', fmt=DISPLAY_FORMAT):
+    """Converts a batch of UTC epoch timestamps into local display strings; empty values become the placeholder."""
+    return [format_local_epoch(value, fmt) if value is not None else placeholder for value in values]
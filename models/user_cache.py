@@ -0,0 +1,54 @@
+import threading
+import time
+from collections import OrderedDict
+
+USER_CACHE_SIZE = 1024
+USER_CACHE_TTL = 300  # seconds; bounds staleness when another worker changes a user
+
+class UserCache:
+    """Bounded LRU of user rows keyed by user id, with a per-entry TTL."""
+
+    def __init__(self, maxsize=USER_CACHE_SIZE, ttl=USER_CACHE_TTL):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._entries = OrderedDict()  # user_id -> (expires_at, row)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, user_id):
+        with self._lock:
+            entry = self._entries.get(user_id)
+            if entry is None or entry[0] < time.monotonic():
+                self._entries.pop(user_id, None)
+                self.misses += 1
+                return None
+            self._entries.move_to_end(user_id)
+            self.hits += 1
+            return entry[1]
+
+    def put(self, user_id, row):
+        with self._lock:
+            self._entries[user_id] = (time.monotonic() + self.ttl, row)
+            self._entries.move_to_end(user_id)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, user_id):
+        with self._lock:
+            self._entries.pop(user_id, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+_caches = {}
+_caches_lock = threading.Lock()
+
+def get_user_cache(database, maxsize=USER_CACHE_SIZE, ttl=USER_CACHE_TTL):
+    """Returns the process-wide user cache for a database file."""
+    with _caches_lock:
+        if database not in _caches:
+            _caches[database] = UserCache(maxsize, ttl)
+        return _caches[database]
@@ -0,0 +1,81 @@
+import threading
+import time
+
+VERSION_SYNC_INTERVAL = 1.0  # seconds between checks for changes made by other processes
+
+class ChangeTracker:
+    """In-process mirror of the change sequence and the per-lot/per-user versions from migration 6.
+
+    Readers ask it for versions without touching the database; it refreshes itself at
+    most once per sync interval, or right away after this process has written.
+    """
+
+    def __init__(self, sync_interval=VERSION_SYNC_INTERVAL):
+        self.sync_interval = sync_interval
+        self.seq = None
+        self.lots = {}
+        self.users = {}
+        self._next_sync = 0.0
+        self._lock = threading.Lock()
+
+    def mark_dirty(self):
+        """Forces a resync on the next read; call after committing a write."""
+        self._next_sync = 0.0
+
+    def sync(self, get_conn):
+        """Brings the mirror up to date if it's due. get_conn is only called when a check is needed."""
+        if time.monotonic() < self._next_sync:
+            return
+        with self._lock:
+            if time.monotonic() < self._next_sync:
+                return
+            conn = get_conn()
+            seq = conn.execute('SELECT seq FROM change_seq WHERE id = 1').fetchone()[0]
+            if seq != self.seq:
+                if self.seq is None or seq < self.seq:
+                    # first sync, or the database was re-initialized underneath us
+                    self.lots = dict(conn.execute('SELECT id, version FROM parking_lots').fetchall())
+                    self.users = {}
+                else:
+                    self.lots.update(conn.execute(
+                        'SELECT id, version FROM parking_lots WHERE version > ?', (self.seq,)
+                    ).fetchall())
+                    self.users.update(conn.execute(
+                        'SELECT id, version FROM users WHERE version > ?', (self.seq,)
+                    ).fetchall())
+                    if conn.execute('SELECT COUNT(*) FROM parking_lots').fetchone()[0] != len(self.lots):
+                        # a lot was deleted; deletions leave no version behind to pick up
+                        self.lots = dict(conn.execute('SELECT id, version FROM parking_lots').fetchall())
+                self.seq = seq
+            self._next_sync = time.monotonic() + self.sync_interval
+
+    def lot_version(self, lot_id):
+        return self.lots.get(lot_id)
+
+    def user_version(self, user_id, get_conn):
+        """The user's version, or None if there's no such user.
+
+        Users whose reservations haven't changed since this process started aren't in the
+        mirror yet; their stored version is read once and then kept current by sync().
+        """
+        version = self.users.get(user_id)
+        if version is not None:
+            return version
+        with self._lock:
+            if user_id not in self.users:
+                row = get_conn().execute('SELECT version FROM users WHERE id = ?', (user_id,)).fetchone()
+                if row is None:
+                    return None
+                self.users[user_id] = row[0]
+            return self.users[user_id]
+
+
+_trackers = {}
+_trackers_lock = threading.Lock()
+
+def get_change_tracker(database):
+    """Returns the process-wide change tracker for a database file."""
+    with _trackers_lock:
+        if database not in _trackers:
+            _trackers[database] = ChangeTracker()
+        return _trackers[database]